@@ -0,0 +1,241 @@
+"""
+Retrieval quality against latency for HNSW ef_search values.
+
+Every query is searched with the HNSW index at each ef_search value and
+compared with exact nearest neighbours computed in NumPy (recall@k) and,
+when the dataset labels them, with the files that answer it (hit rate):
+
+    uv run -m benchmarks.evaluate --project my-project --dataset questions.jsonl
+    uv run -m benchmarks.evaluate --synthetic-files 2000
+
+Datasets are JSON lines of {"query": "...", "files": ["path/relative/to/root"]}.
+Synthetic runs index a generated repository with fake embeddings and label
+each query with the file defining the function it asks about.
+"""
+
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+from src.agent.llm import LLMService
+from src.consts.vectors import VECTOR_DISTANCE_METRIC
+from src.database.backends import backend
+from src.database.pgvector import get_db
+from src.vectors.indexer import CodebaseIndexer
+from src.vectors.vector_store import VectorStore
+from benchmarks.exact import ExactSearch
+from benchmarks.fakes import BenchmarkLLMService
+from benchmarks.synthetic import SyntheticRepo
+from benchmarks.run import (
+    PROJECT_NAME,
+    bench_index,
+    environment,
+    latency_summary,
+    recall_at_k,
+    reset_project,
+)
+
+
+def load_dataset(path: str) -> List[Dict[str, Any]]:
+    """
+    Read a labeled dataset.
+
+    Args:
+        path: JSON lines file of {"query", "files"} objects. A single
+            "file_path" is accepted instead of "files", and both are optional.
+
+    Returns:
+        List of {"query", "files"} dictionaries
+    """
+    dataset = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            files = item.get("files") or (
+                [item["file_path"]] if item.get("file_path") else []
+            )
+            dataset.append({"query": item["query"], "files": files})
+    return dataset
+
+
+def hit(files: List[str], labeled: List[str]) -> Optional[bool]:
+    """Whether any labeled file was retrieved, None for unlabeled queries"""
+    if not labeled:
+        return None
+    return bool(set(files) & set(labeled))
+
+
+def rate(values: List[Optional[bool]]) -> Optional[float]:
+    labeled = [value for value in values if value is not None]
+    return float(np.mean(labeled)) if labeled else None
+
+
+def evaluate(
+    vector_store: VectorStore,
+    project_name: str,
+    dataset: List[Dict[str, Any]],
+    k: int,
+    ef_values: List[int],
+) -> Dict[str, Any]:
+    """
+    Measure recall@k, hit rate and search latency for each ef_search value.
+
+    Args:
+        vector_store: Vector store to search with
+        project_name: Name of an indexed project
+        dataset: Queries with their labeled files
+        k: Number of chunks retrieved per query
+        ef_values: HNSW ef_search values to try
+
+    Returns:
+        Dictionary with the exact search baseline and one entry per ef_search
+    """
+    # Embed once, so only the search itself is timed
+    embeddings = vector_store.llm_service.generate_embeddings(
+        [item["query"] for item in dataset]
+    )
+
+    with get_db() as db:
+        exact = ExactSearch(db, project_name)
+
+    exact_ids = [exact.search(embedding, k) for embedding in embeddings]
+    exact_hits = [
+        hit(exact.search_files(embedding, k), item["files"])
+        for embedding, item in zip(embeddings, dataset)
+    ]
+
+    def search(db, embedding: np.ndarray, ef_search: int):
+        db.rollback()
+        return vector_store.search_vectors(
+            db, project_name, embedding, limit=k, ef_search=ef_search
+        )
+
+    sweep = []
+    with get_db() as db:
+        # Warm the index and table pages up before timing anything
+        for embedding in embeddings:
+            search(db, embedding, max(ef_values))
+
+        for ef_search in ef_values:
+            latencies, recalls, hits = [], [], []
+            for embedding, expected, item in zip(embeddings, exact_ids, dataset):
+                start = time.perf_counter()
+                chunks, files = search(db, embedding, ef_search)
+                latencies.append(time.perf_counter() - start)
+
+                recalls.append(recall_at_k(expected, [chunk["id"] for chunk in chunks]))
+                hits.append(hit([file["file_path"] for file in files], item["files"]))
+
+            sweep.append(
+                {
+                    "ef_search": ef_search,
+                    "recall_at_k": float(np.mean(recalls)),
+                    "hit_rate": rate(hits),
+                    "latency": latency_summary(latencies),
+                }
+            )
+
+    return {
+        "queries": len(dataset),
+        "k": k,
+        "metric": VECTOR_DISTANCE_METRIC,
+        "chunks": len(exact.ids),
+        "exact_hit_rate": rate(exact_hits),
+        "ef_search": sweep,
+    }
+
+
+def recommend(sweep: List[Dict[str, Any]], target_recall: float) -> Optional[int]:
+    """The fastest ef_search by p95 latency that reaches the target recall"""
+    acceptable = [entry for entry in sweep if entry["recall_at_k"] >= target_recall]
+    if not acceptable:
+        return None
+    return min(acceptable, key=lambda entry: entry["latency"]["p95_ms"])["ef_search"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--project", help="Name of an indexed project")
+    parser.add_argument("--dataset", help="JSON lines of labeled queries")
+    parser.add_argument(
+        "--synthetic-files",
+        type=int,
+        default=0,
+        help="Index a synthetic repository of this many files instead",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ef-search", default="10,20,40,80,160,320")
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--output", help="Path of the JSON results file")
+    args = parser.parse_args()
+
+    if not args.synthetic_files and not (args.project and args.dataset):
+        parser.error("Either --project and --dataset, or --synthetic-files")
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    ef_values = [int(value) for value in args.ef_search.split(",")]
+    repo_dir = None
+
+    try:
+        if args.synthetic_files:
+            backend.init_db()
+            vector_store = VectorStore(BenchmarkLLMService())
+
+            repo_dir = tempfile.mkdtemp(prefix="nvim-llama-eval-")
+            repo = SyntheticRepo(repo_dir, args.synthetic_files, args.seed)
+            repo.generate()
+
+            project_name = PROJECT_NAME
+            reset_project(project_name)
+            bench_index(CodebaseIndexer(vector_store), repo)
+
+            dataset = [
+                {"query": item["query"], "files": [item["file_path"]]}
+                for item in repo.queries(args.queries, args.seed)
+            ]
+            if args.dataset:
+                dataset = load_dataset(args.dataset)
+        else:
+            vector_store = VectorStore(LLMService())
+            project_name = args.project
+            dataset = load_dataset(args.dataset)
+
+        result = evaluate(vector_store, project_name, dataset, args.k, ef_values)
+        result["recommended_ef_search"] = recommend(
+            result["ef_search"], args.target_recall
+        )
+
+    finally:
+        if repo_dir:
+            shutil.rmtree(repo_dir, ignore_errors=True)
+            reset_project(PROJECT_NAME)
+
+    output = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "parameters": vars(args),
+        "environment": environment(),
+        "evaluation": result,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
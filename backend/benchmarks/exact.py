@@ -0,0 +1,57 @@
+import numpy as np
+from typing import List
+from sqlalchemy.orm import Session
+
+from src.consts.vectors import VECTOR_DISTANCE_METRIC
+from src.database.backends import backend
+from src.database.pgvector import Project
+from src.vectors.flat_index import distances, load_project_index
+
+
+class ExactSearch:
+    """
+    Brute-force nearest neighbours over every chunk stored for a project,
+    the ground truth that approximate HNSW results are measured against.
+    """
+
+    def __init__(
+        self, db: Session, project_name: str, metric: str = VECTOR_DISTANCE_METRIC
+    ):
+        project = db.query(Project).filter(Project.name == project_name).one()
+        index = load_project_index(db, project, backend)
+
+        self.metric = metric
+        self.ids = index.ids
+        self.file_paths = [chunk[3] for chunk in index.chunks]
+        self.matrix = index.matrix
+        self.norms = index.norms
+
+    def distances(self, query_embedding: np.ndarray) -> np.ndarray:
+        return distances(self.matrix, self.norms, query_embedding, self.metric)
+
+    def search(self, query_embedding: np.ndarray, k: int) -> List[int]:
+        """
+        Find the k nearest chunks.
+
+        Args:
+            query_embedding: Embedding to search for
+            k: Number of neighbours
+
+        Returns:
+            Chunk IDs, nearest first
+        """
+        return self.ids[self._nearest(query_embedding, k)].tolist()
+
+    def search_files(self, query_embedding: np.ndarray, k: int) -> List[str]:
+        """Files of the k nearest chunks, nearest first and without duplicates"""
+        nearest = self._nearest(query_embedding, k)
+        return list(dict.fromkeys(self.file_paths[i] for i in nearest))
+
+    def _nearest(self, query_embedding: np.ndarray, k: int) -> np.ndarray:
+        if not len(self.ids):
+            return np.array([], dtype=int)
+
+        distances = self.distances(query_embedding)
+        k = min(k, len(distances))
+        nearest = np.argpartition(distances, k - 1)[:k]
+        return nearest[np.argsort(distances[nearest])]
@@ -0,0 +1,66 @@
+import re
+import time
+import zlib
+import numpy as np
+from typing import Dict, List
+
+from src.agent.llm import LLMService
+from src.consts.vectors import VECTOR_DIMS
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d+")
+
+
+class FakeEmbeddings:
+    """
+    Deterministic stand-in for a provider embedding model.
+
+    Texts are embedded as the normalized sum of a fixed random vector per
+    token, so texts sharing identifiers land close together and retrieval
+    quality can be measured without calling a provider.
+    """
+
+    def __init__(self, dims: int = VECTOR_DIMS, latency: float = 0.0):
+        self.dims = dims
+        self.latency = latency
+        self._token_vectors: Dict[str, np.ndarray] = {}
+
+    def embed_documents(self, texts: List[str], **kwargs) -> List[List[float]]:
+        # Simulate the provider round trip
+        if self.latency:
+            time.sleep(self.latency)
+
+        return [self._embed(text).tolist() for text in texts]
+
+    def embed_query(self, text: str, **kwargs) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dims, dtype=np.float32)
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            vector += self._token_vector(token)
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _token_vector(self, token: str) -> np.ndarray:
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            rng = np.random.default_rng(zlib.crc32(token.encode()))
+            vector = rng.standard_normal(self.dims).astype(np.float32)
+            self._token_vectors[token] = vector
+        return vector
+
+
+class BenchmarkLLMService(LLMService):
+    """LLMService that embeds with FakeEmbeddings and has no chat model"""
+
+    def __init__(self, embedding_latency: float = 0.0):
+        self.embedding_latency = embedding_latency
+        super().__init__()
+
+    def _initialize_llm(self):
+        return None
+
+    def _initialize_embedding_model(self):
+        self.embedding_model_name = "fake"
+        return FakeEmbeddings(self.embedding_dims, latency=self.embedding_latency)
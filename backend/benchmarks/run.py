@@ -0,0 +1,320 @@
+"""
+Benchmarks for indexing and retrieval.
+
+Runs against the database in DATABASE_URL (see `just bench-setup`) with a
+synthetic repository and deterministic fake embeddings, and writes the
+results as JSON so they can be compared across commits:
+
+    uv run -m benchmarks.run --files 2000 --output results.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+from loguru import logger
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+
+from src.database.backends import backend
+from src.database.pgvector import get_db, Project
+from src.vectors.indexer import CodebaseIndexer
+from src.vectors.vector_store import VectorStore
+from src.vectors.walker import walk_files
+from benchmarks.exact import ExactSearch
+from benchmarks.fakes import BenchmarkLLMService
+from benchmarks.synthetic import SyntheticRepo
+
+PROJECT_NAME = "bench-synthetic"
+FILE_EXTENSIONS = [".py", ".js", ".go", ".lua"]
+EXCLUDE_PATTERNS = ["node_modules", ".git"]
+SCENARIOS = ["walk", "chunking", "cold_index", "incremental_reindex", "concurrent_chat"]
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def reset_project(project_name: str) -> None:
+    """Delete everything stored for the benchmark project, and nothing else"""
+    with get_db() as db:
+        for statement in (
+            "DELETE FROM code_symbols WHERE project_id IN "
+            "(SELECT id FROM projects WHERE name = :name)",
+            "DELETE FROM code_chunks WHERE project_id IN "
+            "(SELECT id FROM projects WHERE name = :name)",
+            "DELETE FROM code_files WHERE project_id IN "
+            "(SELECT id FROM projects WHERE name = :name)",
+            "DELETE FROM projects WHERE name = :name",
+        ):
+            db.execute(text(statement), {"name": project_name})
+        db.commit()
+
+
+def histogram_totals(name: str) -> Dict[str, float]:
+    """Current sum and count of a Prometheus histogram"""
+    return {
+        "sum": REGISTRY.get_sample_value(f"{name}_sum") or 0.0,
+        "count": REGISTRY.get_sample_value(f"{name}_count") or 0.0,
+    }
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """Percentiles of a list of latencies, in milliseconds"""
+    values = np.array(latencies) * 1000
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+        "max_ms": float(values.max()),
+    }
+
+
+def recall_at_k(exact: List[int], retrieved: List[int]) -> float:
+    """Fraction of the exact nearest neighbours that were retrieved"""
+    if not exact:
+        return 1.0
+    return len(set(exact) & set(retrieved)) / len(exact)
+
+
+def bench_walk(repo: SyntheticRepo) -> Dict[str, Any]:
+    """Time to walk the synthetic repository for files to index"""
+    start = time.perf_counter()
+    files = list(walk_files(repo.root, FILE_EXTENSIONS, EXCLUDE_PATTERNS))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "files": len(files),
+        "seconds": elapsed,
+        "files_per_second": len(files) / elapsed,
+    }
+
+
+def bench_chunking(indexer: CodebaseIndexer, repo: SyntheticRepo) -> Dict[str, Any]:
+    """Throughput of CodebaseIndexer._chunk_file over the synthetic files"""
+    contents = []
+    for path, _ in walk_files(repo.root, FILE_EXTENSIONS, EXCLUDE_PATTERNS):
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            contents.append(f.read())
+
+    start = time.perf_counter()
+    chunks = [chunk for content in contents for chunk in indexer._chunk_file(content)]
+    elapsed = time.perf_counter() - start
+
+    num_bytes = sum(len(content.encode("utf-8")) for content in contents)
+    return {
+        "files": len(contents),
+        "chunks": len(chunks),
+        "bytes": num_bytes,
+        "tokens": sum(chunk["token_count"] for chunk in chunks),
+        "seconds": elapsed,
+        "files_per_second": len(contents) / elapsed,
+        "mb_per_second": num_bytes / elapsed / 1e6,
+    }
+
+
+def bench_index(indexer: CodebaseIndexer, repo: SyntheticRepo) -> Dict[str, Any]:
+    """Index the synthetic repository and report throughput"""
+    db_writes_before = histogram_totals("nvim_llama_index_db_write_seconds")
+
+    start = time.perf_counter()
+    indexer.index_codebase(repo.root, PROJECT_NAME, FILE_EXTENSIONS, EXCLUDE_PATTERNS)
+    elapsed = time.perf_counter() - start
+
+    db_writes_after = histogram_totals("nvim_llama_index_db_write_seconds")
+    db_write_seconds = db_writes_after["sum"] - db_writes_before["sum"]
+    files_written = db_writes_after["count"] - db_writes_before["count"]
+
+    with get_db() as db:
+        project = db.query(Project).filter(Project.name == PROJECT_NAME).one()
+        chunk_count = project.chunk_count
+        file_count = project.file_count
+
+    return {
+        "seconds": elapsed,
+        "files_indexed": file_count,
+        "files_written": files_written,
+        "chunks_stored": chunk_count,
+        "files_per_second": files_written / elapsed if elapsed else 0.0,
+        "db_write_seconds": db_write_seconds,
+        "db_writes_per_second": files_written / db_write_seconds
+        if db_write_seconds
+        else 0.0,
+    }
+
+
+def bench_concurrent_chat(
+    vector_store: VectorStore,
+    repo: SyntheticRepo,
+    num_queries: int,
+    concurrency: int,
+    top_k: int,
+) -> Dict[str, Any]:
+    """
+    Run retrieval queries concurrently, reporting latency, throughput,
+    recall@k against exact nearest neighbours, and how often the file
+    defining the function asked about is retrieved.
+    """
+    queries = repo.queries(num_queries)
+
+    with get_db() as db:
+        exact = ExactSearch(db, PROJECT_NAME)
+
+    def run_query(item: Dict[str, str]) -> Dict[str, Any]:
+        with get_db() as db:
+            start = time.perf_counter()
+            chunks, files = vector_store.query_vectors(
+                db, PROJECT_NAME, item["query"], limit=top_k
+            )
+            latency = time.perf_counter() - start
+
+        query_embedding = vector_store.llm_service.generate_embeddings([item["query"]])[
+            0
+        ]
+
+        return {
+            "latency": latency,
+            "recall": recall_at_k(
+                exact.search(query_embedding, top_k),
+                [chunk["id"] for chunk in chunks],
+            ),
+            "hit": item["file_path"] in {file["file_path"] for file in files},
+        }
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(run_query, queries))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "queries": len(results),
+        "concurrency": concurrency,
+        "top_k": top_k,
+        "queries_per_second": len(results) / elapsed,
+        "latency": latency_summary([result["latency"] for result in results]),
+        "recall_at_k": float(np.mean([result["recall"] for result in results])),
+        "file_hit_rate": float(np.mean([result["hit"] for result in results])),
+    }
+
+
+def environment() -> Dict[str, Any]:
+    """Describe where the benchmark ran, so results can be compared fairly"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        commit = None
+
+    with get_db() as db:
+        postgres = db.execute(text("SHOW server_version")).scalar()
+        pgvector = db.execute(
+            text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        ).scalar()
+
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "postgres": postgres,
+        "pgvector": pgvector,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--modify-fraction", type=float, default=0.05)
+    parser.add_argument(
+        "--embedding-latency-ms",
+        type=float,
+        default=0.0,
+        help="Simulated provider latency per embedding request",
+    )
+    parser.add_argument(
+        "--scenarios", default=",".join(SCENARIOS), help="Comma separated scenarios"
+    )
+    parser.add_argument("--output", help="Path of the JSON results file")
+    args = parser.parse_args()
+
+    scenarios = args.scenarios.split(",")
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    backend.init_db()
+    llm_service = BenchmarkLLMService(args.embedding_latency_ms / 1000)
+    vector_store = VectorStore(llm_service)
+    indexer = CodebaseIndexer(vector_store)
+
+    repo_dir = tempfile.mkdtemp(prefix="nvim-llama-bench-")
+    results: Dict[str, Any] = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "parameters": vars(args),
+        "environment": environment(),
+        "scenarios": {},
+    }
+
+    try:
+        repo = SyntheticRepo(repo_dir, args.files, args.seed)
+        repo.generate()
+
+        if "walk" in scenarios:
+            results["scenarios"]["walk"] = bench_walk(repo)
+
+        if "chunking" in scenarios:
+            results["scenarios"]["chunking"] = bench_chunking(indexer, repo)
+
+        needs_index = {"cold_index", "incremental_reindex", "concurrent_chat"}
+        if needs_index & set(scenarios):
+            reset_project(PROJECT_NAME)
+            cold = bench_index(indexer, repo)
+            if "cold_index" in scenarios:
+                results["scenarios"]["cold_index"] = cold
+
+        if "incremental_reindex" in scenarios:
+            modified = repo.modify(args.modify_fraction)
+            incremental = bench_index(indexer, repo)
+            incremental["files_modified"] = len(modified)
+            results["scenarios"]["incremental_reindex"] = incremental
+
+        if "concurrent_chat" in scenarios:
+            results["scenarios"]["concurrent_chat"] = bench_concurrent_chat(
+                vector_store, repo, args.queries, args.concurrency, args.top_k
+            )
+
+    finally:
+        shutil.rmtree(repo_dir, ignore_errors=True)
+        reset_project(PROJECT_NAME)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        name = (results["environment"]["commit"] or "results")[:12]
+        output = os.path.join(RESULTS_DIR, f"{name}.json")
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(json.dumps(results["scenarios"], indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
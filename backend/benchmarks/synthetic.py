@@ -0,0 +1,144 @@
+import os
+import random
+from typing import Dict, List
+
+# Templates of a function definition per file extension
+FUNCTION_TEMPLATES = {
+    ".py": 'def {name}({args}):\n    """{doc}"""\n{body}\n    return {ret}\n',
+    ".js": "function {name}({args}) {{\n  // {doc}\n{body}\n  return {ret};\n}}\n",
+    ".go": "// {doc}\nfunc {name}({args}) int {{\n{body}\n\treturn {ret}\n}}\n",
+    ".lua": "-- {doc}\nlocal function {name}({args})\n{body}\n  return {ret}\nend\n",
+}
+
+STATEMENT_TEMPLATES = {
+    ".py": "    {a} = {b} + {c}  # {word}",
+    ".js": "  const {a} = {b} + {c}; // {word}",
+    ".go": "\t{a} := {b} + {c} // {word}",
+    ".lua": "  local {a} = {b} + {c} -- {word}",
+}
+
+WORDS = (
+    "parse config buffer window session token cache index query vector chunk "
+    "project file render request response handler stream socket retry queue "
+    "worker schedule embed search rank merge filter scope symbol ignore walk"
+).split()
+
+
+class SyntheticRepo:
+    """
+    Deterministic synthetic source tree for benchmarks.
+
+    The same seed always produces the same files, functions and queries, so
+    results are comparable across commits.
+    """
+
+    def __init__(self, root: str, num_files: int, seed: int = 0):
+        self.root = root
+        self.num_files = num_files
+        self.seed = seed
+        self.functions: List[Dict[str, str]] = []
+
+    def generate(self) -> None:
+        """Write the synthetic files below the root directory"""
+        rng = random.Random(self.seed)
+        extensions = list(FUNCTION_TEMPLATES)
+
+        for i in range(self.num_files):
+            ext = extensions[i % len(extensions)]
+            directory = os.path.join(self.root, f"pkg{i % 17}", f"mod{(i // 17) % 11}")
+            os.makedirs(directory, exist_ok=True)
+
+            rel_path = os.path.relpath(
+                os.path.join(directory, f"file_{i}{ext}"), self.root
+            )
+            with open(os.path.join(self.root, rel_path), "w") as f:
+                f.write(self._file_content(rng, ext, rel_path))
+
+        # Excluded trees the walker should never descend into
+        for excluded in ("node_modules/dep", ".git/objects"):
+            directory = os.path.join(self.root, excluded)
+            os.makedirs(directory, exist_ok=True)
+            for i in range(20):
+                with open(os.path.join(directory, f"vendored_{i}.js"), "w") as f:
+                    f.write("module.exports = {};\n" * 50)
+
+    def modify(self, fraction: float, seed: int = 1) -> List[str]:
+        """
+        Rewrite a fraction of the generated files with new content.
+
+        Args:
+            fraction: Fraction of files to modify
+            seed: Seed selecting which files change
+
+        Returns:
+            Relative paths of the modified files
+        """
+        rng = random.Random(seed)
+        paths = sorted({function["file_path"] for function in self.functions})
+        modified = rng.sample(paths, max(1, int(len(paths) * fraction)))
+
+        self.functions = [f for f in self.functions if f["file_path"] not in modified]
+        for rel_path in modified:
+            _, ext = os.path.splitext(rel_path)
+            path = os.path.join(self.root, rel_path)
+            with open(path, "w") as f:
+                f.write(self._file_content(rng, ext, rel_path))
+
+            # Make sure the change is visible even on coarse mtime filesystems
+            stat = os.stat(path)
+            os.utime(path, (stat.st_atime, stat.st_mtime + 2))
+
+        return modified
+
+    def queries(self, count: int, seed: int = 2) -> List[Dict[str, str]]:
+        """
+        Build queries asking about generated functions.
+
+        Args:
+            count: Number of queries
+            seed: Seed selecting the functions asked about
+
+        Returns:
+            List of dictionaries with the query and the file that defines
+            the function it asks about
+        """
+        rng = random.Random(seed)
+        functions = rng.sample(self.functions, min(count, len(self.functions)))
+
+        return [
+            {
+                "query": f"what does {function['name']} do with the {function['doc']}",
+                "file_path": function["file_path"],
+            }
+            for function in functions
+        ]
+
+    def _file_content(self, rng: random.Random, ext: str, rel_path: str) -> str:
+        # Log-normal function counts give a realistic mix of small and large files
+        num_functions = max(1, min(200, int(rng.lognormvariate(2.0, 0.8))))
+        parts = []
+
+        for _ in range(num_functions):
+            name = "_".join(rng.sample(WORDS, 2)) + f"_{rng.randrange(10_000)}"
+            doc = " ".join(rng.sample(WORDS, 4))
+            body = "\n".join(
+                STATEMENT_TEMPLATES[ext].format(
+                    a=rng.choice(WORDS),
+                    b=rng.choice(WORDS),
+                    c=rng.randrange(100),
+                    word=rng.choice(WORDS),
+                )
+                for _ in range(rng.randint(2, 15))
+            )
+            parts.append(
+                FUNCTION_TEMPLATES[ext].format(
+                    name=name,
+                    args=", ".join(rng.sample(WORDS, rng.randint(0, 3))),
+                    doc=doc,
+                    body=body,
+                    ret=rng.choice(WORDS),
+                )
+            )
+            self.functions.append({"name": name, "doc": doc, "file_path": rel_path})
+
+        return "\n".join(parts)
@@ -0,0 +1,478 @@
+import os
+import time
+import asyncio
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from loguru import logger
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from src.telemetry.metrics import (
+    CHAT_ADMISSIONS,
+    CHAT_CANCELLATIONS,
+    CHAT_IN_FLIGHT,
+    CHAT_QUEUE_DEPTH,
+    CHAT_QUEUE_WAIT_SECONDS,
+)
+
+# Maximum number of chat requests worked on at once by a process
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "16"))
+
+# Maximum number of chat requests worked on at once per project
+CHAT_PROJECT_MAX_CONCURRENCY = int(os.getenv("CHAT_PROJECT_MAX_CONCURRENCY", "4"))
+
+# Chat requests of a project waiting for a slot, beyond which further ones
+# are rejected right away
+CHAT_MAX_QUEUED = int(os.getenv("CHAT_MAX_QUEUED", "16"))
+
+# Seconds a chat request waits for a slot before it is rejected
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "10.0"))
+
+# Seconds a chat request may take once admitted, 0 for no limit
+CHAT_REQUEST_TIMEOUT = float(os.getenv("CHAT_REQUEST_TIMEOUT", "120.0"))
+
+# Share the work of identical chat requests made at the same time
+CHAT_SINGLE_FLIGHT = os.getenv("CHAT_SINGLE_FLIGHT", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# Seconds between checks of whether the client of a chat request is gone
+CHAT_DISCONNECT_POLL_INTERVAL = 0.5
+
+# Deadline of the request the current thread works on
+_current_deadline: ContextVar[Optional["Deadline"]] = ContextVar(
+    "deadline", default=None
+)
+
+
+class Rejected(Exception):
+    """A request that wasn't admitted, to be retried later"""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """The work of a request ran out of time"""
+
+
+class RequestCancelled(DeadlineExceeded):
+    """The work of a request is no longer wanted by any client"""
+
+
+class Deadline:
+    """
+    When the work of a request has to stop, because it took too long or its
+    clients went away. Work checks it between steps; blocking waits register
+    to be woken up when it is cancelled.
+    """
+
+    def __init__(self, timeout: float = CHAT_REQUEST_TIMEOUT):
+        self.expires_at = time.monotonic() + timeout if timeout > 0 else None
+        self._cancelled = False
+        self._callbacks: List[Callable[[], Any]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self) -> None:
+        """Stop the work, waking up whatever it waits for"""
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback: Callable[[], Any]) -> None:
+        """Call a function when the work is cancelled, right away if it is"""
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, or None without a time limit"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self) -> None:
+        """Raise if the work has to stop"""
+        if self._cancelled:
+            raise RequestCancelled("Request cancelled")
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            raise DeadlineExceeded("Request timed out")
+
+
+def current_deadline() -> Optional[Deadline]:
+    """The deadline of the request the current thread works on, if any"""
+    return _current_deadline.get()
+
+
+class AdmissionController:
+    """
+    Limits how many requests are worked on at once, in total and per
+    tenant. Requests over the limits wait in a bounded queue, first come
+    first served, and are rejected when it is full or they waited too long.
+
+    Only used from the event loop, so it needs no locking.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = CHAT_MAX_CONCURRENCY,
+        tenant_max_concurrency: int = CHAT_PROJECT_MAX_CONCURRENCY,
+        max_queued: int = CHAT_MAX_QUEUED,
+        queue_timeout: float = CHAT_QUEUE_TIMEOUT,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.tenant_max_concurrency = max(1, tenant_max_concurrency)
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+
+        self._active = 0
+        self._tenant_active: Dict[str, int] = defaultdict(int)
+        self._queued: Dict[str, int] = defaultdict(int)
+        self._waiters: Deque[Tuple[str, asyncio.Future]] = deque()
+
+    def _has_slot(self, tenant: str) -> bool:
+        return (
+            self._active < self.max_concurrency
+            and self._tenant_active[tenant] < self.tenant_max_concurrency
+        )
+
+    def _take(self, tenant: str) -> None:
+        self._active += 1
+        self._tenant_active[tenant] += 1
+        CHAT_IN_FLIGHT.inc()
+
+    async def acquire(self, tenant: str) -> None:
+        """
+        Wait for a slot of a tenant.
+
+        Args:
+            tenant: The tenant the request is made for
+
+        Raises:
+            Rejected: If the tenant's queue is full, or no slot freed up in
+                time
+        """
+        # Requests of the tenant already waiting go first
+        if self._has_slot(tenant) and not self._queued[tenant]:
+            self._take(tenant)
+            CHAT_ADMISSIONS.labels("admitted").inc()
+            return
+
+        if self._queued[tenant] >= self.max_queued:
+            CHAT_ADMISSIONS.labels("rejected").inc()
+            raise Rejected(f"Too many requests queued for {tenant}")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((tenant, waiter))
+        self._queued[tenant] += 1
+        CHAT_QUEUE_DEPTH.inc()
+
+        start = time.monotonic()
+        try:
+            await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            # Gone after being given a slot
+            if waiter.done() and not waiter.cancelled():
+                self.release(tenant)
+            raise
+        finally:
+            CHAT_QUEUE_WAIT_SECONDS.observe(time.monotonic() - start)
+            if not waiter.done():
+                self._waiters.remove((tenant, waiter))
+                self._dequeue(tenant)
+                waiter.cancel()
+
+        if waiter.cancelled():
+            CHAT_ADMISSIONS.labels("timed_out").inc()
+            raise Rejected(
+                f"No capacity for {tenant} within {self.queue_timeout:g}s",
+                retry_after=max(1, round(self.queue_timeout)),
+            )
+
+        CHAT_ADMISSIONS.labels("admitted").inc()
+
+    def release(self, tenant: str) -> None:
+        """Give back a tenant's slot, to the oldest waiting request that fits"""
+        self._active -= 1
+        self._tenant_active[tenant] -= 1
+        if not self._tenant_active[tenant]:
+            del self._tenant_active[tenant]
+        CHAT_IN_FLIGHT.dec()
+
+        for waiting in list(self._waiters):
+            if self._active >= self.max_concurrency:
+                break
+
+            waiting_tenant, waiter = waiting
+            if self._has_slot(waiting_tenant):
+                self._waiters.remove(waiting)
+                self._dequeue(waiting_tenant)
+                self._take(waiting_tenant)
+                waiter.set_result(None)
+
+    def _dequeue(self, tenant: str) -> None:
+        self._queued[tenant] -= 1
+        if not self._queued[tenant]:
+            del self._queued[tenant]
+        CHAT_QUEUE_DEPTH.dec()
+
+
+# End of a flight's items
+_DONE = object()
+
+
+class _Flight:
+    """
+    The work of one or more identical requests. Items are recorded, so
+    requests joining late get them all. Only touched from the event loop.
+    """
+
+    def __init__(self, deadline: Deadline, on_finish: Callable[[], None]):
+        self.deadline = deadline
+        self.items: List[Any] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self._on_finish = on_finish
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    def publish(self, item: Any) -> None:
+        self.items.append(item)
+        for queue in self._subscribers:
+            queue.put_nowait(item)
+
+    def finish(self, error: Optional[BaseException]) -> None:
+        self.done = True
+        self.error = error
+        for queue in self._subscribers:
+            queue.put_nowait(_DONE)
+        self._on_finish()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in self.items:
+            queue.put_nowait(item)
+        if self.done:
+            queue.put_nowait(_DONE)
+        self._subscribers.add(queue)
+
+        try:
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                yield item
+        finally:
+            # The work stops once nobody waits for it anymore
+            self._subscribers.discard(queue)
+            if not self._subscribers and not self.done:
+                self.deadline.cancel()
+
+
+class RequestGate:
+    """
+    Runs the blocking work of requests in worker threads, once admitted.
+
+    Identical requests made while one of them is being worked on share its
+    work instead of being admitted themselves. The work is cancelled when
+    its deadline passes or when every request sharing it is gone.
+    """
+
+    def __init__(
+        self,
+        admission: AdmissionController,
+        timeout: float = CHAT_REQUEST_TIMEOUT,
+        single_flight: bool = CHAT_SINGLE_FLIGHT,
+    ):
+        self.admission = admission
+        self.timeout = timeout
+        self.single_flight = single_flight
+        self._flights: Dict[str, _Flight] = {}
+        # One thread per slot, so admitted work never queues for a thread
+        self._executor = ThreadPoolExecutor(
+            max_workers=admission.max_concurrency, thread_name_prefix="request"
+        )
+
+    def _joinable(self, key: Optional[str]) -> Optional[_Flight]:
+        if key is None or not self.single_flight:
+            return None
+        flight = self._flights.get(key)
+        if flight is None or flight.deadline.cancelled:
+            return None
+        return flight
+
+    async def run(
+        self,
+        tenant: str,
+        key: Optional[str],
+        work: Callable[[Deadline], Iterator[Any]],
+    ) -> AsyncIterator[Any]:
+        """
+        Run the work of a request, or join identical work already running.
+
+        Args:
+            tenant: The tenant the request is admitted for
+            key: What identifies identical requests, None if the request
+                can't share its work
+            work: Function of the deadline returning an iterator over the
+                request's results, run in a worker thread
+
+        Returns:
+            Async iterator over the results
+
+        Raises:
+            Rejected: If the request wasn't admitted
+            DeadlineExceeded: If the work ran out of time
+        """
+        flight = self._joinable(key)
+        if flight is None:
+            await self.admission.acquire(tenant)
+
+            # An identical request may have started while this one waited
+            flight = self._joinable(key)
+            if flight is None:
+                flight = self._start(tenant, key, work)
+            else:
+                self.admission.release(tenant)
+                CHAT_ADMISSIONS.labels("coalesced").inc()
+        else:
+            CHAT_ADMISSIONS.labels("coalesced").inc()
+
+        async for item in flight.subscribe():
+            yield item
+
+    async def collect(
+        self,
+        tenant: str,
+        key: Optional[str],
+        work: Callable[[Deadline], Iterator[Any]],
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> List[Any]:
+        """
+        Run the work of a request like run, and wait for all its results.
+
+        Args:
+            tenant: The tenant the request is admitted for
+            key: What identifies identical requests, None if the request
+                can't share its work
+            work: Function of the deadline returning an iterator over the
+                request's results, run in a worker thread
+            is_disconnected: Tells whether the client went away, in which
+                case the request stops waiting
+
+        Returns:
+            The results
+
+        Raises:
+            Rejected: If the request wasn't admitted
+            DeadlineExceeded: If the work ran out of time
+            RequestCancelled: If the client went away
+        """
+
+        async def results() -> List[Any]:
+            return [item async for item in self.run(tenant, key, work)]
+
+        task = asyncio.ensure_future(results())
+        if is_disconnected is None:
+            return await task
+
+        async def disconnected() -> None:
+            while not await is_disconnected():
+                await asyncio.sleep(CHAT_DISCONNECT_POLL_INTERVAL)
+
+        watcher = asyncio.ensure_future(disconnected())
+        try:
+            await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            watcher.cancel()
+            if not task.done():
+                task.cancel()
+                # Let it leave the work before going on
+                await asyncio.wait({task})
+
+        if task.cancelled():
+            raise RequestCancelled("Client disconnected")
+        return task.result()
+
+    def _start(
+        self,
+        tenant: str,
+        key: Optional[str],
+        work: Callable[[Deadline], Iterator[Any]],
+    ) -> _Flight:
+        loop = asyncio.get_running_loop()
+
+        def finished() -> None:
+            if key is not None and self._flights.get(key) is flight:
+                del self._flights[key]
+            self.admission.release(tenant)
+
+        flight = _Flight(Deadline(self.timeout), finished)
+        if key is not None and self.single_flight:
+            self._flights[key] = flight
+
+        self._executor.submit(self._produce, loop, flight, work)
+        return flight
+
+    def _produce(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        flight: _Flight,
+        work: Callable[[Deadline], Iterator[Any]],
+    ) -> None:
+        # Embedding requests and generation made by the work see its deadline
+        token = _current_deadline.set(flight.deadline)
+        error = None
+        items = None
+        try:
+            items = work(flight.deadline)
+            for item in items:
+                flight.deadline.check()
+                loop.call_soon_threadsafe(flight.publish, item)
+        except RequestCancelled as e:
+            CHAT_CANCELLATIONS.labels("disconnected").inc()
+            error = e
+        except DeadlineExceeded as e:
+            CHAT_CANCELLATIONS.labels("timeout").inc()
+            error = e
+        except Exception as e:
+            error = e
+        finally:
+            # Stop generators where they are, e.g. streams from the provider
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+            _current_deadline.reset(token)
+
+            try:
+                loop.call_soon_threadsafe(flight.finish, error)
+            except RuntimeError:
+                logger.warning("Event loop closed before a request finished")
@@ -0,0 +1,110 @@
+import os
+import time
+import hashlib
+import threading
+from loguru import logger
+from typing import Callable, Dict, Optional, Tuple
+
+# Seconds provider-side caches of system prompts live, 0 disables them
+LLM_CONTEXT_CACHE_TTL = int(os.getenv("LLM_CONTEXT_CACHE_TTL", "0"))
+
+# Tokens a system prompt needs before it is cached. Providers reject smaller
+# caches, and below this their implicit prefix caching is enough.
+LLM_CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("LLM_CONTEXT_CACHE_MIN_TOKENS", "4096"))
+
+# Seconds before expiry at which a cache is no longer used, so requests
+# don't reference a cache that expires while they are processed
+REFRESH_MARGIN = 60
+
+
+class ContextCache:
+    """
+    Explicit provider-side caches of system prompts, billed and processed
+    once instead of with every request. Prompts are cached by their content,
+    so a project's instructions and overview share one cache until they
+    change, and recreated when they are about to expire. Concurrent requests
+    for a prompt not cached yet wait for a single cache to be created.
+    """
+
+    def __init__(
+        self,
+        create: Callable[[str, int], str],
+        count_tokens: Callable[[str], int],
+        ttl: int = LLM_CONTEXT_CACHE_TTL,
+        min_tokens: int = LLM_CONTEXT_CACHE_MIN_TOKENS,
+    ):
+        """
+        Args:
+            create: Creates a cache of a system prompt living a number of
+                seconds with the provider, and returns its name
+            count_tokens: Counts the tokens of a prompt
+            ttl: Seconds each cache lives, raised to twice REFRESH_MARGIN
+                so caches are used for at least as long as the margin
+            min_tokens: Tokens below which prompts are not cached
+        """
+        if ttl < 2 * REFRESH_MARGIN:
+            # Caches would be recreated, and paid for, with every request
+            logger.warning(
+                f"Context cache TTL of {ttl}s raised to {2 * REFRESH_MARGIN}s"
+            )
+            ttl = 2 * REFRESH_MARGIN
+
+        self.create = create
+        self.count_tokens = count_tokens
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        # Cache name, or None for prompts not cached, and until when
+        self._entries: Dict[str, Tuple[Optional[str], float]] = {}
+        # Held while the entry of a prompt is created
+        self._creating: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, system_prompt: str) -> Optional[str]:
+        """
+        The cache holding a system prompt, created if needed.
+
+        Args:
+            system_prompt: The system prompt
+
+        Returns:
+            Name of the cache, or None to send the prompt uncached
+        """
+        key = hashlib.sha256(system_prompt.encode()).hexdigest()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+            creating = self._creating.setdefault(key, threading.Lock())
+
+        with creating:
+            # Another request may have created it meanwhile
+            now = time.monotonic()
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                return entry[0]
+
+            if self.count_tokens(system_prompt) < self.min_tokens:
+                # Small prompts stay small
+                name, until = None, float("inf")
+            else:
+                try:
+                    name = self.create(system_prompt, self.ttl)
+                    until = now + self.ttl - REFRESH_MARGIN
+                    logger.info(f"Created context cache {name}")
+                except Exception as e:
+                    # Sent uncached, and retried after the margin
+                    logger.warning(f"Failed to create context cache: {str(e)}")
+                    name, until = None, now + REFRESH_MARGIN
+
+            with self._lock:
+                # Drop expired caches, they can't be used anymore
+                self._entries = {
+                    other: entry
+                    for other, entry in self._entries.items()
+                    if entry[1] > now
+                }
+                self._entries[key] = (name, until)
+                self._creating.pop(key, None)
+        return name
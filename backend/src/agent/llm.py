@@ -1,6 +1,11 @@
 import os
+import time
+import tiktoken
+import numpy as np
+from datetime import timedelta
+from functools import partial
 from loguru import logger
-from typing import List, Dict, Optional
+from typing import Any, Iterator, List, Dict, NamedTuple, Optional
 
 # LangChain imports
 from langchain_google_genai import (
@@ -9,10 +14,50 @@ from langchain_google_genai import (
 )
 from langchain.prompts import (
     ChatPromptTemplate,
+    MessagesPlaceholder,
     SystemMessagePromptTemplate,
     HumanMessagePromptTemplate,
 )
-from langchain.schema import AIMessage, HumanMessage, SystemMessage
+from langchain.schema import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from src.consts.vectors import EMBEDDING_NORMALIZE, VECTOR_DIMS
+from src.agent.admission import DeadlineExceeded, current_deadline
+from src.agent.context_cache import LLM_CONTEXT_CACHE_TTL, ContextCache
+from src.agent.scheduler import EmbeddingScheduler, InteractiveLoadSignal, Priority
+from src.telemetry.metrics import (
+    LLM_PROMPT_TOKENS,
+    LLM_RESPONSE_SECONDS,
+    LLM_TIME_TO_FIRST_TOKEN_SECONDS,
+)
+from src.telemetry.tracing import span
+
+# Instructions for every chat prompt
+SYSTEM_INSTRUCTIONS = """You are a coding assistant that helps users understand and work with their codebase.
+Answer the user's question based on the code context provided with it.
+Be specific and reference relevant parts of the code in your explanation.
+If the context doesn't contain enough information to answer the question, say so.
+"""
+
+# Compiled once. What stays the same across queries comes first, so
+# providers can reuse the processed prefix: the instructions and project
+# overview, then the conversation, which only grows. The summary and the
+# retrieved code change with every query and come last.
+CHAT_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        SystemMessagePromptTemplate.from_template("{instructions}{project_context}"),
+        MessagesPlaceholder("history"),
+        HumanMessagePromptTemplate.from_template(
+            "{summary}CODE CONTEXT:\n{context}\n\nQUESTION:\n{query}"
+        ),
+    ]
+)
+
+
+class EmbeddingSpace(NamedTuple):
+    """An embedding model and the dimensions requested from it"""
+
+    model: Optional[str]
+    dims: int
 
 
 class LLMService:
@@ -21,7 +66,8 @@ class LLMService:
 
     This service handles:
     1. Chat/completion generation
-    2. Text embeddings
+    2. Text embeddings, scheduled by priority so interactive queries are not
+       held up by bulk indexing
     """
 
     def __init__(self):
@@ -29,9 +75,28 @@ class LLMService:
         self.provider = os.getenv("LLM_PROVIDER", "google").lower()
         self.embedding_provider = os.getenv("EMBEDDING_PROVIDER", "google").lower()
 
+        # Dimensions requested from the embedding model, and its name, which
+        # together identify the embedding space of stored vectors
+        self.embedding_dims = VECTOR_DIMS
+        self.embedding_model_name: Optional[str] = None
+        self.encoding = None
+
         # Initialize the LLM and Embedding models based on provider config
         self.llm = self._initialize_llm()
         self.embedding_model = self._initialize_embedding_model()
+        # Clients of other embedding models, for projects still embedded
+        # with the model they were first indexed with
+        self._embedding_models: Dict[str, Any] = {}
+        self.embedding_scheduler = EmbeddingScheduler(
+            self._embed_batch, load_signal=InteractiveLoadSignal()
+        )
+
+        # Explicit caching of system prompts, where the provider supports it
+        self.context_cache = (
+            ContextCache(self._create_context_cache, self._count_tokens)
+            if LLM_CONTEXT_CACHE_TTL > 0
+            else None
+        )
 
         logger.info(f"Initialized LLM service with provider: {self.provider}")
         logger.info(
@@ -78,6 +143,7 @@ class LLMService:
             model_name = os.getenv(
                 "GEMINI_EMBEDDING_MODEL", "models/text-embedding-004"
             )
+            self.embedding_model_name = model_name
             return GoogleGenerativeAIEmbeddings(
                 model=model_name, google_api_key=api_key
             )
@@ -91,15 +157,61 @@ class LLMService:
                 logger.warning("GEMINI_API_KEY not found in environment variables")
 
             model_name = os.getenv("GEMINI_EMBEDDING_MODEL", "models/embedding-001")
+            self.embedding_model_name = model_name
             return GoogleGenerativeAIEmbeddings(
                 model=model_name, google_api_key=api_key
             )
 
+    @property
+    def embedding_space(self) -> EmbeddingSpace:
+        """The configured embedding model and dimensions"""
+        return EmbeddingSpace(self.embedding_model_name, self.embedding_dims)
+
+    def _embedding_model_for(self, model_name: Optional[str]):
+        """The client of an embedding model, the configured one by default"""
+        if model_name is None or model_name == self.embedding_model_name:
+            return self.embedding_model
+
+        if model_name not in self._embedding_models:
+            self._embedding_models[model_name] = GoogleGenerativeAIEmbeddings(
+                model=model_name, google_api_key=os.getenv("GEMINI_API_KEY")
+            )
+        return self._embedding_models[model_name]
+
+    def _create_context_cache(self, system_prompt: str, ttl: int) -> str:
+        """Cache a system prompt with the Gemini API, returning the cache name"""
+        from google.ai.generativelanguage_v1beta import (
+            CacheServiceClient,
+            CachedContent,
+            Content,
+            Part,
+        )
+
+        client = CacheServiceClient(
+            client_options={"api_key": os.getenv("GEMINI_API_KEY")}
+        )
+        cached = client.create_cached_content(
+            cached_content=CachedContent(
+                model=self.llm.model,
+                system_instruction=Content(parts=[Part(text=system_prompt)]),
+                ttl=timedelta(seconds=ttl),
+            )
+        )
+        return cached.name
+
+    def _count_tokens(self, text: str) -> int:
+        """Approximate the tokens of a text"""
+        if self.encoding is None:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+        return len(self.encoding.encode(text))
+
     def generate_response(
         self,
         query: str,
         context: str,
         chat_history: Optional[List[Dict[str, str]]] = None,
+        summary: Optional[str] = None,
+        project_context: Optional[str] = None,
     ) -> str:
         """
         Generate a response using the LLM model based on the query and context.
@@ -108,119 +220,259 @@ class LLMService:
             query: User query string
             context: Code context from the vector store
             chat_history: List of previous chat messages as dictionaries with 'role' and 'content'
+            summary: Summary of earlier messages no longer in chat_history
+            project_context: Context about the whole project, the same for
+                all of its queries
 
         Returns:
             Generated response string
+
+        Raises:
+            DeadlineExceeded: If the deadline of the request passed, which
+                stops generation
         """
+        deadline = current_deadline()
         try:
-            # Create system message with context
-            system_template = """You are a coding assistant that helps users understand and work with their codebase.
-Answer the user's question based on the code context provided below. 
-Be specific and reference relevant parts of the code in your explanation.
-If the context doesn't contain enough information to answer the question, say so.
+            parts = []
+            for part in self.stream_response(
+                query, context, chat_history, summary, project_context
+            ):
+                if deadline is not None:
+                    deadline.check()
+                parts.append(part)
+            return "".join(parts)
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to generate response: {str(e)}")
+            # Fallback error response
+            return f"I'm sorry, I encountered an error while generating a response: {str(e)}"
 
-CODE CONTEXT:
-{context}
-"""
-            system_message_prompt = SystemMessagePromptTemplate.from_template(
-                system_template
-            )
+    def stream_response(
+        self,
+        query: str,
+        context: str,
+        chat_history: Optional[List[Dict[str, str]]] = None,
+        summary: Optional[str] = None,
+        project_context: Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        Stream a response from the LLM model as it is generated.
 
-            # Create human message prompt
-            human_template = "{query}"
-            human_message_prompt = HumanMessagePromptTemplate.from_template(
-                human_template
-            )
+        Args:
+            query: User query string
+            context: Code context from the vector store
+            chat_history: List of previous chat messages as dictionaries with 'role' and 'content'
+            summary: Summary of earlier messages no longer in chat_history
+            project_context: Context about the whole project, the same for
+                all of its queries
 
-            # Create chat prompt
-            chat_prompt = ChatPromptTemplate.from_messages(
-                [system_message_prompt, human_message_prompt]
+        Returns:
+            Iterator of response text fragments
+        """
+        messages = self._build_messages(
+            query, context, chat_history, summary, project_context
+        )
+
+        # A cached system prompt replaces the system message
+        options = {}
+        if self.context_cache is not None:
+            cached_content = self.context_cache.get(messages[0].content)
+            if cached_content:
+                messages = messages[1:]
+                options["cached_content"] = cached_content
+
+        with span(
+            "llm.stream_response",
+            LLM_RESPONSE_SECONDS,
+            set_current=False,
+            provider=self.provider,
+        ):
+            start = time.perf_counter()
+            first_token = True
+            prompt_tokens = cached_tokens = 0
+
+            for chunk in self.llm.stream(messages, **options):
+                # Chunks report the prompt's tokens once, and the cached
+                # ones with every chunk
+                usage = getattr(chunk, "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    details = usage.get("input_token_details") or {}
+                    cached_tokens = max(cached_tokens, details.get("cache_read") or 0)
+
+                content = chunk.content if hasattr(chunk, "content") else chunk
+                if not isinstance(content, str):
+                    content = str(content)
+                if not content:
+                    continue
+
+                if first_token:
+                    LLM_TIME_TO_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start)
+                    first_token = False
+
+                yield content
+
+            LLM_PROMPT_TOKENS.labels("cached").inc(cached_tokens)
+            LLM_PROMPT_TOKENS.labels("uncached").inc(
+                max(prompt_tokens - cached_tokens, 0)
             )
 
-            # Format messages
-            messages = chat_prompt.format_prompt(
-                context=context, query=query
-            ).to_messages()
-
-            # Convert chat history if provided
-            if chat_history:
-                history_messages = []
-                for msg in chat_history[
-                    :-1
-                ]:  # Exclude the current query which we already formatted
-                    role = msg.get("role", "user")
-                    content = msg.get("content", "")
-
-                    if not content.strip():
-                        continue
-
-                    if role == "user":
-                        history_messages.append(HumanMessage(content=content))
-                    elif role == "assistant":
-                        history_messages.append(AIMessage(content=content))
-                    elif role == "system":
-                        history_messages.append(SystemMessage(content=content))
-
-                # Insert history before current query but after system message
-                if history_messages:
-                    messages = [messages[0]] + history_messages + [messages[-1]]
-
-            # Generate response
-            response = self.llm(messages)
-
-            # Extract response content
-            if hasattr(response, "content"):
-                return response.content
-            else:
-                return str(response)
+    def _build_messages(
+        self,
+        query: str,
+        context: str,
+        chat_history: Optional[List[Dict[str, str]]] = None,
+        summary: Optional[str] = None,
+        project_context: Optional[str] = None,
+    ) -> List[BaseMessage]:
+        """
+        Build the prompt messages for a query.
 
-        except Exception as e:
-            logger.error(f"Failed to generate response: {str(e)}")
-            # Fallback error response
-            return f"I'm sorry, I encountered an error while generating a response: {str(e)}"
+        Args:
+            query: User query string
+            context: Code context from the vector store
+            chat_history: List of previous chat messages as dictionaries with 'role' and 'content'
+            summary: Summary of earlier messages no longer in chat_history
+            project_context: Context about the whole project
+
+        Returns:
+            List of messages to send to the LLM
+        """
+        # Convert chat history if provided
+        history_messages = []
+        # Exclude the current query which is formatted with its context
+        for msg in (chat_history or [])[:-1]:
+            role = msg.get("role", "user")
+            content = msg.get("content", "")
+
+            if not content.strip():
+                continue
+
+            if role == "user":
+                history_messages.append(HumanMessage(content=content))
+            elif role == "assistant":
+                history_messages.append(AIMessage(content=content))
+            elif role == "system":
+                history_messages.append(SystemMessage(content=content))
+
+        return CHAT_PROMPT.format_messages(
+            instructions=SYSTEM_INSTRUCTIONS,
+            project_context=(
+                f"\nPROJECT OVERVIEW:\n{project_context}\n" if project_context else ""
+            ),
+            history=history_messages,
+            summary=(
+                f"SUMMARY OF THE CONVERSATION SO FAR:\n{summary}\n\n" if summary else ""
+            ),
+            context=context,
+            query=query,
+        )
 
-    def pad_embedding(self, embedding, target_dim=1024):
-        """Pad embedding with zeros to reach target dimension"""
-        current_dim = len(embedding)
+    def summarize_conversation(
+        self,
+        summary: Optional[str],
+        chat_history: List[Dict[str, str]],
+        max_words: int = 250,
+    ) -> str:
+        """
+        Fold chat messages into a running summary of the conversation.
 
-        if current_dim == target_dim:
-            return embedding
-        elif current_dim > target_dim:
-            return embedding[:target_dim]  # Truncate if larger
+        Args:
+            summary: Summary of the messages before chat_history, if any
+            chat_history: List of chat messages as dictionaries with 'role' and 'content'
+            max_words: Length the summary should stay under
 
-        # Pad with zeros
-        padding = [0.0] * (target_dim - current_dim)
-        return embedding + padding
+        Returns:
+            The updated summary
+        """
+        transcript = "\n\n".join(
+            f"{msg.get('role', 'user')}: {msg.get('content', '')}"
+            for msg in chat_history
+        )
+        prompt = f"""Update the summary of a conversation between a user and a coding assistant, so the assistant can continue the conversation from the summary alone.
+Keep the questions asked, the files, functions and decisions discussed, and anything left open. Drop pleasantries and code that can be looked up again.
+Answer with the summary only, in at most {max_words} words.
+
+SUMMARY SO FAR:
+{summary or "(none)"}
 
-    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+NEW MESSAGES:
+{transcript}
+"""
+
+        with span("llm.summarize_conversation", provider=self.provider):
+            response = self.llm.invoke([HumanMessage(content=prompt)])
+
+        content = response.content if hasattr(response, "content") else response
+        return str(content).strip()
+
+    def _embed_batch(
+        self, texts: List[str], space: Optional[EmbeddingSpace] = None
+    ) -> np.ndarray:
+        """Embed a single batch of texts with the provider"""
+        space = space or self.embedding_space
+        embeddings = np.asarray(
+            self._embedding_model_for(space.model).embed_documents(
+                texts, output_dimensionality=space.dims
+            ),
+            dtype=np.float32,
+        )
+
+        if embeddings.ndim != 2 or embeddings.shape[1] != space.dims:
+            raise ValueError(
+                f"Embedding model returned {embeddings.shape[-1]} dimensions, "
+                f"expected {space.dims}; set EMBEDDING_DIMS"
+            )
+
+        if EMBEDDING_NORMALIZE:
+            normalize_embeddings(embeddings)
+
+        return embeddings
+
+    def generate_embeddings(
+        self,
+        texts: List[str],
+        priority: Priority = Priority.BULK,
+        space: Optional[EmbeddingSpace] = None,
+    ) -> np.ndarray:
         """
         Generate embeddings for a list of text strings.
 
         Args:
             texts: List of text strings to embed
+            priority: Scheduling priority; use Priority.INTERACTIVE for
+                requests a user is waiting on
+            space: Model and dimensions to embed with, if not the
+                configured ones, e.g. those a project was indexed with
 
         Returns:
-            List of embedding vectors
+            float32 matrix with one embedding per row. Provider errors are
+            raised rather than returned as placeholder vectors.
         """
         try:
             # Check if there are any texts to embed
             if not texts:
-                return []
+                dims = space.dims if space else self.embedding_dims
+                return np.empty((0, dims), dtype=np.float32)
 
             # Generate embeddings using the configured provider
-            embeddings = self.embedding_model.embed_documents(
-                texts, output_dimensionality=1024
+            if space is None or space == self.embedding_space:
+                return self.embedding_scheduler.embed(texts, priority)
+            return self.embedding_scheduler.embed(
+                texts, priority, partial(self._embed_batch, space=space)
             )
 
-            padded_embeddings = []
-            for embedding in embeddings:
-                padded_embeddings.append(self.pad_embedding(embedding))
-
-            return padded_embeddings
-
         except Exception as e:
+            # No fallback: a placeholder vector would be stored or searched
+            # as if it were a real embedding
             logger.error(f"Failed to generate embeddings: {str(e)}")
-            # Return empty embeddings for all texts as fallback
-            # Using a standard embedding dimension, adjust based on your model
-            embedding_dim = 1024
-            return [[0.0] * embedding_dim] * len(texts)
+            raise
+
+
+def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    """Scale each row to unit L2 norm in place, leaving zero rows as they are"""
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    np.divide(embeddings, norms, out=embeddings, where=norms > 0)
+    return embeddings
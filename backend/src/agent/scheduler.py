@@ -0,0 +1,375 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+import numpy as np
+from enum import IntEnum
+from concurrent.futures import CancelledError, Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from loguru import logger
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import text
+
+from src.agent.admission import Deadline, current_deadline
+from src.database.backends import backend
+from src.database.pgvector import get_db
+from src.telemetry.metrics import (
+    EMBEDDING_ERRORS,
+    EMBEDDING_IN_FLIGHT,
+    EMBEDDING_LATENCY_SECONDS,
+    EMBEDDING_QUEUE_DEPTH,
+    EMBEDDING_QUEUE_WAIT_SECONDS,
+)
+
+# Maximum number of concurrent requests to the embedding provider
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+
+# Provider slots that bulk work never takes, so interactive queries always
+# find a free slot
+EMBEDDING_INTERACTIVE_RESERVED = int(os.getenv("EMBEDDING_INTERACTIVE_RESERVED", "1"))
+
+# Provider slots bulk work may use while interactive queries are active
+EMBEDDING_BULK_CONCURRENCY_UNDER_LOAD = int(
+    os.getenv("EMBEDDING_BULK_CONCURRENCY_UNDER_LOAD", "1")
+)
+
+# Texts per provider request for bulk work. Smaller batches let interactive
+# queries get in sooner.
+EMBEDDING_BULK_BATCH_SIZE = int(os.getenv("EMBEDDING_BULK_BATCH_SIZE", "32"))
+
+# Seconds after an interactive query during which bulk work stays throttled
+EMBEDDING_INTERACTIVE_COOLDOWN = float(
+    os.getenv("EMBEDDING_INTERACTIVE_COOLDOWN", "5.0")
+)
+
+# Bounds of the exponential backoff applied to bulk work after provider errors
+EMBEDDING_BULK_BACKOFF_MIN = float(os.getenv("EMBEDDING_BULK_BACKOFF_MIN", "1.0"))
+EMBEDDING_BULK_BACKOFF_MAX = float(os.getenv("EMBEDDING_BULK_BACKOFF_MAX", "60.0"))
+
+
+class Priority(IntEnum):
+    """Priority classes of embedding work, lower values are served first"""
+
+    INTERACTIVE = 0
+    BULK = 1
+
+
+class _Batch:
+    def __init__(
+        self,
+        texts: List[str],
+        priority: Priority,
+        embed_batch: Optional[Callable[[List[str]], np.ndarray]] = None,
+    ):
+        self.texts = texts
+        self.priority = priority
+        self.embed_batch = embed_batch
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class InteractiveLoadSignal:
+    """
+    Shares interactive embedding activity between processes through the database.
+
+    The API publishes when it serves interactive queries, and indexing
+    workers in other processes read it to throttle their bulk embeddings.
+    Both sides are best effort: failures are logged and treated as idle.
+    """
+
+    def __init__(
+        self,
+        window: float = EMBEDDING_INTERACTIVE_COOLDOWN,
+        refresh_interval: float = 1.0,
+    ):
+        self.window = window
+        self.refresh_interval = refresh_interval
+        self._busy = False
+        self._last_published = 0.0
+        self._refresher: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def publish(self) -> None:
+        """Record interactive activity, at most once per refresh interval"""
+        now = time.monotonic()
+        if now - self._last_published < self.refresh_interval:
+            return
+        self._last_published = now
+
+        try:
+            with get_db() as db:
+                db.execute(
+                    text(
+                        """
+                        INSERT INTO embedding_activity (name, interactive_at)
+                        VALUES ('interactive', now())
+                        ON CONFLICT (name) DO UPDATE SET interactive_at = now()
+                        """
+                    )
+                )
+                db.commit()
+        except Exception as e:
+            logger.warning(f"Failed to publish interactive embedding load: {e}")
+
+    def is_busy(self) -> bool:
+        """
+        Whether any process served interactive queries recently. Reads a
+        cached value refreshed in the background, so this never blocks.
+        """
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh, daemon=True)
+                self._refresher.start()
+
+        return self._busy
+
+    def _refresh(self) -> None:
+        warned = False
+        while True:
+            try:
+                with get_db() as db:
+                    self._busy = bool(
+                        db.execute(
+                            text(
+                                f"""
+                                SELECT interactive_at > {backend.seconds_ago("window")}
+                                FROM embedding_activity
+                                WHERE name = 'interactive'
+                                """
+                            ),
+                            {"window": self.window},
+                        ).scalar()
+                    )
+                warned = False
+            except Exception as e:
+                self._busy = False
+                if not warned:
+                    logger.warning(f"Failed to read interactive embedding load: {e}")
+                    warned = True
+
+            time.sleep(self.refresh_interval)
+
+
+class EmbeddingScheduler:
+    """
+    Schedules embedding requests to the provider by priority class.
+
+    Interactive queries always go ahead of queued bulk batches and have
+    provider slots reserved for them. Bulk work is split into small batches
+    and throttled while interactive queries are active, locally or in other
+    processes, and backs off after provider errors such as rate limits.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], np.ndarray],
+        load_signal: Optional[InteractiveLoadSignal] = None,
+        max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+        interactive_reserved: int = EMBEDDING_INTERACTIVE_RESERVED,
+        bulk_concurrency_under_load: int = EMBEDDING_BULK_CONCURRENCY_UNDER_LOAD,
+        bulk_batch_size: int = EMBEDDING_BULK_BATCH_SIZE,
+        interactive_cooldown: float = EMBEDDING_INTERACTIVE_COOLDOWN,
+    ):
+        self.embed_batch = embed_batch
+        self.load_signal = load_signal
+        self.max_concurrency = max(1, max_concurrency)
+        self.bulk_concurrency = max(1, self.max_concurrency - interactive_reserved)
+        self.bulk_concurrency_under_load = bulk_concurrency_under_load
+        self.bulk_batch_size = max(1, bulk_batch_size)
+        self.interactive_cooldown = interactive_cooldown
+
+        self._queue: List = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._in_flight: Dict[Priority, int] = {p: 0 for p in Priority}
+        self._last_interactive = float("-inf")
+        self._bulk_backoff = 0.0
+        self._bulk_paused_until = 0.0
+        self._threads: List[threading.Thread] = []
+
+    def embed(
+        self,
+        texts: List[str],
+        priority: Priority,
+        embed_batch: Optional[Callable[[List[str]], np.ndarray]] = None,
+    ) -> np.ndarray:
+        """
+        Embed texts, blocking until all of them are done.
+
+        Under the deadline of a request, waits no longer than it allows, and
+        batches still queued when it passes are dropped.
+
+        Args:
+            texts: List of text strings to embed
+            priority: Priority class of the request
+            embed_batch: Optional function embedding the batches instead of
+                the scheduler's, e.g. with another model
+
+        Returns:
+            float32 matrix of embeddings, one row per text in order
+
+        Raises:
+            DeadlineExceeded: If the request's deadline passed
+        """
+        start = time.monotonic()
+        deadline = current_deadline()
+
+        try:
+            batch_size = (
+                len(texts) if priority == Priority.INTERACTIVE else self.bulk_batch_size
+            )
+            batches = [
+                self._submit(texts[i : i + batch_size], priority, embed_batch)
+                for i in range(0, len(texts), batch_size)
+            ]
+
+            return np.concatenate(
+                [
+                    np.asarray(self._result(batch, deadline), dtype=np.float32)
+                    for batch in batches
+                ]
+            )
+
+        finally:
+            EMBEDDING_LATENCY_SECONDS.labels(priority.name.lower()).observe(
+                time.monotonic() - start
+            )
+
+    def _result(self, batch: _Batch, deadline: Optional[Deadline]):
+        if deadline is None:
+            return batch.future.result()
+
+        deadline.on_cancel(batch.future.cancel)
+        try:
+            return batch.future.result(timeout=deadline.remaining())
+        except (CancelledError, FutureTimeoutError):
+            # Dropped if still queued
+            batch.future.cancel()
+            deadline.check()
+            raise
+
+    def _submit(
+        self,
+        texts: List[str],
+        priority: Priority,
+        embed_batch: Optional[Callable[[List[str]], np.ndarray]] = None,
+    ) -> _Batch:
+        batch = _Batch(texts, priority, embed_batch)
+
+        with self._condition:
+            self._start_threads()
+            heapq.heappush(self._queue, (priority, next(self._sequence), batch))
+            if priority == Priority.INTERACTIVE:
+                self._last_interactive = batch.enqueued_at
+
+            EMBEDDING_QUEUE_DEPTH.labels(priority.name.lower()).inc()
+            self._condition.notify_all()
+
+        return batch
+
+    def _start_threads(self) -> None:
+        # Called with the condition held
+        if self._threads:
+            return
+
+        for i in range(self.max_concurrency):
+            thread = threading.Thread(
+                target=self._run, name=f"embedding-scheduler-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _bulk_limit(self, now: float) -> int:
+        if now < self._bulk_paused_until:
+            return 0
+
+        interactive_busy = (
+            self._in_flight[Priority.INTERACTIVE] > 0
+            or now - self._last_interactive < self.interactive_cooldown
+            or (self.load_signal is not None and self.load_signal.is_busy())
+        )
+        if interactive_busy:
+            return self.bulk_concurrency_under_load
+
+        return self.bulk_concurrency
+
+    def _next_batch(self) -> Optional[_Batch]:
+        # Called with the condition held
+        while self._queue:
+            priority, _, batch = self._queue[0]
+            if (
+                priority == Priority.BULK
+                and not batch.future.cancelled()
+                and self._in_flight[Priority.BULK] >= self._bulk_limit(time.monotonic())
+            ):
+                return None
+
+            heapq.heappop(self._queue)
+            # Batches of requests that were cancelled while queued are dropped
+            if batch.future.set_running_or_notify_cancel():
+                return batch
+            EMBEDDING_QUEUE_DEPTH.labels(priority.name.lower()).dec()
+
+        return None
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                batch = self._next_batch()
+                while batch is None:
+                    # Time out to re-evaluate cooldowns and backoff
+                    self._condition.wait(timeout=0.25)
+                    batch = self._next_batch()
+
+                self._in_flight[batch.priority] += 1
+
+            label = batch.priority.name.lower()
+            EMBEDDING_QUEUE_DEPTH.labels(label).dec()
+            EMBEDDING_IN_FLIGHT.labels(label).inc()
+            EMBEDDING_QUEUE_WAIT_SECONDS.labels(label).observe(
+                time.monotonic() - batch.enqueued_at
+            )
+
+            try:
+                result = (batch.embed_batch or self.embed_batch)(batch.texts)
+            except Exception as e:
+                EMBEDDING_ERRORS.labels(label).inc()
+                self._on_error(batch)
+                batch.future.set_exception(e)
+            else:
+                # The caller gets its embeddings before load is published,
+                # which may take a database round trip
+                batch.future.set_result(result)
+                try:
+                    self._on_success(batch)
+                except Exception as e:
+                    logger.warning(f"Failed to record embedding success: {str(e)}")
+            finally:
+                EMBEDDING_IN_FLIGHT.labels(label).dec()
+                with self._condition:
+                    self._in_flight[batch.priority] -= 1
+                    self._condition.notify_all()
+
+    def _on_success(self, batch: _Batch) -> None:
+        if batch.priority == Priority.INTERACTIVE:
+            if self.load_signal is not None:
+                self.load_signal.publish()
+        else:
+            with self._condition:
+                self._bulk_backoff = 0.0
+
+    def _on_error(self, batch: _Batch) -> None:
+        if batch.priority != Priority.BULK:
+            return
+
+        with self._condition:
+            self._bulk_backoff = min(
+                EMBEDDING_BULK_BACKOFF_MAX,
+                max(EMBEDDING_BULK_BACKOFF_MIN, self._bulk_backoff * 2),
+            )
+            self._bulk_paused_until = time.monotonic() + self._bulk_backoff
+
+        logger.warning(
+            f"Bulk embedding failed, pausing bulk work for {self._bulk_backoff:.1f}s"
+        )
@@ -0,0 +1,366 @@
+import os
+import numpy as np
+import tiktoken
+from loguru import logger
+from typing import List, Dict, Any, Optional, Tuple
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from src.database.pgvector import ChatSession, ChatMessage
+from src.vectors.vector_store import VectorStore
+from src.vectors.overlay import BufferOverlay
+from src.vectors.scope import SearchScope
+from src.telemetry.metrics import (
+    CHAT_COMPACTIONS,
+    CHAT_HISTORY_TOKENS,
+    CHAT_RETRIEVALS,
+)
+
+# Tokens of verbatim history above which older messages are summarized
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "2000"))
+
+# Words the running summary of compacted messages is kept under
+CHAT_SUMMARY_MAX_WORDS = int(os.getenv("CHAT_SUMMARY_MAX_WORDS", "250"))
+
+# Cosine similarity to the embedding a session's context was retrieved with,
+# above which a question is taken to be on the same topic and reuses it
+CHAT_TOPIC_SIMILARITY = float(os.getenv("CHAT_TOPIC_SIMILARITY", "0.8"))
+
+
+class ChatSessions:
+    """
+    Conversations kept on the server, so clients send only the new question.
+
+    Messages are stored verbatim until they exceed the token budget, then the
+    oldest are folded into a running summary by the LLM. The chunks retrieved
+    for a question are kept with the session and reused for follow-ups on the
+    same topic, which skips the vector search.
+    """
+
+    def __init__(
+        self,
+        vector_store: VectorStore,
+        token_budget: int = CHAT_HISTORY_TOKEN_BUDGET,
+        topic_similarity: float = CHAT_TOPIC_SIMILARITY,
+    ):
+        self.vector_store = vector_store
+        self.llm_service = vector_store.llm_service
+        self.token_budget = token_budget
+        self.topic_similarity = topic_similarity
+        self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def create(self, db: Session, project_name: str) -> ChatSession:
+        """
+        Start a chat session.
+
+        Args:
+            db: Database session
+            project_name: Name of the project the conversation is about
+
+        Returns:
+            The session
+        """
+        session = ChatSession(project_name=project_name)
+        db.add(session)
+        db.commit()
+        db.refresh(session)
+        return session
+
+    def get(self, db: Session, session_id: int) -> Optional[ChatSession]:
+        """Get a chat session by ID"""
+        return db.get(ChatSession, session_id)
+
+    def delete(self, db: Session, session_id: int) -> bool:
+        """
+        Delete a chat session and its messages.
+
+        Returns:
+            False if the session doesn't exist
+        """
+        session = db.get(ChatSession, session_id)
+        if session is None:
+            return False
+
+        db.delete(session)
+        db.commit()
+        return True
+
+    def history(self, db: Session, session: ChatSession) -> List[Dict[str, str]]:
+        """
+        The messages of a session not folded into its summary yet, oldest
+        first.
+
+        Args:
+            db: Database session
+            session: Chat session
+
+        Returns:
+            List of messages as dictionaries with 'role' and 'content'
+        """
+        messages = self._recent_messages(db, session.id)
+
+        CHAT_HISTORY_TOKENS.observe(
+            session.summary_token_count
+            + sum(message.token_count for message in messages)
+        )
+        return [
+            {"role": message.role, "content": message.content} for message in messages
+        ]
+
+    def retrieve(
+        self,
+        db: Session,
+        session: ChatSession,
+        query: str,
+        project_names: List[str],
+        scope: Optional[SearchScope] = None,
+        limit: int = 5,
+        overlay: Optional[BufferOverlay] = None,
+        read_db: Optional[Session] = None,
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Find the code context for a question of a session.
+
+        Follow-up questions are often too short to search with on their own,
+        so the previous question is embedded with them. If the result is
+        close to the embedding the session's context was retrieved with, and
+        the projects and scope are unchanged, that context is reused. It
+        isn't with unsaved buffers, which may have changed since.
+
+        Args:
+            db: Database session
+            session: Chat session
+            query: The new question
+            project_names: Names of the projects to search
+            scope: Optional files, directories and languages to search in
+            limit: Maximum number of chunks
+            overlay: Optional unsaved buffers to search
+            read_db: Optional session to fetch and search chunks with, e.g.
+                on a read replica. The session's context is stored with db.
+
+        Returns:
+            Same as VectorStore.query_vectors
+        """
+        previous = db.execute(
+            select(ChatMessage.content)
+            .where(ChatMessage.session_id == session.id, ChatMessage.role == "user")
+            .order_by(ChatMessage.id.desc())
+            .limit(1)
+        ).scalar()
+        space, version_id = self.vector_store.query_space(
+            read_db or db, project_names[0]
+        )
+        embedding = self.vector_store.embed_query(
+            f"{previous}\n{query}" if previous else query, space
+        )
+
+        # Embeddings of another version can't be compared with this one
+        key = {
+            "project_names": project_names,
+            "paths": scope.paths if scope else [],
+            "languages": scope.languages if scope else [],
+            "embedding_version_id": version_id,
+        }
+        if (
+            overlay is None
+            and session.context_chunk_ids
+            and session.context_scope == key
+            and self._same_topic(embedding, session.context_embedding)
+        ):
+            chunks, files = self.vector_store.get_chunks(
+                read_db or db, session.context_chunk_ids
+            )
+            # Reindexing replaces chunks, search again for the current ones
+            if len(chunks) == len(session.context_chunk_ids):
+                CHAT_RETRIEVALS.labels("reused").inc()
+                return chunks, files
+
+        chunks, files = self.vector_store.search_vectors(
+            read_db or db,
+            project_names,
+            embedding,
+            limit,
+            scope=scope,
+            overlay=overlay,
+            embedding_version_id=version_id,
+        )
+        CHAT_RETRIEVALS.labels("search").inc()
+
+        session.context_chunk_ids = [chunk["id"] for chunk in chunks]
+        session.context_scope = key
+        session.context_embedding = embedding
+        db.commit()
+        return chunks, files
+
+    def add_turn(
+        self, db: Session, session: ChatSession, query: str, response: str
+    ) -> bool:
+        """
+        Store a question and its answer.
+
+        Args:
+            db: Database session
+            session: Chat session
+            query: The user's question
+            response: The assistant's answer
+
+        Returns:
+            Whether the history is over budget and should be compacted
+        """
+        for role, content in (("user", query), ("assistant", response)):
+            db.add(
+                ChatMessage(
+                    session_id=session.id,
+                    role=role,
+                    content=content,
+                    token_count=len(self.encoding.encode(content)),
+                )
+            )
+        session.updated_at = func.now()
+        db.commit()
+
+        return self._history_tokens(db, session.id) > self.token_budget
+
+    def compact(self, db: Session, session_id: int) -> bool:
+        """
+        Fold the oldest messages of a session into its summary until the
+        rest take at most half the token budget, so compaction doesn't run
+        again on the next turn. The last question and answer are always
+        kept verbatim.
+
+        No lock is held while the LLM summarizes, so the session's next turn
+        isn't held up by it. The summary is then applied only if the session
+        wasn't compacted meanwhile.
+
+        Args:
+            db: Database session
+            session_id: ID of the chat session
+
+        Returns:
+            Whether any messages were compacted
+        """
+        try:
+            previous = db.execute(
+                select(ChatSession.summary).where(ChatSession.id == session_id)
+            ).one_or_none()
+            if previous is None:
+                return False
+            previous = previous.summary
+
+            messages = self._recent_messages(db, session_id)
+            db.commit()
+
+            remaining = sum(message.token_count for message in messages)
+            if remaining <= self.token_budget:
+                return False
+
+            count = 0
+            while count < len(messages) - 2 and remaining > self.token_budget // 2:
+                remaining -= messages[count].token_count
+                count += 1
+            if count == 0:
+                return False
+
+            compacted = messages[:count]
+            summary = self.llm_service.summarize_conversation(
+                previous,
+                [
+                    {"role": message.role, "content": message.content}
+                    for message in compacted
+                ],
+                max_words=CHAT_SUMMARY_MAX_WORDS,
+            )
+
+            # Compare and set: another compaction applied since the summary
+            # was read replaces it, and this one is dropped
+            applied = db.execute(
+                update(ChatSession)
+                .where(
+                    ChatSession.id == session_id,
+                    ChatSession.summary.is_not_distinct_from(previous),
+                )
+                .values(
+                    summary=summary,
+                    summary_token_count=len(self.encoding.encode(summary)),
+                )
+            ).rowcount
+            if not applied:
+                db.rollback()
+                logger.info(
+                    f"Chat session {session_id} was compacted meanwhile, "
+                    "dropping this summary"
+                )
+                return False
+
+            db.execute(
+                update(ChatMessage)
+                .where(ChatMessage.id.in_([message.id for message in compacted]))
+                .values(summarized=True)
+            )
+            db.commit()
+
+            CHAT_COMPACTIONS.inc()
+            logger.info(f"Compacted {count} messages of chat session {session_id}")
+            return True
+
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to compact chat session {session_id}: {str(e)}")
+            raise
+
+    def to_dict(self, db: Session, session: ChatSession) -> Dict[str, Any]:
+        """Serialize a session and its verbatim messages for the API"""
+        return {
+            "id": session.id,
+            "project_name": session.project_name,
+            "summary": session.summary,
+            "messages": [
+                {
+                    "role": message.role,
+                    "content": message.content,
+                    "token_count": message.token_count,
+                }
+                for message in self._recent_messages(db, session.id)
+            ],
+            "created_at": session.created_at.isoformat()
+            if session.created_at
+            else None,
+            "updated_at": session.updated_at.isoformat()
+            if session.updated_at
+            else None,
+        }
+
+    def _recent_messages(self, db: Session, session_id: int) -> List[ChatMessage]:
+        """Messages of a session not folded into the summary, oldest first"""
+        return list(
+            db.execute(
+                select(ChatMessage)
+                .where(
+                    ChatMessage.session_id == session_id,
+                    ChatMessage.summarized.is_(False),
+                )
+                .order_by(ChatMessage.id)
+            ).scalars()
+        )
+
+    def _history_tokens(self, db: Session, session_id: int) -> int:
+        """Tokens of the messages of a session not folded into the summary"""
+        return db.execute(
+            select(func.coalesce(func.sum(ChatMessage.token_count), 0)).where(
+                ChatMessage.session_id == session_id,
+                ChatMessage.summarized.is_(False),
+            )
+        ).scalar()
+
+    def _same_topic(
+        self, embedding: np.ndarray, previous: Optional[np.ndarray]
+    ) -> bool:
+        """Whether two retrieval embeddings are similar enough to share context"""
+        if previous is None or len(previous) != len(embedding):
+            return False
+
+        previous = np.asarray(previous, dtype=np.float32)
+        norms = np.linalg.norm(embedding) * np.linalg.norm(previous)
+        if norms == 0:
+            return False
+        return float(np.dot(embedding, previous) / norms) >= self.topic_similarity
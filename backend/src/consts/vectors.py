@@ -1 +1,41 @@
-VECTOR_DIMS = 1024
+import os
+
+# Dimensions requested from the embedding model. Vectors are stored at this
+# size; projects remember the dimensions they were indexed with.
+VECTOR_DIMS = int(os.getenv("EMBEDDING_DIMS", "768"))
+
+# Scale embeddings to unit length before storing and searching with them.
+# Models asked for fewer dimensions than they produce return unnormalized
+# vectors, which skews l2 and inner product rankings.
+EMBEDDING_NORMALIZE = os.getenv("EMBEDDING_NORMALIZE", "true").lower() == "true"
+
+# Distance used to rank chunks: "cosine", "l2" or "inner_product". The HNSW
+# index is built for this metric, queries with another one can't use it.
+VECTOR_DISTANCE_METRIC = os.getenv("VECTOR_DISTANCE_METRIC", "cosine")
+
+# Candidate list size of HNSW searches. Higher values trade latency for
+# recall; unset uses pgvector's default (40).
+HNSW_EF_SEARCH = (
+    int(os.getenv("HNSW_EF_SEARCH")) if os.getenv("HNSW_EF_SEARCH") else None
+)
+
+# HNSW iterative scan mode for searches scoped to some files or languages:
+# "strict_order" or "relaxed_order" keep scanning the index until enough
+# chunks pass the filter. Needs pgvector 0.8; empty disables it.
+HNSW_ITERATIVE_SCAN = os.getenv("HNSW_ITERATIVE_SCAN", "strict_order")
+
+# Precision of the HNSW index: "vector" (float32), "halfvec" (float16, half
+# the memory) or "binary" (1 bit per dimension, 1/32 of the memory, with
+# candidates reranked at full precision). Embeddings are always stored at
+# full precision.
+VECTOR_INDEX_PRECISION = os.getenv("VECTOR_INDEX_PRECISION", "vector")
+
+# Candidates fetched per result from a binary index before reranking
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "4"))
+
+# Attempts at embedding a chunk, counting the first, before it is given up
+# on and reported as failed
+EMBEDDING_MAX_ATTEMPTS = int(os.getenv("EMBEDDING_MAX_ATTEMPTS", "5"))
+
+# Chunks re-embedded per provider request when retrying failed embeddings
+EMBEDDING_RETRY_BATCH_SIZE = int(os.getenv("EMBEDDING_RETRY_BATCH_SIZE", "32"))
@@ -0,0 +1,443 @@
+import threading
+import numpy as np
+from abc import ABC, abstractmethod
+from loguru import logger
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from sqlalchemy import (
+    LargeBinary,
+    cast,
+    func,
+    inspect,
+    select,
+    text,
+    type_coerce,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from pgvector.sqlalchemy import BIT, HALFVEC, VECTOR
+
+from src.consts.vectors import (
+    HNSW_ITERATIVE_SCAN,
+    VECTOR_DISTANCE_METRIC,
+    VECTOR_INDEX_PRECISION,
+    VECTOR_RERANK_FACTOR,
+)
+from src.database.copy import copy_code_chunks, read_chunk_embeddings
+from src.database.pgvector import (
+    Base,
+    Project,
+    CodeFile,
+    CodeChunk,
+    engine,
+    init_db,
+    notify_chunks_changed,
+)
+from src.vectors.flat_index import ProjectIndex, load_project_index
+from src.vectors.scope import SearchScope
+
+# Comparator of the embedding column for each distance metric
+DISTANCE_FUNCTIONS = {
+    "cosine": "cosine_distance",
+    "l2": "l2_distance",
+    "inner_product": "max_inner_product",
+}
+
+
+class StorageBackend(ABC):
+    """
+    What differs between the databases projects can be stored in.
+
+    Projects, files, chunk metadata and jobs are the same SQLAlchemy models
+    everywhere. How embeddings are written, read and searched, how other
+    processes learn about changed chunks, and a few SQL constructs are not.
+    """
+
+    # Name of the backend, also used as a metric label
+    name = ""
+
+    @abstractmethod
+    def init_db(self) -> None:
+        """Create the schema, or bring an existing one up to date"""
+
+    @abstractmethod
+    def insert(self, table: Any) -> Any:
+        """An INSERT supporting on_conflict_do_update for the database"""
+
+    @abstractmethod
+    def seconds_ago(self, parameter: str) -> str:
+        """
+        SQL for the current time minus a number of seconds.
+
+        Args:
+            parameter: Name of the bound parameter holding the seconds
+
+        Returns:
+            SQL expression usable in text() statements
+        """
+
+    @abstractmethod
+    def write_chunks(
+        self,
+        db: Session,
+        project_id: int,
+        file_id: Union[int, Sequence[int]],
+        chunks: List[Dict[str, Any]],
+        embeddings: Optional[np.ndarray],
+        embedding_version_id: Optional[int] = None,
+    ) -> None:
+        """
+        Insert chunks in the session's transaction.
+
+        Args:
+            db: Database session
+            project_id: ID of the project the file belongs to
+            file_id: ID of the file the chunks belong to, or of each chunk's
+                file
+            chunks: List of code chunks with start_line, end_line and content
+            embeddings: Matrix of embeddings, one row per chunk, or None to
+                store the chunks as pending an embedding
+            embedding_version_id: Embedding version of the embeddings
+        """
+
+    @abstractmethod
+    def read_chunk_embeddings(
+        self, db: Session, project_id: int, dims: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Read the IDs and embeddings of a project's embedded chunks.
+
+        Args:
+            db: Database session
+            project_id: ID of the project
+            dims: Dimensions of the embeddings to read
+
+        Returns:
+            Tuple of chunk IDs and the matrix of their embeddings, ordered by ID
+        """
+
+    @abstractmethod
+    def chunks_changed(self, db: Session, project_id: int) -> None:
+        """
+        Record that a project's chunks changed, taking effect when the
+        session's transaction commits.
+
+        Args:
+            db: Database session
+            project_id: ID of the project
+        """
+
+    @abstractmethod
+    def search(
+        self,
+        db: Session,
+        project: Project,
+        query_embedding: np.ndarray,
+        limit: int,
+        ef_search: Optional[int] = None,
+        scope: Optional[SearchScope] = None,
+    ) -> List[Any]:
+        """
+        Find the chunks of a project nearest to an embedding.
+
+        Args:
+            db: Database session
+            project: Project to search
+            query_embedding: Embedding with the project's dimensions
+            limit: Maximum number of results
+            ef_search: HNSW candidate list size, for backends using HNSW
+            scope: Optional files, directories and languages to search in,
+                relative to the project root
+
+        Returns:
+            Rows with id, content, start_line, end_line, file_path,
+            language and distance, nearest first
+        """
+
+
+class PostgresBackend(StorageBackend):
+    """
+    Postgres with pgvector, for shared deployments: chunks are written with
+    binary COPY, searched through HNSW indexes, and changes are announced
+    with NOTIFY.
+    """
+
+    name = "postgres"
+
+    def init_db(self) -> None:
+        init_db()
+
+    def insert(self, table: Any) -> Any:
+        return postgresql.insert(table)
+
+    def seconds_ago(self, parameter: str) -> str:
+        return f"now() - make_interval(secs => :{parameter})"
+
+    def write_chunks(
+        self, db, project_id, file_id, chunks, embeddings, embedding_version_id=None
+    ) -> None:
+        copy_code_chunks(
+            db, project_id, file_id, chunks, embeddings, embedding_version_id
+        )
+
+    def read_chunk_embeddings(self, db, project_id, dims):
+        return read_chunk_embeddings(db, project_id, dims)
+
+    def chunks_changed(self, db, project_id) -> None:
+        notify_chunks_changed(db, project_id)
+
+    def search(self, db, project, query_embedding, limit, ef_search=None, scope=None):
+        # Only applies to the current transaction
+        if ef_search is not None:
+            db.execute(text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+
+        # Without iterative scans, HNSW returns its ef_search nearest chunks
+        # before filtering, which a narrow scope can leave empty
+        if scope and HNSW_ITERATIVE_SCAN:
+            db.execute(text(f"SET LOCAL hnsw.iterative_scan = {HNSW_ITERATIVE_SCAN}"))
+
+        nearest, distance = self._search_clauses(
+            project.id, query_embedding, limit, scope, project.embedding_version_id
+        )
+        stmt = (
+            select(
+                CodeChunk.id,
+                CodeChunk.content,
+                CodeChunk.start_line,
+                CodeChunk.end_line,
+                CodeFile.file_path,
+                CodeFile.language,
+                distance.label("distance"),
+            )
+            .join(CodeFile, CodeChunk.file_id == CodeFile.id)
+            .where(nearest)
+            .order_by(distance)
+            .limit(limit)
+        )
+
+        return db.execute(stmt).fetchall()
+
+    def _search_clauses(
+        self,
+        project_id: int,
+        query_embedding: np.ndarray,
+        limit: int,
+        scope: Optional[SearchScope] = None,
+        embedding_version_id: Optional[int] = None,
+    ) -> Tuple[Any, Any]:
+        """
+        Build the filter and ordering of a nearest chunk search.
+
+        The ordering must be the expression create_vector_index indexed, and
+        the filter must include its predicate, for Postgres to use the index.
+
+        Args:
+            project_id: ID of the project to search
+            query_embedding: Embedding of the project's dimensions
+            limit: Maximum number of results
+            scope: Optional files, directories and languages to search in
+            embedding_version_id: Embedding version the query was embedded
+                with. Chunks of other versions are left out, so a search
+                running into a project's switch to a new version finds
+                nothing rather than chunks it can't be compared with.
+
+        Returns:
+            Tuple of the WHERE clause and the ORDER BY expression
+        """
+        dims = len(query_embedding)
+        distance = DISTANCE_FUNCTIONS[VECTOR_DISTANCE_METRIC]
+        in_project = (CodeChunk.project_id == project_id) & (
+            func.vector_dims(CodeChunk.embedding) == dims
+        )
+        if embedding_version_id is not None:
+            in_project &= CodeChunk.embedding_version_id == embedding_version_id
+
+        # A filter on code_chunks itself, so it applies during the index
+        # scan, including the binary candidate scan
+        files = scope.clause() if scope else None
+        if files is not None:
+            in_project &= CodeChunk.file_id.in_(
+                select(CodeFile.id).where(CodeFile.project_id == project_id, files)
+            )
+
+        if VECTOR_INDEX_PRECISION == "binary":
+            # Over-fetch by hamming distance between the quantized vectors,
+            # then rerank the candidates at full precision
+            hamming = cast(
+                func.binary_quantize(CodeChunk.embedding), BIT(dims)
+            ).hamming_distance(
+                func.binary_quantize(cast(query_embedding, VECTOR(dims)))
+            )
+            candidates = (
+                select(CodeChunk.id)
+                .where(in_project)
+                .order_by(hamming)
+                .limit(limit * VECTOR_RERANK_FACTOR)
+            )
+            return (
+                CodeChunk.id.in_(candidates.scalar_subquery()),
+                getattr(CodeChunk.embedding, distance)(query_embedding),
+            )
+
+        vector_type = (
+            HALFVEC(dims) if VECTOR_INDEX_PRECISION == "halfvec" else VECTOR(dims)
+        )
+        return (
+            in_project,
+            getattr(cast(CodeChunk.embedding, vector_type), distance)(query_embedding),
+        )
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    A local SQLite file, for single-user installs that shouldn't need a
+    database server. Embeddings are stored as float32 blobs and searched
+    exactly in memory; a project's embeddings are read once and kept until
+    its chunks change.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, metric: str = VECTOR_DISTANCE_METRIC):
+        self.metric = metric
+        self._indexes: Dict[Tuple[int, Any], ProjectIndex] = {}
+        self._lock = threading.Lock()
+
+    def init_db(self) -> None:
+        try:
+            Base.metadata.create_all(bind=engine)
+            self._upgrade_schema()
+            logger.info("Database initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize database: {str(e)}")
+            raise
+
+    def _upgrade_schema(self) -> None:
+        """
+        Add columns and indexes added to the models since the file was
+        created. create_all() only creates missing tables, and SQLite can
+        only add columns that may be NULL, which is all that has been needed
+        so far.
+        """
+        existing = inspect(engine)
+        with engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                columns = {
+                    column["name"] for column in existing.get_columns(table.name)
+                }
+                for column in table.columns:
+                    if column.name in columns or not column.nullable:
+                        continue
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(
+                        text(
+                            f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                        )
+                    )
+                    logger.debug(f"Added column {table.name}.{column.name}")
+
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
+
+    def insert(self, table: Any) -> Any:
+        return sqlite.insert(table)
+
+    def seconds_ago(self, parameter: str) -> str:
+        return f"datetime(now(), '-' || :{parameter} || ' seconds')"
+
+    def write_chunks(
+        self, db, project_id, file_id, chunks, embeddings, embedding_version_id=None
+    ) -> None:
+        if not chunks:
+            return
+
+        if embeddings is None:
+            vectors = [None] * len(chunks)
+            state, attempts, version = "pending", 1, None
+        else:
+            vectors = np.asarray(embeddings, dtype=np.float32)
+            state, attempts, version = "embedded", 0, embedding_version_id
+
+        file_ids = (
+            [file_id] * len(chunks) if isinstance(file_id, int) else list(file_id)
+        )
+        db.execute(
+            self.insert(CodeChunk),
+            [
+                {
+                    "project_id": project_id,
+                    "file_id": chunk_file_id,
+                    "start_line": chunk["start_line"],
+                    "end_line": chunk["end_line"],
+                    "content": chunk["content"],
+                    "embedding": vector,
+                    "embedding_state": state,
+                    "embedding_attempts": attempts,
+                    "embedding_version_id": version,
+                }
+                for chunk, vector, chunk_file_id in zip(chunks, vectors, file_ids)
+            ],
+        )
+
+    def read_chunk_embeddings(self, db, project_id, dims):
+        # Raw bytes, joined and decoded in one go
+        blob = type_coerce(CodeChunk.embedding, LargeBinary)
+        rows = db.execute(
+            select(CodeChunk.id, blob)
+            .where(
+                CodeChunk.project_id == project_id,
+                CodeChunk.embedding_state == "embedded",
+                func.length(blob) == 4 * dims,
+            )
+            .order_by(CodeChunk.id)
+        ).fetchall()
+
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        matrix = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32)
+        return ids, matrix.reshape(len(rows), dims)
+
+    def chunks_changed(self, db, project_id) -> None:
+        db.execute(
+            update(Project)
+            .where(Project.id == project_id)
+            .values(chunks_version=Project.chunks_version + 1)
+        )
+
+    def search(self, db, project, query_embedding, limit, ef_search=None, scope=None):
+        if not project.embedding_dim:
+            return []
+
+        # IDs and versions start over if the database is recreated
+        key = (project.id, project.created_at)
+        with self._lock:
+            index = self._indexes.get(key)
+
+        if (
+            index is None
+            or index.version != project.chunks_version
+            or index.dims != len(query_embedding)
+        ):
+            index = load_project_index(db, project, self)
+            with self._lock:
+                self._indexes[key] = index
+
+        return index.search(query_embedding, limit, self.metric, scope)
+
+
+def get_backend(dialect: str) -> StorageBackend:
+    """
+    The storage backend for a database.
+
+    Args:
+        dialect: SQLAlchemy dialect name of the database
+
+    Returns:
+        The backend
+    """
+    if dialect == "sqlite":
+        return SQLiteBackend()
+    return PostgresBackend()
+
+
+# Backend of the configured DATABASE_URL
+backend = get_backend(engine.dialect.name)
@@ -0,0 +1,183 @@
+import io
+import struct
+import itertools
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from sqlalchemy.orm import Session
+
+# Columns written by copy_code_chunks, in the order they are encoded
+CODE_CHUNK_COPY_COLUMNS = (
+    "project_id",
+    "file_id",
+    "start_line",
+    "end_line",
+    "content",
+    "embedding",
+    "embedding_state",
+    "embedding_attempts",
+    "embedding_version_id",
+)
+
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+COPY_TRAILER = struct.pack(">h", -1)
+COPY_NULL = struct.pack(">i", -1)
+
+
+def encode_code_chunks(
+    project_id: int,
+    file_id: Union[int, Sequence[int]],
+    chunks: List[Dict[str, Any]],
+    embeddings: Optional[np.ndarray],
+    embedding_version_id: Optional[int] = None,
+) -> bytes:
+    """
+    Encode chunks as a Postgres binary COPY stream.
+
+    Embeddings are converted to big-endian float32 in one pass and written
+    in pgvector's binary format (dimensions, an unused field, then the
+    values), so no Python float is created per dimension.
+
+    Args:
+        project_id: ID of the project the file belongs to
+        file_id: ID of the file the chunks belong to, or of each chunk's file
+        chunks: List of code chunks with start_line, end_line and content
+        embeddings: Matrix of embeddings, one row per chunk, or None to
+            store the chunks as pending an embedding
+        embedding_version_id: Embedding version of the embeddings
+
+    Returns:
+        The COPY payload
+    """
+    # State, attempts and version, the same for every chunk
+    if embeddings is None:
+        vectors = [None] * len(chunks)
+        vector_header = None
+        state = _encode_text("pending") + struct.pack(">ii", 4, 1) + COPY_NULL
+    else:
+        vectors = np.ascontiguousarray(embeddings, dtype=">f4")
+        dims = vectors.shape[1]
+        vector_header = struct.pack(">iHH", 4 + 4 * dims, dims, 0)
+        version = (
+            COPY_NULL
+            if embedding_version_id is None
+            else struct.pack(">ii", 4, embedding_version_id)
+        )
+        state = _encode_text("embedded") + struct.pack(">ii", 4, 0) + version
+
+    project = struct.pack(">hii", len(CODE_CHUNK_COPY_COLUMNS), 4, project_id)
+    if isinstance(file_id, int):
+        file_ids = itertools.repeat(project + struct.pack(">ii", 4, file_id))
+    else:
+        file_ids = (project + struct.pack(">ii", 4, int(i)) for i in file_id)
+
+    buffer = io.BytesIO()
+    buffer.write(COPY_HEADER)
+    for chunk, vector, ids in zip(chunks, vectors, file_ids):
+        buffer.write(ids)
+        buffer.write(struct.pack(">iiii", 4, chunk["start_line"], 4, chunk["end_line"]))
+        buffer.write(_encode_text(chunk["content"]))
+        if vector is None:
+            buffer.write(COPY_NULL)
+        else:
+            buffer.write(vector_header)
+            buffer.write(vector.data)
+        buffer.write(state)
+    buffer.write(COPY_TRAILER)
+
+    return buffer.getvalue()
+
+
+def _encode_text(value: str) -> bytes:
+    encoded = value.encode("utf-8")
+    return struct.pack(">i", len(encoded)) + encoded
+
+
+def copy_code_chunks(
+    db: Session,
+    project_id: int,
+    file_id: Union[int, Sequence[int]],
+    chunks: List[Dict[str, Any]],
+    embeddings: Optional[np.ndarray],
+    embedding_version_id: Optional[int] = None,
+) -> None:
+    """
+    Insert chunks with a binary COPY in the session's transaction.
+
+    Args:
+        db: Database session
+        project_id: ID of the project the file belongs to
+        file_id: ID of the file the chunks belong to, or of each chunk's file
+        chunks: List of code chunks with start_line, end_line and content
+        embeddings: Matrix of embeddings, one row per chunk, or None to
+            store the chunks as pending an embedding
+        embedding_version_id: Embedding version of the embeddings
+    """
+    if not chunks:
+        return
+
+    payload = encode_code_chunks(
+        project_id, file_id, chunks, embeddings, embedding_version_id
+    )
+    columns = ", ".join(CODE_CHUNK_COPY_COLUMNS)
+
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY code_chunks ({columns}) FROM STDIN WITH (FORMAT BINARY)",
+            io.BytesIO(payload),
+        )
+    finally:
+        cursor.close()
+
+
+def read_chunk_embeddings(
+    db: Session, project_id: int, dims: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Read the IDs and embeddings of a project's embedded chunks with a binary
+    COPY, decoding every row at once into a float32 matrix.
+
+    Args:
+        db: Database session
+        project_id: ID of the project
+        dims: Dimensions of the embeddings to read
+
+    Returns:
+        Tuple of chunk IDs and the matrix of their embeddings, ordered by ID
+    """
+    buffer = io.BytesIO()
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"""
+            COPY (
+                SELECT id, embedding FROM code_chunks
+                WHERE project_id = {int(project_id)}
+                  AND embedding_state = 'embedded'
+                  AND vector_dims(embedding) = {int(dims)}
+                ORDER BY id
+            ) TO STDOUT WITH (FORMAT BINARY)
+            """,
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+    # Every row has the same size: field count, then the length and value
+    # of the ID and of the vector
+    row = np.dtype(
+        [
+            ("field_count", ">i2"),
+            ("id_length", ">i4"),
+            ("id", ">i4"),
+            ("vector_length", ">i4"),
+            ("dims", ">u2"),
+            ("unused", ">u2"),
+            ("values", ">f4", (dims,)),
+        ]
+    )
+    payload = buffer.getbuffer()
+    count = (len(payload) - len(COPY_HEADER) - len(COPY_TRAILER)) // row.itemsize
+    rows = np.frombuffer(payload, dtype=row, count=count, offset=len(COPY_HEADER))
+
+    return rows["id"].astype(np.int64), rows["values"].astype(np.float32)
@@ -0,0 +1,65 @@
+import os
+import numpy as np
+from datetime import datetime
+from sqlalchemy import event, LargeBinary
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import now
+from sqlalchemy.types import TypeDecorator
+
+
+class EmbeddingBlob(TypeDecorator):
+    """Embeddings stored as float32 bytes, since SQLite has no vector type"""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return np.asarray(value, dtype=np.float32).tobytes()
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return np.frombuffer(value, dtype=np.float32)
+
+
+@compiles(now, "sqlite")
+def _compile_now(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP is UTC without fractions of a second, while
+    # timestamps bound from Python are local with microseconds. now() is
+    # registered on every connection to match them.
+    return "now()"
+
+
+def _now() -> str:
+    return datetime.now().isoformat(" ")
+
+
+def configure_sqlite(engine: Engine) -> None:
+    """
+    Prepare an engine for use as an embedded database: create the file's
+    directory, and set up every connection for concurrent readers and the
+    SQL functions the models and queries rely on.
+
+    Args:
+        engine: Engine of a SQLite database
+    """
+    database = engine.url.database
+    if database and database != ":memory:":
+        directory = os.path.dirname(os.path.abspath(database))
+        os.makedirs(directory, exist_ok=True)
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.create_function("now", 0, _now)
+
+        cursor = dbapi_connection.cursor()
+        # Readers don't block the indexer's writes, and writers wait for
+        # each other instead of failing
+        cursor.execute("PRAGMA journal_mode = WAL")
+        cursor.execute("PRAGMA synchronous = NORMAL")
+        cursor.execute("PRAGMA busy_timeout = 30000")
+        cursor.execute("PRAGMA foreign_keys = ON")
+        cursor.close()
@@ -0,0 +1,308 @@
+import os
+from loguru import logger
+from typing import List, Dict, Any, Optional
+from sqlalchemy import select, update, text, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from src.database.backends import backend
+from src.database.pgvector import IndexJob
+
+# Seconds without a heartbeat after which a running job is considered lost
+JOB_STALE_AFTER = int(os.getenv("INDEX_JOB_STALE_AFTER", "120"))
+
+# Puts running jobs back to pending. A job is cancelled instead if that was
+# requested, and failed when a newer job for the same project is already
+# pending, since that job will index the project anyway.
+RELEASE_JOBS_SQL = """
+    UPDATE index_jobs AS j SET
+        status = CASE
+            WHEN j.cancel_requested THEN 'cancelled'
+            WHEN EXISTS (
+                SELECT 1 FROM index_jobs p
+                WHERE p.project_name = j.project_name
+                  AND p.status = 'pending'
+            ) THEN 'failed'
+            ELSE 'pending'
+        END,
+        error = :error,
+        worker_id = NULL
+    WHERE j.status = 'running'
+"""
+
+
+class JobQueue:
+    """
+    Durable queue of indexing jobs stored in the database.
+
+    Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED so any number of
+    workers can poll the same table. Partial unique indexes on index_jobs
+    guarantee at most one pending and one running job per project. SQLite
+    ignores the row locks, but only lets one transaction write at a time.
+    """
+
+    def enqueue(
+        self,
+        db: Session,
+        project_name: str,
+        project_path: str,
+        file_extensions: List[str],
+        exclude_patterns: List[str],
+    ) -> IndexJob:
+        """
+        Queue an indexing job for a project. If a job for the project is
+        already pending, it is updated with the new options and returned
+        instead of queueing a duplicate.
+
+        Args:
+            db: Database session
+            project_name: Name of the project
+            project_path: Path to the project root
+            file_extensions: List of file extensions to include
+            exclude_patterns: List of patterns to exclude
+
+        Returns:
+            The pending job
+        """
+        try:
+            stmt = backend.insert(IndexJob).values(
+                project_name=project_name,
+                project_path=project_path,
+                file_extensions=file_extensions,
+                exclude_patterns=exclude_patterns,
+                status="pending",
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[IndexJob.project_name],
+                index_where=text("status = 'pending'"),
+                set_={
+                    "project_path": stmt.excluded.project_path,
+                    "file_extensions": stmt.excluded.file_extensions,
+                    "exclude_patterns": stmt.excluded.exclude_patterns,
+                },
+            ).returning(IndexJob.id)
+
+            job_id = db.execute(stmt).scalar_one()
+            db.commit()
+
+            return db.get(IndexJob, job_id)
+
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to enqueue indexing job: {str(e)}")
+            raise
+
+    def claim(self, db: Session, worker_id: str) -> Optional[IndexJob]:
+        """
+        Claim the oldest pending job whose project has no running job.
+
+        Args:
+            db: Database session
+            worker_id: Identifier of the claiming worker
+
+        Returns:
+            The claimed job, or None if there is nothing to do
+        """
+        running = IndexJob.__table__.alias("running")
+        candidate = (
+            select(IndexJob.id)
+            .where(
+                IndexJob.status == "pending",
+                ~select(running.c.id)
+                .where(
+                    running.c.project_name == IndexJob.project_name,
+                    running.c.status == "running",
+                )
+                .exists(),
+            )
+            .order_by(IndexJob.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+
+        try:
+            job_id = db.execute(
+                update(IndexJob)
+                .where(IndexJob.id == candidate)
+                .values(
+                    status="running",
+                    worker_id=worker_id,
+                    attempts=IndexJob.attempts + 1,
+                    started_at=func.now(),
+                    heartbeat_at=func.now(),
+                )
+                .returning(IndexJob.id)
+            ).scalar_one_or_none()
+            db.commit()
+
+        except IntegrityError:
+            # Another worker started a job for the same project concurrently
+            db.rollback()
+            return None
+
+        if job_id is None:
+            return None
+
+        logger.info(f"Worker {worker_id} claimed indexing job {job_id}")
+        return db.get(IndexJob, job_id)
+
+    def heartbeat(self, db: Session, job_id: int) -> bool:
+        """
+        Record that a running job is still alive.
+
+        Args:
+            db: Database session
+            job_id: ID of the running job
+
+        Returns:
+            True if cancellation of the job has been requested
+        """
+        cancel_requested = db.execute(
+            update(IndexJob)
+            .where(IndexJob.id == job_id)
+            .values(heartbeat_at=func.now())
+            .returning(IndexJob.cancel_requested)
+        ).scalar_one_or_none()
+        db.commit()
+
+        return bool(cancel_requested)
+
+    def finish(
+        self, db: Session, job_id: int, status: str, error: Optional[str] = None
+    ) -> None:
+        """
+        Mark a running job as finished.
+
+        Args:
+            db: Database session
+            job_id: ID of the running job
+            status: Final status, one of completed, failed or cancelled
+            error: Error message for failed jobs
+        """
+        db.execute(
+            update(IndexJob)
+            .where(IndexJob.id == job_id)
+            .values(status=status, error=error, finished_at=func.now())
+        )
+        db.commit()
+
+    def cancel(self, db: Session, job_id: int) -> Optional[IndexJob]:
+        """
+        Cancel a job. Pending jobs are cancelled immediately, running jobs
+        are flagged and stop after the file they are currently indexing.
+
+        Args:
+            db: Database session
+            job_id: ID of the job
+
+        Returns:
+            The job, or None if it does not exist
+        """
+        db.execute(
+            update(IndexJob)
+            .where(IndexJob.id == job_id, IndexJob.status == "pending")
+            .values(status="cancelled", finished_at=func.now())
+        )
+        db.execute(
+            update(IndexJob)
+            .where(IndexJob.id == job_id, IndexJob.status == "running")
+            .values(cancel_requested=True)
+        )
+        db.commit()
+
+        return db.get(IndexJob, job_id)
+
+    def release(self, db: Session, job_id: int) -> None:
+        """
+        Hand a running job back to the queue, e.g. when its worker shuts
+        down, so another worker resumes it.
+
+        Args:
+            db: Database session
+            job_id: ID of the running job
+        """
+        db.execute(
+            text(RELEASE_JOBS_SQL + " AND j.id = :job_id"),
+            {"error": None, "job_id": job_id},
+        )
+        db.commit()
+
+    def requeue_stale(self, db: Session) -> int:
+        """
+        Return running jobs whose worker stopped sending heartbeats to the
+        queue, so another worker resumes them.
+
+        Args:
+            db: Database session
+
+        Returns:
+            Number of stale jobs found
+        """
+        result = db.execute(
+            text(
+                RELEASE_JOBS_SQL
+                + f" AND j.heartbeat_at < {backend.seconds_ago('stale_after')}"
+            ),
+            {"error": "worker stopped responding", "stale_after": JOB_STALE_AFTER},
+        )
+        db.commit()
+
+        if result.rowcount:
+            logger.warning(f"Requeued {result.rowcount} stale indexing jobs")
+        return result.rowcount
+
+    def get(self, db: Session, job_id: int) -> Optional[IndexJob]:
+        """
+        Get a job by ID.
+
+        Args:
+            db: Database session
+            job_id: ID of the job
+
+        Returns:
+            The job, or None if it does not exist
+        """
+        return db.get(IndexJob, job_id)
+
+    def list_jobs(
+        self, db: Session, project_name: Optional[str] = None, limit: int = 50
+    ) -> List[IndexJob]:
+        """
+        List the most recent jobs, optionally for a single project.
+
+        Args:
+            db: Database session
+            project_name: Name of the project to filter by
+            limit: Maximum number of jobs to return
+
+        Returns:
+            List of jobs, newest first
+        """
+        stmt = select(IndexJob).order_by(IndexJob.id.desc()).limit(limit)
+        if project_name:
+            stmt = stmt.where(IndexJob.project_name == project_name)
+
+        return list(db.execute(stmt).scalars())
+
+    def to_dict(self, job: IndexJob) -> Dict[str, Any]:
+        """
+        Serialize a job for API responses.
+
+        Args:
+            job: The job to serialize
+
+        Returns:
+            Dictionary with job information
+        """
+        return {
+            "job_id": job.id,
+            "project_name": job.project_name,
+            "status": job.status,
+            "cancel_requested": job.cancel_requested,
+            "attempts": job.attempts,
+            "error": job.error,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "started_at": job.started_at.isoformat() if job.started_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        }
@@ -0,0 +1,208 @@
+import os
+import sys
+import socket
+import signal
+import threading
+import multiprocessing
+from typing import List, Tuple
+from loguru import logger
+from prometheus_client import start_http_server
+
+from src.database.pgvector import get_db
+from src.jobs.queue import JobQueue
+
+# Number of worker processes started by `python -m src.jobs.worker`
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "2"))
+
+# Seconds to wait between polls when the queue is empty
+POLL_INTERVAL = float(os.getenv("INDEX_JOB_POLL_INTERVAL", "1.0"))
+
+# Seconds between heartbeats of a running job
+HEARTBEAT_INTERVAL = float(os.getenv("INDEX_JOB_HEARTBEAT_INTERVAL", "10.0"))
+
+# Number of indexing workers the API runs as threads of its own process, so
+# a single-user setup indexes without `python -m src.jobs.worker`. Unset runs
+# one with embedded backends such as SQLite and none with Postgres.
+API_INDEX_WORKERS = os.getenv("API_INDEX_WORKERS")
+
+# When set, worker N serves Prometheus metrics on port WORKER_METRICS_PORT + N
+WORKER_METRICS_PORT = os.getenv("WORKER_METRICS_PORT")
+
+
+class IndexWorker:
+    """
+    Runs indexing jobs from the job queue, one at a time. While the queue is
+    empty, re-embeds projects moving to a new embedding model.
+
+    Workers usually run in their own processes, separate from the API, so
+    indexing load never competes with chat requests for the API's CPU and
+    threads. Single-user setups can run them inside the API instead, see
+    start_worker_threads.
+    """
+
+    def __init__(self, worker_id: str, vector_store=None):
+        # Imported here so each worker process builds its own services
+        from src.vectors.vector_store import VectorStore
+        from src.vectors.indexer import CodebaseIndexer
+        from src.vectors.migration import EmbeddingMigrator
+
+        self.worker_id = worker_id
+        self.queue = JobQueue()
+        vector_store = vector_store or VectorStore()
+        self.indexer = CodebaseIndexer(vector_store)
+        self.migrator = EmbeddingMigrator(vector_store.llm_service)
+
+    def run(self, stop: threading.Event) -> None:
+        """
+        Poll for and run jobs until stop is set.
+
+        Args:
+            stop: Event that ends the loop once the current job is done
+        """
+        logger.info(f"Indexing worker {self.worker_id} started")
+
+        while not stop.is_set():
+            try:
+                with get_db() as db:
+                    self.queue.requeue_stale(db)
+                    job = self.queue.claim(db, self.worker_id)
+
+                if job is None:
+                    delay = self.migrator.run_once()
+                    stop.wait(POLL_INTERVAL if delay is None else delay)
+                    continue
+
+                self.run_job(job, stop)
+
+            except Exception as e:
+                logger.error(f"Indexing worker {self.worker_id} error: {str(e)}")
+                stop.wait(POLL_INTERVAL)
+
+        logger.info(f"Indexing worker {self.worker_id} stopped")
+
+    def run_job(self, job, stop: threading.Event) -> None:
+        """
+        Run a single claimed job, sending heartbeats from a background thread
+        and stopping early if the job is cancelled or the worker shuts down.
+
+        Args:
+            job: The claimed job
+            stop: Event set when the worker is shutting down
+        """
+        cancelled = threading.Event()
+        done = threading.Event()
+
+        def heartbeat():
+            while not done.wait(HEARTBEAT_INTERVAL):
+                try:
+                    with get_db() as db:
+                        if self.queue.heartbeat(db, job.id):
+                            cancelled.set()
+                except Exception as e:
+                    logger.error(f"Failed to send heartbeat for job {job.id}: {e}")
+
+        heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+
+        try:
+            completed = self.indexer.index_codebase(
+                job.project_path,
+                job.project_name,
+                job.file_extensions,
+                job.exclude_patterns,
+                should_stop=lambda: cancelled.is_set() or stop.is_set(),
+            )
+            status, error = ("completed" if completed else "cancelled"), None
+
+        except Exception as e:
+            status, error = "failed", str(e)
+
+        finally:
+            done.set()
+            heartbeat_thread.join()
+
+        with get_db() as db:
+            if status == "cancelled" and not cancelled.is_set():
+                # Interrupted by shutdown: resume from the last stored file
+                self.queue.release(db, job.id)
+                status = "released"
+            else:
+                self.queue.finish(db, job.id, status, error)
+        logger.info(f"Indexing job {job.id} for {job.project_name} {status}")
+
+
+def _worker_process(index: int) -> None:
+    """
+    Entry point of a worker process.
+
+    Args:
+        index: Index of the worker within the pool
+    """
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    if WORKER_METRICS_PORT:
+        start_http_server(int(WORKER_METRICS_PORT) + index)
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{index}"
+    IndexWorker(worker_id).run(stop)
+
+
+def start_worker_threads(
+    count: int, vector_store=None
+) -> Tuple[threading.Event, List[threading.Thread]]:
+    """
+    Start indexing workers as threads of the calling process, sharing its
+    vector store and so its embedding scheduler.
+
+    Args:
+        count: Number of workers to start
+        vector_store: Vector store of the process, or None to build one
+
+    Returns:
+        Tuple of the event that stops the workers and their threads
+    """
+    stop = threading.Event()
+    threads = []
+    for i in range(count):
+        worker_id = f"{socket.gethostname()}-{os.getpid()}-api-{i}"
+        worker = IndexWorker(worker_id, vector_store)
+        thread = threading.Thread(
+            target=worker.run, args=(stop,), name=f"index-worker-{i}", daemon=True
+        )
+        thread.start()
+        threads.append(thread)
+    return stop, threads
+
+
+def main() -> None:
+    """
+    Start a pool of indexing worker processes and wait for them to exit.
+    """
+    logger.remove()
+    logger.add(sys.stderr, level="DEBUG")
+
+    # Spawn so each worker gets its own database engine and connections
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=_worker_process, args=(i,), name=f"index-worker-{i}")
+        for i in range(INDEX_WORKERS)
+    ]
+
+    for process in processes:
+        process.start()
+
+    logger.info(f"Started {len(processes)} indexing workers")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Workers received the interrupt too and hand back their jobs
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
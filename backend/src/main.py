@@ -1,33 +1,90 @@
+import os
 import sys
+import json
+import tempfile
 from loguru import logger
-from typing import List, Dict, Any, Optional
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from typing import AsyncIterator, Iterator, List, Dict, Any, Optional, Tuple
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Depends, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from starlette.background import BackgroundTask
 from contextlib import asynccontextmanager
 
-from src.database.pgvector import get_db_session, init_db
+from src.database.backends import backend
+from src.database.pgvector import (
+    ChatSession,
+    Project,
+    get_db,
+    get_db_session,
+    get_read_db,
+    get_read_db_session,
+)
 from src.vectors.vector_store import VectorStore
+from src.vectors.memory_index import MemoryIndex
+from src.vectors.overlay import OverlayBuilder
+from src.vectors.scope import SearchScope
 from src.vectors.indexer import CodebaseIndexer
+from src.vectors.snapshot import export_snapshot
+from src.vectors.symbols import SymbolIndex
+from src.agent.admission import (
+    AdmissionController,
+    Deadline,
+    DeadlineExceeded,
+    Rejected,
+    RequestCancelled,
+    RequestGate,
+)
 from src.agent.llm import LLMService
+from src.agent.sessions import ChatSessions
+from src.jobs.queue import JobQueue
+from src.jobs.worker import API_INDEX_WORKERS, start_worker_threads
+from src.telemetry.metrics import CHAT_REQUEST_SECONDS, CONTEXT_ASSEMBLY_SECONDS
+from src.telemetry.tracing import span
 
 # Set the logging level based on provided env
 logger.remove()
 logger.add(sys.stderr, level="DEBUG")
 
 # Initialize services
-vector_store = VectorStore()
 llm_service = LLMService()
-codebase_indexer = CodebaseIndexer(vector_store)
+# Embedded backends already search in memory
+memory_index = MemoryIndex() if backend.name == "postgres" else None
+vector_store = VectorStore(llm_service, memory_index)
+symbol_index = SymbolIndex()
+codebase_indexer = CodebaseIndexer(vector_store, symbol_index)
+job_queue = JobQueue()
+chat_sessions = ChatSessions(vector_store)
+overlay_builder = OverlayBuilder(codebase_indexer, llm_service)
+chat_gate = RequestGate(AdmissionController())
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Initialize the database on startup
-    init_db()
+    backend.init_db()
+
+    # Load hot projects into memory in the background, searches use
+    # Postgres until they are ready
+    if memory_index is not None:
+        memory_index.start()
+
+    # Run indexing jobs in this process when no separate workers are expected
+    worker_count = (
+        int(API_INDEX_WORKERS)
+        if API_INDEX_WORKERS
+        else (0 if backend.name == "postgres" else 1)
+    )
+    stop_workers, worker_threads = start_worker_threads(worker_count, vector_store)
+    if worker_threads:
+        logger.info(f"Started {len(worker_threads)} indexing workers in the API")
     yield
 
-    # Clean up resources on shutdown
-    pass
+    # Let the workers hand back their jobs on shutdown
+    stop_workers.set()
+    for thread in worker_threads:
+        thread.join()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -61,37 +118,63 @@ class IndexCodebaseRequest(BaseModel):
     ]
 
 
+class Buffer(BaseModel):
+    # Path of the file, relative to the project root or absolute
+    file_path: str
+    content: str
+    # Project of the file, found from its path when not given
+    project_name: Optional[str] = None
+
+
 class ChatRequest(BaseModel):
     project_name: str
     query: str
     chat_history: List[Dict[str, str]] = []
+    # Files or directories to restrict retrieval to, relative to the project
+    # root or absolute
     context_files: Optional[List[str]] = None
+    # Languages to restrict retrieval to, e.g. ["python", "lua"]
+    languages: Optional[List[str]] = None
+    # Other projects searched together with project_name
+    project_names: List[str] = []
+    # Session keeping the conversation on the server, chat_history is
+    # ignored when set
+    session_id: Optional[int] = None
+    # Unsaved buffers, searched instead of what was indexed of their files
+    buffers: List[Buffer] = []
 
 
 class ChatResponse(BaseModel):
     response: str
     context_files: List[Dict[str, Any]] = []
+    session_id: Optional[int] = None
+
+
+class CreateSessionRequest(BaseModel):
+    project_name: str
 
 
 @app.post("/index_codebase")
-async def index_codebase(
-    request: IndexCodebaseRequest, background_tasks: BackgroundTasks
-):
+async def index_codebase(request: IndexCodebaseRequest, db=Depends(get_db_session)):
     """
-    Index a codebase for vectorization. This is a long-running operation
-    that will be executed in the background.
+    Queue a codebase for indexing. This is a long-running operation that is
+    executed by the indexing workers (`python -m src.jobs.worker`). Requests
+    for a project that already has a pending job are merged into that job.
     """
     try:
-        # Start indexing in the background
-        background_tasks.add_task(
-            codebase_indexer.index_codebase,
-            request.project_path,
+        job = job_queue.enqueue(
+            db,
             request.project_name,
+            request.project_path,
             request.file_extensions,
             request.exclude_patterns,
         )
 
-        return {"status": "indexing_started", "project_name": request.project_name}
+        return {
+            "status": "queued",
+            "project_name": request.project_name,
+            "job_id": job.id,
+        }
     except Exception as e:
         logger.error(f"Failed to start indexing: {str(e)}")
         raise HTTPException(
@@ -99,8 +182,45 @@ async def index_codebase(
         )
 
 
+@app.get("/jobs")
+async def list_jobs(project_name: Optional[str] = None, db=Depends(get_db_session)):
+    """
+    List recent indexing jobs, optionally for a single project.
+    """
+    try:
+        jobs = job_queue.list_jobs(db, project_name)
+        return [job_queue.to_dict(job) for job in jobs]
+    except Exception as e:
+        logger.error(f"Failed to list jobs: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to list jobs: {str(e)}")
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: int, db=Depends(get_db_session)):
+    """
+    Get the status of an indexing job.
+    """
+    job = job_queue.get(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    return job_queue.to_dict(job)
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: int, db=Depends(get_db_session)):
+    """
+    Cancel an indexing job. Running jobs stop after their current file.
+    """
+    job = job_queue.cancel(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    return job_queue.to_dict(job)
+
+
 @app.get("/index_status/{project_name}")
-async def index_status(project_name: str, db=Depends(get_db_session)):
+async def index_status(project_name: str, db=Depends(get_read_db_session)):
     """
     Get the indexing status for a project.
     """
@@ -114,40 +234,453 @@ async def index_status(project_name: str, db=Depends(get_db_session)):
         )
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat_with_codebase(request: ChatRequest, db=Depends(get_db_session)):
+@app.get("/symbols/{project_name}")
+async def find_symbol(project_name: str, name: str, db=Depends(get_read_db_session)):
     """
-    Chat with the codebase using the LLM model and vector store.
+    Find where a symbol of a project is defined.
+    """
+    definitions = symbol_index.lookup(db, [project_name], [name])
+    return {
+        "project_name": project_name,
+        "name": name,
+        "definitions": [
+            {
+                "file_path": definition["file_path"],
+                "kind": definition["kind"],
+                "line": definition["line"],
+            }
+            for definition in definitions
+        ],
+    }
+
+
+@app.get("/repo_map/{project_name}")
+async def repo_map(project_name: str, db=Depends(get_read_db_session)):
+    """
+    Get the outline of a project's definitions sent with its questions.
+    """
+    project = db.query(Project).filter(Project.name == project_name).first()
+    if project is None:
+        raise HTTPException(status_code=404, detail=f"Project {project_name} not found")
+
+    return {"project_name": project_name, "repo_map": project.repo_map}
+
+
+@app.get("/snapshot/{project_name}")
+def snapshot(project_name: str):
+    """
+    Download a snapshot of a project's index, to import with
+    `python -m src.vectors.snapshot import` instead of indexing it again.
     """
+    fd, path = tempfile.mkstemp(prefix="nvim-llama-", suffix=".tar.gz")
+    os.close(fd)
+
     try:
-        # Retrieve relevant code chunks based on the query
-        context_chunks, context_files = vector_store.query_vectors(
-            db, request.project_name, request.query, limit=5
+        with get_read_db() as db:
+            export_snapshot(db, project_name, path)
+    except LookupError as e:
+        os.remove(path)
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        os.remove(path)
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        os.remove(path)
+        logger.error(f"Failed to export {project_name}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error exporting: {str(e)}")
+
+    return FileResponse(
+        path,
+        media_type="application/gzip",
+        filename=f"{project_name}.tar.gz",
+        background=BackgroundTask(os.remove, path),
+    )
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Expose Prometheus metrics.
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.post("/sessions")
+async def create_session(request: CreateSessionRequest, db=Depends(get_db_session)):
+    """
+    Start a chat session. Pass its ID to /chat to have the conversation kept
+    on the server.
+    """
+    try:
+        session = chat_sessions.create(db, request.project_name)
+        return chat_sessions.to_dict(db, session)
+    except Exception as e:
+        logger.error(f"Failed to create session: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Failed to create session: {str(e)}"
         )
 
-        # Format context
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: int, db=Depends(get_db_session)):
+    """
+    Get a chat session with its summary and the messages not summarized yet.
+    """
+    session = chat_sessions.get(db, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+
+    return chat_sessions.to_dict(db, session)
+
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: int, db=Depends(get_db_session)):
+    """
+    Delete a chat session and its messages.
+    """
+    if not chat_sessions.delete(db, session_id):
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+
+    return {"status": "deleted", "session_id": session_id}
+
+
+def compact_session(session_id: int) -> None:
+    """Summarize the older messages of a session, after the response is sent"""
+    with get_db() as db:
+        chat_sessions.compact(db, session_id)
+
+
+def format_path(chunk: Dict[str, Any], project_names: List[str]) -> str:
+    if len(project_names) == 1:
+        return chunk["file_path"]
+    return f"{chunk['project_name']}/{chunk['file_path']}"
+
+
+def event(event_type: str, **fields) -> str:
+    """A streamed chat event, as a line of JSON"""
+    return json.dumps({"type": event_type, **fields}) + "\n"
+
+
+def get_chat_session(request: ChatRequest, db: Session) -> Optional[ChatSession]:
+    """The session of a chat request, if it names one"""
+    if request.session_id is None:
+        return None
+
+    session = chat_sessions.get(db, request.session_id)
+    if session is None:
+        raise HTTPException(
+            status_code=404, detail=f"Session {request.session_id} not found"
+        )
+    return session
+
+
+def retrieve_context(
+    request: ChatRequest,
+    session: Optional[ChatSession],
+    project_names: List[str],
+    db: Session,
+    read_db: Session,
+    limit: int = 5,
+) -> List[Dict[str, Any]]:
+    """
+    Retrieve the code chunks a chat request is answered with.
+
+    Symbols the question names are looked up exactly, and the vector search
+    fills the rest of the context, if anything is left to fill.
+
+    Args:
+        request: The chat request
+        session: Its chat session, if any
+        project_names: Names of the projects to search
+        db: Database session on the primary, for the chat session
+        read_db: Database session for retrieval, possibly on a replica
+        limit: Maximum number of chunks
+
+    Returns:
+        The chunks, as VectorStore.query_vectors returns them
+    """
+    scope = SearchScope(request.context_files, request.languages)
+    overlay = (
+        overlay_builder.build(
+            read_db, project_names, [buffer.model_dump() for buffer in request.buffers]
+        )
+        if request.buffers
+        else None
+    )
+
+    context_chunks, _ = vector_store.get_chunks(
+        read_db,
+        symbol_index.resolve(
+            read_db, project_names, request.query, scope, overlay, limit=limit
+        ),
+    )
+    if len(context_chunks) >= limit:
+        return context_chunks
+
+    if session is not None:
+        chunks, _ = chat_sessions.retrieve(
+            db,
+            session,
+            request.query,
+            project_names,
+            scope,
+            limit=limit,
+            overlay=overlay,
+            read_db=read_db,
+        )
+    else:
+        chunks, _ = vector_store.query_vectors(
+            read_db,
+            project_names,
+            request.query,
+            limit=limit,
+            scope=scope,
+            overlay=overlay,
+        )
+
+    found = {chunk["id"] for chunk in context_chunks}
+    return (
+        context_chunks
+        + [chunk for chunk in chunks if chunk["id"] not in found][
+            : limit - len(context_chunks)
+        ]
+    )
+
+
+def build_prompt(
+    request: ChatRequest, session: Optional[ChatSession], db: Session
+) -> Dict[str, Any]:
+    """
+    Retrieve the code context of a chat request, and the history to send
+    with it.
+
+    Args:
+        request: The chat request
+        session: Its chat session, if any
+        db: Database session
+
+    Returns:
+        Dictionary with context, context_files, chat_history, summary and
+        project_context
+    """
+    project_names = [request.project_name] + [
+        name for name in request.project_names if name != request.project_name
+    ]
+
+    # Retrieval reads from a replica when there are any
+    with get_read_db(db) as read_db:
+        context_chunks = retrieve_context(request, session, project_names, db, read_db)
+        project = (
+            read_db.query(Project).filter(Project.name == request.project_name).first()
+        )
+        repo_map = project.repo_map if project is not None else None
+
+    # Files in order of their first chunk
+    context_files = {
+        (chunk["project_name"], chunk["file_path"]): None for chunk in context_chunks
+    }
+
+    # Format context. Paths are prefixed with their project when
+    # several projects were searched.
+    with span("chat.assemble_context", CONTEXT_ASSEMBLY_SECONDS):
         context_text = "\n\n".join(
             [
-                f"File: {chunk['file_path']}\n```{chunk['language']}\n{chunk['content']}\n```"
+                f"File: {format_path(chunk, project_names)}\n```{chunk['language']}\n{chunk['content']}\n```"
                 for chunk in context_chunks
             ]
         )
 
-        # Get response from LLM
-        response = llm_service.generate_response(
-            request.query, context_text, request.chat_history
+    # The history ends with the current query, like the chat_history
+    # clients send
+    if session is not None:
+        chat_history = chat_sessions.history(db, session) + [
+            {"role": "user", "content": request.query}
+        ]
+    else:
+        chat_history = request.chat_history
+
+    return {
+        "context": context_text,
+        "context_files": [
+            {"project_name": project_name, "file_path": file_path}
+            for project_name, file_path in context_files
+        ],
+        "chat_history": chat_history,
+        "summary": session.summary if session is not None else None,
+        "project_context": repo_map,
+    }
+
+
+def flight_key(request: ChatRequest, stream: bool) -> Optional[str]:
+    """
+    What identifies identical chat requests, which can share one answer.
+    Requests in a session can't, their answer becomes part of it.
+    """
+    if request.session_id is not None:
+        return None
+    return f"{'stream' if stream else 'chat'}:{request.model_dump_json()}"
+
+
+def chat_error(e: Exception) -> HTTPException:
+    """The HTTP error of a chat request that failed before answering"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, Rejected):
+        return HTTPException(
+            status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)}
         )
+    if isinstance(e, RequestCancelled):
+        # Nobody is left to read it
+        return HTTPException(status_code=499, detail=str(e))
+    if isinstance(e, DeadlineExceeded):
+        return HTTPException(status_code=504, detail=str(e))
 
-        return ChatResponse(
-            response=response,
-            context_files=[{"file_path": file["file_path"]} for file in context_files],
+    logger.error(f"Failed to generate response: {str(e)}")
+    return HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat_with_codebase(
+    request: ChatRequest,
+    http_request: Request,
+    background_tasks: BackgroundTasks,
+):
+    """
+    Chat with the codebase using the LLM model and vector store.
+    """
+
+    def answer(deadline: Deadline) -> Iterator[Tuple[ChatResponse, bool]]:
+        with span("chat", CHAT_REQUEST_SECONDS, project_name=request.project_name):
+            # Connections are only taken once the request is admitted, and
+            # returned before generation starts
+            with get_db() as db:
+                session = get_chat_session(request, db)
+                prompt = build_prompt(request, session, db)
+            deadline.check()
+
+            # Get response from LLM
+            response = llm_service.generate_response(
+                request.query,
+                prompt["context"],
+                prompt["chat_history"],
+                prompt["summary"],
+                prompt["project_context"],
+            )
+
+            compact = False
+            if request.session_id is not None:
+                with get_db() as db:
+                    session = chat_sessions.get(db, request.session_id)
+                    compact = session is not None and chat_sessions.add_turn(
+                        db, session, request.query, response
+                    )
+
+        yield (
+            ChatResponse(
+                response=response,
+                context_files=prompt["context_files"],
+                session_id=request.session_id,
+            ),
+            compact,
+        )
+
+    try:
+        [(response, compact)] = await chat_gate.collect(
+            request.project_name,
+            flight_key(request, stream=False),
+            answer,
+            http_request.is_disconnected,
         )
     except Exception as e:
-        logger.error(f"Failed to generate response: {str(e)}")
-        raise HTTPException(
-            status_code=500, detail=f"Error generating response: {str(e)}"
+        raise chat_error(e)
+
+    if compact:
+        background_tasks.add_task(compact_session, request.session_id)
+    return response
+
+
+@app.post("/chat/stream")
+async def stream_chat_with_codebase(request: ChatRequest):
+    """
+    Chat with the codebase, streaming the response as it is generated.
+
+    The response is newline-delimited JSON: a "context" event with the
+    context files, "token" events with the response text, then "done", or
+    "error" if generation failed.
+    """
+
+    def answer(deadline: Deadline) -> Iterator[str]:
+        # The database session is closed before generation starts
+        with get_db() as db:
+            session = get_chat_session(request, db)
+            prompt = build_prompt(request, session, db)
+
+        yield event(
+            "context",
+            context_files=prompt["context_files"],
+            session_id=request.session_id,
         )
 
+        parts = []
+        try:
+            for token in llm_service.stream_response(
+                request.query,
+                prompt["context"],
+                prompt["chat_history"],
+                prompt["summary"],
+                prompt["project_context"],
+            ):
+                deadline.check()
+                parts.append(token)
+                yield event("token", content=token)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to stream response: {str(e)}")
+            yield event("error", message=str(e))
+            return
+
+        if request.session_id is not None:
+            with get_db() as stream_db:
+                session = chat_sessions.get(stream_db, request.session_id)
+                if session is not None:
+                    chat_sessions.add_turn(
+                        stream_db, session, request.query, "".join(parts)
+                    )
+
+        yield event("done")
+
+    events = chat_gate.run(
+        request.project_name, flight_key(request, stream=True), answer
+    )
+
+    # Errors before the context is retrieved are still HTTP errors
+    try:
+        context = await events.__anext__()
+    except Exception as e:
+        raise chat_error(e)
+
+    async def stream() -> AsyncIterator[str]:
+        yield context
+        try:
+            async for line in events:
+                yield line
+        except RequestCancelled:
+            return
+        except Exception as e:
+            logger.error(f"Failed to stream response: {str(e)}")
+            yield event("error", message=str(e))
+
+    # Compaction checks whether it is needed first
+    background = (
+        BackgroundTask(compact_session, request.session_id)
+        if request.session_id is not None
+        else None
+    )
+    return StreamingResponse(
+        stream(), media_type="application/x-ndjson", background=background
+    )
+
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,186 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Embedding scheduler
+EMBEDDING_QUEUE_DEPTH = Gauge(
+    "nvim_llama_embedding_queue_depth",
+    "Embedding batches waiting for the provider",
+    ["priority"],
+)
+EMBEDDING_IN_FLIGHT = Gauge(
+    "nvim_llama_embedding_in_flight",
+    "Embedding batches currently sent to the provider",
+    ["priority"],
+)
+EMBEDDING_QUEUE_WAIT_SECONDS = Histogram(
+    "nvim_llama_embedding_queue_wait_seconds",
+    "Time embedding batches wait in the scheduler queue",
+    ["priority"],
+)
+EMBEDDING_LATENCY_SECONDS = Histogram(
+    "nvim_llama_embedding_latency_seconds",
+    "End to end latency of embedding requests, including queueing",
+    ["priority"],
+)
+EMBEDDING_ERRORS = Counter(
+    "nvim_llama_embedding_errors_total",
+    "Embedding batches that failed at the provider",
+    ["priority"],
+)
+
+# Chat request stages
+QUERY_EMBEDDING_SECONDS = Histogram(
+    "nvim_llama_query_embedding_seconds",
+    "Time to embed a chat query",
+)
+VECTOR_SEARCH_SECONDS = Histogram(
+    "nvim_llama_vector_search_seconds",
+    "Time of the approximate nearest neighbour search over code chunks",
+)
+CONTEXT_ASSEMBLY_SECONDS = Histogram(
+    "nvim_llama_context_assembly_seconds",
+    "Time to assemble retrieved chunks into the prompt context",
+)
+LLM_TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    "nvim_llama_llm_time_to_first_token_seconds",
+    "Time from sending a prompt to the LLM until the first token arrives",
+)
+LLM_RESPONSE_SECONDS = Histogram(
+    "nvim_llama_llm_response_seconds",
+    "Time from sending a prompt to the LLM until the response is complete",
+)
+LLM_PROMPT_TOKENS = Counter(
+    "nvim_llama_llm_prompt_tokens_total",
+    "Prompt tokens sent to the LLM, by whether the provider served them from its cache",
+    ["cache"],
+)
+CHAT_REQUEST_SECONDS = Histogram(
+    "nvim_llama_chat_request_seconds",
+    "Total latency of chat requests",
+)
+
+# Indexing
+INDEX_FILES_WALKED = Counter(
+    "nvim_llama_index_files_walked_total",
+    "Files found while walking projects for indexing",
+)
+INDEX_FILES_SKIPPED = Counter(
+    "nvim_llama_index_files_skipped_total",
+    "Files that were walked but not indexed",
+    ["reason"],
+)
+INDEX_FILES_CHUNKED = Counter(
+    "nvim_llama_index_files_chunked_total",
+    "Files chunked and stored",
+)
+INDEX_CHUNKS_STORED = Counter(
+    "nvim_llama_index_chunks_stored_total",
+    "Code chunks stored",
+)
+INDEX_TOKENS_EMBEDDED = Counter(
+    "nvim_llama_index_tokens_embedded_total",
+    "Tokens of code sent to the embedding provider while indexing",
+)
+INDEX_EMBEDDING_FAILURES = Counter(
+    "nvim_llama_index_embedding_failures_total",
+    "Chunks stored without an embedding, or left without one on retry, "
+    "after embedding provider errors",
+)
+INDEX_EMBEDDING_RETRIES = Counter(
+    "nvim_llama_index_embedding_retries_total",
+    "Chunks embedded by retrying after an earlier failure",
+)
+INDEX_DB_WRITE_SECONDS = Histogram(
+    "nvim_llama_index_db_write_seconds",
+    "Time spent writing a file's chunks and counters to the database",
+)
+
+# In-memory vector search tier
+MEMORY_INDEX_CHUNKS = Gauge(
+    "nvim_llama_memory_index_chunks",
+    "Chunks of a project held in the in-memory index",
+    ["project"],
+)
+MEMORY_INDEX_LOADS = Counter(
+    "nvim_llama_memory_index_loads_total",
+    "Projects loaded into the in-memory index",
+    ["source"],
+)
+MEMORY_INDEX_SEARCHES = Counter(
+    "nvim_llama_memory_index_searches_total",
+    "Vector searches by where they were served from",
+    ["tier"],
+)
+
+# Chat sessions
+CHAT_RETRIEVALS = Counter(
+    "nvim_llama_chat_retrievals_total",
+    "Chat context by whether it was searched or reused from the previous turn",
+    ["source"],
+)
+CHAT_HISTORY_TOKENS = Histogram(
+    "nvim_llama_chat_history_tokens",
+    "Tokens of session history and summary sent with a chat prompt",
+    buckets=(0, 250, 500, 1000, 2000, 4000, 8000, 16000),
+)
+CHAT_COMPACTIONS = Counter(
+    "nvim_llama_chat_compactions_total",
+    "Chat session histories compacted into their summary",
+)
+
+# Unsaved buffer overlays
+OVERLAY_EMBEDDINGS = Counter(
+    "nvim_llama_overlay_embeddings_total",
+    "Chunks of unsaved buffers, by whether their embedding was cached",
+    ["source"],
+)
+
+# Symbol lookups
+SYMBOL_LOOKUPS = Counter(
+    "nvim_llama_symbol_lookups_total",
+    "Names mentioned in questions that were found defined, by whether they "
+    "were looked up or too ambiguous to",
+    ["result"],
+)
+
+# Database connection pools
+DB_POOL_CHECKED_OUT = Gauge(
+    "nvim_llama_db_pool_checked_out",
+    "Connections of a database engine's pool currently in use",
+    ["engine"],
+)
+
+# Chat admission control
+CHAT_ADMISSIONS = Counter(
+    "nvim_llama_chat_admissions_total",
+    "Chat requests by whether they were admitted, joined identical work, or "
+    "were rejected because the queue was full or they waited too long",
+    ["result"],
+)
+CHAT_IN_FLIGHT = Gauge(
+    "nvim_llama_chat_in_flight",
+    "Chat requests currently worked on",
+)
+CHAT_QUEUE_DEPTH = Gauge(
+    "nvim_llama_chat_queue_depth",
+    "Chat requests waiting to be admitted",
+)
+CHAT_QUEUE_WAIT_SECONDS = Histogram(
+    "nvim_llama_chat_queue_wait_seconds",
+    "Time chat requests wait to be admitted",
+)
+CHAT_CANCELLATIONS = Counter(
+    "nvim_llama_chat_cancellations_total",
+    "Chat work stopped before it finished, by whether it timed out or its "
+    "clients disconnected",
+    ["reason"],
+)
+
+# Embedding migrations
+EMBEDDING_MIGRATION_CHUNKS = Counter(
+    "nvim_llama_embedding_migration_chunks_total",
+    "Chunks re-embedded in the background with a new embedding version",
+)
+EMBEDDING_MIGRATION_CUTOVERS = Counter(
+    "nvim_llama_embedding_migration_cutovers_total",
+    "Projects switched over to a new embedding version",
+)
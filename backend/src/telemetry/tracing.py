@@ -0,0 +1,53 @@
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from prometheus_client import Histogram
+
+# OpenTelemetry is optional. Spans are only recorded when the API package is
+# installed, and only exported when an SDK is configured, e.g. by running
+# under `opentelemetry-instrument`.
+try:
+    from opentelemetry import trace
+
+    _tracer = trace.get_tracer("nvim-llama")
+except ImportError:
+    _tracer = None
+
+
+@contextmanager
+def span(
+    name: str,
+    histogram: Optional[Histogram] = None,
+    set_current: bool = True,
+    **attributes,
+) -> Iterator[None]:
+    """
+    Trace a block of code as an OpenTelemetry span and optionally record its
+    duration in a Prometheus histogram.
+
+    Args:
+        name: Name of the span
+        histogram: Histogram to observe the duration in seconds with
+        set_current: Make the span the parent of spans started inside the
+            block. Generators must pass False, since they can be resumed
+            from another thread or context.
+        attributes: Attributes to set on the span
+    """
+    start = time.perf_counter()
+
+    try:
+        if _tracer is None:
+            yield
+        elif set_current:
+            with _tracer.start_as_current_span(name, attributes=attributes):
+                yield
+        else:
+            otel_span = _tracer.start_span(name, attributes=attributes)
+            try:
+                yield
+            finally:
+                otel_span.end()
+    finally:
+        if histogram is not None:
+            histogram.observe(time.perf_counter() - start)
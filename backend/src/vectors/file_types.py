@@ -0,0 +1,107 @@
+import os
+import re
+import mmap
+import numpy as np
+from typing import Iterator, Optional
+
+# Files larger than this are never indexed
+INDEX_MAX_FILE_BYTES = int(os.getenv("INDEX_MAX_FILE_BYTES", str(4 * 1024 * 1024)))
+
+# Files larger than this are streamed line by line from a memory map and
+# stored in batches of chunks, instead of being read whole
+INDEX_STREAM_FILE_BYTES = int(os.getenv("INDEX_STREAM_FILE_BYTES", str(1024 * 1024)))
+
+# Chunks of a streamed file embedded and written at a time
+INDEX_STREAM_BATCH_CHUNKS = int(os.getenv("INDEX_STREAM_BATCH_CHUNKS", "64"))
+
+# Average line length of the start of a file above which it is taken to be
+# minified
+INDEX_MAX_AVERAGE_LINE_LENGTH = int(os.getenv("INDEX_MAX_AVERAGE_LINE_LENGTH", "300"))
+
+# Bytes read from the start of a file to tell what kind of file it is
+SNIFF_BYTES = 16 * 1024
+
+# Bits of entropy per byte above which a file with hardly any whitespace is
+# taken to be encoded data (base64, compressed or encrypted blobs) rather
+# than code. Source code is around 4.5 to 5.5.
+DATA_ENTROPY = 6.0
+
+# Names of files that are generated or vendored build output
+GENERATED_NAMES = re.compile(
+    r".*(?:[.-]min\.(?:js|css)|\.bundle\.js|\.chunk\.js|\.map|\.pb\.go|_pb2\.py"
+    r"|_pb2_grpc\.py|\.pb\.(?:h|cc)|\.g\.dart|\.generated\.\w+"
+    r"|package-lock\.json|yarn\.lock|pnpm-lock\.yaml|Cargo\.lock|go\.sum)$"
+)
+
+# Markers generators put at the top of their output
+GENERATED_HEADER = re.compile(
+    rb"@generated|DO NOT EDIT|auto-?generated|automatically generated"
+    rb"|generated by (?:the )?protoc",
+    re.IGNORECASE,
+)
+
+
+def skip_reason(file_path: str, size: int) -> Optional[str]:
+    """
+    Tell whether a file shouldn't be indexed, from its name, its size and
+    the start of its content.
+
+    Args:
+        file_path: Path of the file
+        size: Size of the file in bytes
+
+    Returns:
+        "too_large", "generated", "binary" or "minified", or None if the
+        file should be indexed
+    """
+    if size > INDEX_MAX_FILE_BYTES:
+        return "too_large"
+
+    if GENERATED_NAMES.match(os.path.basename(file_path)):
+        return "generated"
+
+    with open(file_path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+
+    if b"\0" in head:
+        return "binary"
+
+    # Generators mark their output in the first lines
+    if GENERATED_HEADER.search(b"\n".join(head.split(b"\n", 5)[:5])):
+        return "generated"
+
+    if not head:
+        return None
+
+    lines = head.count(b"\n") + 1
+    if len(head) / lines > INDEX_MAX_AVERAGE_LINE_LENGTH:
+        return "minified"
+
+    counts = np.bincount(np.frombuffer(head, dtype=np.uint8), minlength=256)
+    probabilities = counts[counts > 0] / len(head)
+    entropy = float(-(probabilities * np.log2(probabilities)).sum())
+    whitespace = sum(counts[byte] for byte in b" \t\n\r") / len(head)
+    if entropy > DATA_ENTROPY and whitespace < 0.05:
+        return "binary"
+
+    return None
+
+
+def read_lines(file_path: str) -> Iterator[str]:
+    """
+    Iterate over the lines of a file through a memory map, so large files
+    are never held in memory whole.
+
+    Args:
+        file_path: Path of the file
+
+    Returns:
+        Iterator of the lines, without line endings
+    """
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for line in iter(mapped.readline, b""):
+                yield line.decode("utf-8", errors="ignore").rstrip("\r\n")
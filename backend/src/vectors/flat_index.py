@@ -0,0 +1,173 @@
+import numpy as np
+from typing import Any, Dict, List, NamedTuple, Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from src.database.pgvector import Project, CodeFile, CodeChunk
+from src.vectors.scope import SearchScope
+
+
+class ChunkRow(NamedTuple):
+    id: int
+    content: str
+    start_line: int
+    end_line: int
+    file_path: str
+    language: str
+    distance: float
+
+
+def distances(
+    matrix: np.ndarray, norms: np.ndarray, query: np.ndarray, metric: str
+) -> np.ndarray:
+    """
+    Distances from a query to every row of a matrix, matching pgvector's
+    operators for the metric.
+
+    Args:
+        matrix: Embeddings, one per row
+        norms: L2 norms of the rows of matrix
+        query: Query embedding
+        metric: "cosine", "l2" or "inner_product"
+
+    Returns:
+        Array of distances, smaller is nearer
+    """
+    query = np.asarray(query, dtype=np.float32)
+    dots = matrix @ query
+
+    if metric == "inner_product":
+        return -dots
+
+    if metric == "l2":
+        return np.sqrt(np.maximum(norms**2 - 2 * dots + query @ query, 0))
+
+    denominators = norms * np.linalg.norm(query)
+    return 1 - np.divide(
+        dots, denominators, out=np.zeros_like(dots), where=denominators > 0
+    )
+
+
+class ProjectIndex:
+    """Embeddings and chunk metadata of one project, searched exhaustively"""
+
+    def __init__(
+        self,
+        project_id: int,
+        version: int,
+        ids: np.ndarray,
+        matrix: np.ndarray,
+        norms: np.ndarray,
+        chunks: List[List],
+        path: str = "",
+        embedding_version_id: Optional[int] = None,
+    ):
+        self.project_id = project_id
+        self.path = path
+        self.version = version
+        self.embedding_version_id = embedding_version_id
+        self.ids = ids
+        self.matrix = matrix
+        self.norms = norms
+        self.chunks = chunks
+        self.dims = matrix.shape[1] if matrix.ndim == 2 else 0
+
+        # Distinct files and the file of every chunk, so scopes are
+        # evaluated once per file rather than once per chunk
+        self.files, self.chunk_files = np.unique(
+            np.array([chunk[3] for chunk in chunks], dtype=str), return_inverse=True
+        )
+        self.file_languages = np.empty(len(self.files), dtype=object)
+        self.file_languages[self.chunk_files] = [chunk[4] for chunk in chunks]
+
+    def search(
+        self,
+        query_embedding: np.ndarray,
+        limit: int,
+        metric: str,
+        scope: Optional[SearchScope] = None,
+    ) -> List[ChunkRow]:
+        """
+        Find the chunks nearest to a query embedding.
+
+        Args:
+            query_embedding: Embedding with the project's dimensions
+            limit: Maximum number of results to return
+            metric: Distance metric
+            scope: Optional files, directories and languages to search in
+
+        Returns:
+            Chunks with their distance, nearest first
+        """
+        if scope:
+            in_scope = scope.mask(self.files, self.file_languages)
+            candidates = np.flatnonzero(in_scope[self.chunk_files])
+            matrix, norms = self.matrix[candidates], self.norms[candidates]
+        else:
+            candidates = np.arange(len(self.ids))
+            matrix, norms = self.matrix, self.norms
+
+        if not len(candidates):
+            return []
+
+        scores = distances(matrix, norms, query_embedding, metric)
+        limit = min(limit, len(scores))
+        nearest = np.argpartition(scores, limit - 1)[:limit]
+        nearest = nearest[np.argsort(scores[nearest])]
+
+        return [
+            ChunkRow(
+                int(self.ids[candidates[i]]),
+                *self.chunks[candidates[i]],
+                float(scores[i]),
+            )
+            for i in nearest
+        ]
+
+
+def load_project_index(db: Session, project: Project, backend: Any) -> ProjectIndex:
+    """
+    Read a project's embedded chunks into a ProjectIndex, labeled with the
+    chunks version the project was read at. The caller picks the isolation
+    level; chunks changing meanwhile at worst label newer chunks with an
+    older version, so they are reloaded once more.
+
+    Args:
+        db: Database session
+        project: Project to read, with its embedding dimensions
+        backend: Storage backend to read embeddings with
+
+    Returns:
+        The project's index
+    """
+    ids, matrix = backend.read_chunk_embeddings(db, project.id, project.embedding_dim)
+    rows = db.execute(
+        select(
+            CodeChunk.id,
+            CodeChunk.content,
+            CodeChunk.start_line,
+            CodeChunk.end_line,
+            CodeFile.file_path,
+            CodeFile.language,
+        )
+        .join(CodeFile, CodeChunk.file_id == CodeFile.id)
+        .where(
+            CodeChunk.project_id == project.id,
+            CodeChunk.embedding_state == "embedded",
+        )
+    ).fetchall()
+
+    metadata: Dict[int, List] = {row.id: list(row[1:]) for row in rows}
+    known = np.array([chunk_id in metadata for chunk_id in ids.tolist()], dtype=bool)
+    ids, matrix = ids[known], matrix[known]
+
+    return ProjectIndex(
+        project.id,
+        project.chunks_version,
+        ids,
+        matrix,
+        np.linalg.norm(matrix, axis=1),
+        [metadata[chunk_id] for chunk_id in ids.tolist()],
+        project.path,
+        project.embedding_version_id,
+    )
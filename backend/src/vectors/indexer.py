@@ -1,17 +1,37 @@
 import os
+import time
 from loguru import logger
-import fnmatch
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional, Tuple
 import tiktoken
+from sqlalchemy import func, or_, select, update
 from sqlalchemy.orm import Session
 
+from src.database.backends import backend
 from src.database.pgvector import get_db, Project, CodeFile, CodeChunk
+from src.vectors.file_types import (
+    INDEX_STREAM_BATCH_CHUNKS,
+    INDEX_STREAM_FILE_BYTES,
+    read_lines,
+    skip_reason,
+)
+from src.vectors.migration import get_migration_status, start_migration
+from src.vectors.symbols import LineSymbols, SymbolIndex, extract_symbols
+from src.vectors.walker import walk_files
+from src.telemetry.metrics import (
+    INDEX_FILES_CHUNKED,
+    INDEX_FILES_SKIPPED,
+)
+from src.telemetry.tracing import span
+
+# Minimum seconds between progress writes while skipping unmodified files
+PROGRESS_INTERVAL = 2.0
 
 
 class CodebaseIndexer:
-    def __init__(self, vector_store):
+    def __init__(self, vector_store, symbol_index: Optional[SymbolIndex] = None):
         self.vector_store = vector_store
+        self.symbol_index = symbol_index or SymbolIndex()
         self.encoding = tiktoken.get_encoding(
             "cl100k_base"
         )  # Same as used by many embedding models
@@ -24,128 +44,355 @@ class CodebaseIndexer:
         project_name: str,
         file_extensions: List[str],
         exclude_patterns: List[str],
-    ) -> None:
+        should_stop: Optional[Callable[[], bool]] = None,
+    ) -> bool:
         """
         Index a codebase by chunking files and storing their vectors.
 
+        Every changed file is committed together with its chunks, so an
+        interrupted run resumes where it stopped: files that were already
+        stored are skipped as unmodified on the next run.
+
         Args:
             project_path: Path to the project root
             project_name: Name of the project
             file_extensions: List of file extensions to include
             exclude_patterns: List of patterns to exclude
+            should_stop: Optional callback checked before each file; indexing
+                stops early when it returns True
+
+        Returns:
+            True if indexing ran to completion, False if it was stopped
         """
         logger.info(f"Starting indexing for project {project_name} at {project_path}")
 
-        with get_db() as db:
+        with (
+            get_db() as db,
+            span("indexer.index_codebase", project_name=project_name),
+        ):
+            project_id = None
             try:
                 # Create or update project entry
-                project = db.query(Project).filter(Project.name == project_name).first()
-                if project:
-                    project.path = project_path
-                    project.updated_at = datetime.now()
-                else:
-                    project = Project(name=project_name, path=project_path)
-                    db.add(project)
+                project_id = self._upsert_project(db, project_name, project_path)
+                self._check_embedding_space(db, project_id)
+                self._set_progress(
+                    db,
+                    project_id,
+                    index_phase="scanning",
+                    files_total=0,
+                    files_scanned=0,
+                    index_started_at=func.now(),
+                    index_finished_at=None,
+                )
+                db.commit()
 
+                # Collect candidate files up front so progress has a total
+                candidates = list(
+                    walk_files(project_path, file_extensions, exclude_patterns)
+                )
+                self._set_progress(
+                    db, project_id, index_phase="indexing", files_total=len(candidates)
+                )
                 db.commit()
 
-                # Walk through project files
                 file_count = 0
                 chunk_count = 0
-
-                for root, dirs, files in os.walk(project_path):
-                    # Filter out excluded directories
-                    dirs[:] = [
-                        d
-                        for d in dirs
-                        if not any(
-                            fnmatch.fnmatch(d, pattern) for pattern in exclude_patterns
+                last_progress = time.monotonic()
+
+                for files_scanned, (file_path, stat) in enumerate(candidates, 1):
+                    if should_stop and should_stop():
+                        self._set_progress(
+                            db,
+                            project_id,
+                            index_phase="cancelled",
+                            files_scanned=files_scanned - 1,
+                            index_finished_at=func.now(),
                         )
-                    ]
+                        db.commit()
+                        logger.info(f"Indexing stopped for {project_name}")
+                        return False
 
-                    for file in files:
-                        # Check if file has a valid extension
-                        if not any(file.endswith(ext) for ext in file_extensions):
-                            continue
-
-                        # Check if file matches any exclude pattern
-                        if any(
-                            fnmatch.fnmatch(file, pattern)
-                            for pattern in exclude_patterns
-                        ):
-                            continue
-
-                        file_path = os.path.join(root, file)
-                        rel_path = os.path.relpath(file_path, project_path)
+                    rel_path = os.path.relpath(file_path, project_path)
 
-                        try:
-                            # Determine language based on file extension
-                            _, ext = os.path.splitext(file)
-                            language = self._get_language_for_extension(ext)
+                    try:
+                        # Determine language based on file extension
+                        _, ext = os.path.splitext(file_path)
+                        language = self._get_language_for_extension(ext)
 
-                            # Get file modification time
-                            mtime = datetime.fromtimestamp(os.path.getmtime(file_path))
+                        # Modification time and size, as stat'ed by the walk
+                        mtime = datetime.fromtimestamp(stat.st_mtime)
 
-                            # Create or update file entry
-                            code_file = (
-                                db.query(CodeFile)
-                                .filter(
-                                    CodeFile.project_id == project.id,
-                                    CodeFile.file_path == rel_path,
+                        # Create or update file entry. Unmodified files
+                        # come back as None and are skipped.
+                        file_id = self._upsert_file(
+                            db, project_id, rel_path, language, mtime
+                        )
+                        if file_id is None:
+                            INDEX_FILES_SKIPPED.labels("unchanged").inc()
+                            # Throttle progress writes for skipped files
+                            if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                                self._set_progress(
+                                    db, project_id, files_scanned=files_scanned
                                 )
-                                .first()
-                            )
-
-                            if code_file:
-                                # Skip if file hasn't been modified
-                                if (
-                                    code_file.last_modified
-                                    and code_file.last_modified >= mtime
-                                ):
-                                    continue
+                                db.commit()
+                                last_progress = time.monotonic()
+                            continue
 
-                                code_file.language = language
-                                code_file.last_modified = mtime
+                        # Store chunks with vectors. This commits the file
+                        # upsert, symbols, counters and progress together
+                        # with the chunks, so a failure leaves the file to be
+                        # picked up on the next run.
+                        self._set_progress(db, project_id, files_scanned=files_scanned)
+
+                        reason = skip_reason(file_path, stat.st_size)
+                        if reason is None and stat.st_size > INDEX_STREAM_FILE_BYTES:
+                            stored = self.vector_store.store_chunk_batches(
+                                db,
+                                project_id,
+                                file_id,
+                                rel_path,
+                                self._stream_file(
+                                    db, project_id, file_id, file_path, language
+                                ),
+                                stat.st_size,
+                            )
+                        else:
+                            if reason is not None:
+                                # Stored without chunks, so the file is
+                                # skipped as unmodified until it changes
+                                INDEX_FILES_SKIPPED.labels(reason).inc()
+                                chunks, symbols = [], []
                             else:
-                                code_file = CodeFile(
-                                    project_id=project.id,
-                                    file_path=rel_path,
-                                    language=language,
-                                    last_modified=mtime,
-                                )
-                                db.add(code_file)
-
-                            db.commit()
-
-                            # Process file content
-                            with open(
-                                file_path, "r", encoding="utf-8", errors="ignore"
-                            ) as f:
-                                content = f.read()
-
-                            # Chunk the file
-                            chunks = self._chunk_file(content)
-
-                            # Store chunks with vectors
+                                chunks, symbols = self._read_file(file_path, language)
+                            self.symbol_index.store(db, project_id, file_id, symbols)
                             self.vector_store.store_code_chunks(
-                                db, project_name, rel_path, language, chunks
+                                db,
+                                project_id,
+                                file_id,
+                                rel_path,
+                                chunks,
+                                0 if reason else stat.st_size,
+                                skip_reason=reason,
                             )
+                            stored = len(chunks)
+                        last_progress = time.monotonic()
+                        if reason is not None:
+                            continue
 
-                            file_count += 1
-                            chunk_count += len(chunks)
+                        INDEX_FILES_CHUNKED.inc()
+                        file_count += 1
+                        chunk_count += stored
+
+                    except Exception as e:
+                        db.rollback()
+                        INDEX_FILES_SKIPPED.labels("error").inc()
+                        logger.error(f"Error processing file {file_path}: {str(e)}")
+
+                # Retry chunks stored without embeddings, in this run or an
+                # earlier one
+                self._set_progress(
+                    db,
+                    project_id,
+                    index_phase="embedding",
+                    files_scanned=len(candidates),
+                )
+                db.commit()
+                self.vector_store.retry_embeddings(db, project_id, should_stop)
+
+                # Outline the project again once its definitions changed
+                if file_count or self._repo_map_missing(db, project_id):
+                    db.execute(
+                        update(Project)
+                        .where(Project.id == project_id)
+                        .values(
+                            repo_map=self.symbol_index.build_repo_map(db, project_id)
+                        )
+                    )
 
-                        except Exception as e:
-                            logger.error(f"Error processing file {file_path}: {str(e)}")
+                self._set_progress(
+                    db,
+                    project_id,
+                    index_phase="completed",
+                    index_finished_at=func.now(),
+                )
+                db.commit()
 
                 logger.info(
                     f"Indexing completed for {project_name}: processed {file_count} files and created {chunk_count} chunks"
                 )
+                return True
 
             except Exception as e:
                 db.rollback()
                 logger.error(f"Failed to index codebase: {str(e)}")
+                if project_id is not None:
+                    self._set_progress(
+                        db,
+                        project_id,
+                        index_phase="failed",
+                        index_finished_at=func.now(),
+                    )
+                    db.commit()
                 raise
 
+    def _set_progress(self, db: Session, project_id: int, **fields) -> None:
+        """
+        Update the live indexing progress fields of a project. The caller
+        is responsible for committing.
+
+        Args:
+            db: Database session
+            project_id: ID of the project
+            fields: Progress columns to set on the project
+        """
+        db.execute(update(Project).where(Project.id == project_id).values(**fields))
+
+    def _read_file(
+        self, file_path: str, language: str
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Chunk a file and extract its symbols, reading it whole. Files larger
+        than INDEX_STREAM_FILE_BYTES go through _stream_file instead.
+
+        Args:
+            file_path: Path of the file
+            language: Language of the file
+
+        Returns:
+            Tuple of the file's chunks and symbols
+        """
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            content = f.read()
+        return self._chunk_file(content), extract_symbols(content, language)
+
+    def _stream_file(
+        self,
+        db: Session,
+        project_id: int,
+        file_id: int,
+        file_path: str,
+        language: str,
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Chunk a large file in batches of INDEX_STREAM_BATCH_CHUNKS, reading
+        it line by line from a memory map. Symbols are extracted in the same
+        pass, and stored once the last line has been read, in the
+        transaction the chunks are stored in.
+
+        Args:
+            db: Database session
+            project_id: ID of the project the file belongs to
+            file_id: ID of the file
+            file_path: Path of the file
+            language: Language of the file
+
+        Returns:
+            Iterator of batches of chunks, as _chunk_file returns them
+        """
+        symbols = LineSymbols(language)
+
+        def lines() -> Iterator[str]:
+            for line in read_lines(file_path):
+                symbols.add(line)
+                yield line
+
+        batch = []
+        for chunk in self._iter_chunks(lines()):
+            batch.append(chunk)
+            if len(batch) >= INDEX_STREAM_BATCH_CHUNKS:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+        self.symbol_index.store(db, project_id, file_id, symbols.symbols())
+
+    def _repo_map_missing(self, db: Session, project_id: int) -> bool:
+        """Whether a project has no repo map, e.g. indexed before they existed"""
+        return (
+            db.execute(
+                select(Project.repo_map).where(Project.id == project_id)
+            ).scalar()
+            is None
+        )
+
+    def _upsert_project(self, db: Session, project_name: str, project_path: str) -> int:
+        """
+        Insert or update a project in a single statement.
+
+        Args:
+            db: Database session
+            project_name: Name of the project
+            project_path: Path to the project root
+
+        Returns:
+            ID of the project
+        """
+        stmt = backend.insert(Project).values(name=project_name, path=project_path)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Project.name],
+            set_={"path": stmt.excluded.path, "updated_at": func.now()},
+        ).returning(Project.id)
+
+        return db.execute(stmt).scalar_one()
+
+    def _check_embedding_space(self, db: Session, project_id: int) -> None:
+        """
+        Move a project to the configured embedding model and dimensions.
+        When they changed since it was last indexed, the project keeps its
+        embeddings and is re-embedded in the background, see
+        start_migration. Indexing meanwhile embeds with the project's
+        current version, so its chunks stay searchable.
+
+        Args:
+            db: Database session
+            project_id: ID of the project
+        """
+        start_migration(db, project_id, self.vector_store.llm_service.embedding_space)
+
+    def _upsert_file(
+        self,
+        db: Session,
+        project_id: int,
+        rel_path: str,
+        language: str,
+        mtime: datetime,
+    ) -> Optional[int]:
+        """
+        Insert or update a file, only touching existing rows when the file on
+        disk is newer than what was last indexed.
+
+        Args:
+            db: Database session
+            project_id: ID of the owning project
+            rel_path: Path to the file relative to project root
+            language: Programming language of the file
+            mtime: Modification time of the file on disk
+
+        Returns:
+            ID of the file, or None if it is already up to date
+        """
+        stmt = backend.insert(CodeFile).values(
+            project_id=project_id,
+            file_path=rel_path,
+            language=language,
+            last_modified=mtime,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CodeFile.project_id, CodeFile.file_path],
+            set_={
+                "language": stmt.excluded.language,
+                "last_modified": stmt.excluded.last_modified,
+                "updated_at": func.now(),
+            },
+            where=or_(
+                CodeFile.last_modified.is_(None),
+                CodeFile.last_modified < stmt.excluded.last_modified,
+            ),
+        ).returning(CodeFile.id)
+
+        return db.execute(stmt).scalar_one_or_none()
+
     def get_index_status(self, project_name: str, db: Session) -> Dict[str, Any]:
         """
         Get the indexing status for a project.
@@ -162,27 +409,133 @@ class CodebaseIndexer:
             if not project:
                 return {"status": "not_found", "project_name": project_name}
 
-            file_count = (
-                db.query(CodeFile).filter(CodeFile.project_id == project.id).count()
-            )
-            chunk_count = (
-                db.query(CodeChunk).filter(CodeChunk.project_id == project.id).count()
-            )
+            if project.index_phase in ("scanning", "indexing", "embedding"):
+                status = "indexing"
+            elif project.index_phase == "failed":
+                status = "failed"
+            else:
+                status = "indexed" if project.file_count > 0 else "pending"
 
             return {
-                "status": "indexed" if file_count > 0 else "pending",
+                "status": status,
                 "project_name": project_name,
-                "file_count": file_count,
-                "chunk_count": chunk_count,
+                "file_count": project.file_count,
+                "chunk_count": project.chunk_count,
+                "byte_count": project.byte_count,
+                "token_count": project.token_count,
+                "embeddings": self._get_embedding_states(db, project.id),
+                "embedding_migration": get_migration_status(db, project),
+                "skipped_files": self._get_skipped_files(db, project.id),
                 "last_updated": project.updated_at.isoformat()
                 if project.updated_at
                 else None,
+                "progress": self._get_progress(project),
             }
 
         except Exception as e:
             logger.error(f"Failed to get index status: {str(e)}")
             raise
 
+    def _get_embedding_states(self, db: Session, project_id: int) -> Dict[str, int]:
+        """
+        Count the chunks of a project still without an embedding. Reads only
+        the partial index of such chunks, which is empty when all is well.
+
+        Args:
+            db: Database session
+            project_id: ID of the project
+
+        Returns:
+            Dictionary with pending and failed chunk counts
+        """
+        counts = dict(
+            db.execute(
+                select(CodeChunk.embedding_state, func.count())
+                .where(
+                    CodeChunk.project_id == project_id,
+                    CodeChunk.embedding_state != "embedded",
+                )
+                .group_by(CodeChunk.embedding_state)
+            ).all()
+        )
+        return {
+            "pending": counts.get("pending", 0),
+            "failed": counts.get("failed", 0),
+        }
+
+    def _get_skipped_files(self, db: Session, project_id: int) -> Dict[str, int]:
+        """
+        Count the files of a project left unindexed, by reason.
+
+        Args:
+            db: Database session
+            project_id: ID of the project
+
+        Returns:
+            Dictionary of file counts by reason, e.g. "too_large"
+        """
+        return dict(
+            db.execute(
+                select(CodeFile.skip_reason, func.count())
+                .where(
+                    CodeFile.project_id == project_id,
+                    CodeFile.skip_reason.is_not(None),
+                )
+                .group_by(CodeFile.skip_reason)
+            ).all()
+        )
+
+    def _get_progress(self, project: Project) -> Dict[str, Any]:
+        """
+        Derive throughput and ETA from the progress fields of a project.
+
+        Args:
+            project: Project to report progress for
+
+        Returns:
+            Dictionary with progress information
+        """
+        files_total = project.files_total or 0
+        files_scanned = project.files_scanned or 0
+        started_at = project.index_started_at
+
+        throughput = None
+        eta_seconds = None
+        if started_at:
+            finished_at = project.index_finished_at or datetime.now()
+            elapsed = (finished_at - started_at).total_seconds()
+            if elapsed > 0 and files_scanned > 0:
+                throughput = files_scanned / elapsed
+                if project.index_phase == "indexing":
+                    eta_seconds = (files_total - files_scanned) / throughput
+
+        return {
+            "phase": project.index_phase,
+            "files_scanned": files_scanned,
+            "files_total": files_total,
+            "started_at": started_at.isoformat() if started_at else None,
+            "finished_at": project.index_finished_at.isoformat()
+            if project.index_finished_at
+            else None,
+            "files_per_second": throughput,
+            "eta_seconds": eta_seconds,
+        }
+
+    def chunk_buffer(self, file_path: str, content: str) -> Tuple[str, List[Dict]]:
+        """
+        Chunk the contents of a file that isn't saved, the way indexing
+        would chunk the saved file.
+
+        Args:
+            file_path: Path of the file
+            content: Contents of the file
+
+        Returns:
+            Tuple of the file's language and its chunks
+        """
+        _, ext = os.path.splitext(file_path)
+        return self._get_language_for_extension(ext), self._chunk_file(content)
+
     def _chunk_file(self, content: str) -> List[Dict[str, Any]]:
         """
         Chunk a file content into smaller pieces for embedding.
@@ -191,18 +544,41 @@ class CodebaseIndexer:
             content: File content as string
 
         Returns:
-            List of chunk dictionaries with start_line, end_line, and content
+            List of chunk dictionaries with start_line, end_line, content and token_count
         """
-        # Split content into lines
-        lines = content.splitlines()
+        return self._chunk_lines(content.splitlines())
 
-        # Initialize chunks
-        chunks = []
+    def _chunk_lines(self, lines: Iterable[str]) -> List[Dict[str, Any]]:
+        """
+        Chunk the lines of a file.
+
+        Args:
+            lines: Lines of the file, without line endings
+
+        Returns:
+            Same as _chunk_file
+        """
+        return list(self._iter_chunks(lines))
+
+    def _iter_chunks(self, lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        """
+        Chunk the lines of a file as they are read, holding only the lines
+        of the current chunk.
+
+        Args:
+            lines: Lines of the file, without line endings
+
+        Returns:
+            Iterator of chunks, as _chunk_file returns them
+        """
         current_chunk_lines = []
         current_chunk_tokens = 0
         start_line = 1
+        line_count = 0
 
         for i, line in enumerate(lines, 1):
+            line_count = i
+
             # Encode line to get token count
             line_tokens = len(self.encoding.encode(line))
 
@@ -213,22 +589,23 @@ class CodebaseIndexer:
             ):
                 # Store current chunk
                 chunk_content = "\n".join(current_chunk_lines)
-                chunks.append(
+                yield (
                     {
                         "start_line": start_line,
                         "end_line": i - 1,
                         "content": chunk_content,
+                        "token_count": current_chunk_tokens,
                     }
                 )
 
                 # Calculate overlap - keep the last few lines
                 overlap_lines = []
                 overlap_tokens = 0
-                for line in reversed(current_chunk_lines):
-                    line_token_count = len(self.encoding.encode(line))
+                for overlap_line in reversed(current_chunk_lines):
+                    line_token_count = len(self.encoding.encode(overlap_line))
                     if overlap_tokens + line_token_count > self.chunk_overlap:
                         break
-                    overlap_lines.insert(0, line)
+                    overlap_lines.insert(0, overlap_line)
                     overlap_tokens += line_token_count
 
                 # Start new chunk with overlap
@@ -243,16 +620,15 @@ class CodebaseIndexer:
         # Don't forget the last chunk
         if current_chunk_lines:
             chunk_content = "\n".join(current_chunk_lines)
-            chunks.append(
+            yield (
                 {
                     "start_line": start_line,
-                    "end_line": len(lines),
+                    "end_line": line_count,
                     "content": chunk_content,
+                    "token_count": current_chunk_tokens,
                 }
             )
 
-        return chunks
-
     def _get_language_for_extension(self, extension: str) -> str:
         """
         Map file extension to programming language.
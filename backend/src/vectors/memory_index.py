@@ -0,0 +1,309 @@
+import os
+import re
+import json
+import time
+import select
+import threading
+import numpy as np
+import psycopg2
+from loguru import logger
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+
+from src.consts.vectors import VECTOR_DISTANCE_METRIC
+from src.database.backends import backend
+from src.database.pgvector import CHUNKS_CHANGED_CHANNEL, engine, get_db, Project
+from src.vectors.flat_index import ProjectIndex, load_project_index
+from src.telemetry.metrics import MEMORY_INDEX_CHUNKS, MEMORY_INDEX_LOADS
+
+# Projects kept in memory, comma separated. Empty disables the memory tier.
+MEMORY_INDEX_PROJECTS = [
+    name.strip()
+    for name in os.getenv("MEMORY_INDEX_PROJECTS", "").split(",")
+    if name.strip()
+]
+
+# Projects with more chunks than this are left to Postgres, since searches
+# in memory are exhaustive
+MEMORY_INDEX_MAX_CHUNKS = int(os.getenv("MEMORY_INDEX_MAX_CHUNKS", "200000"))
+
+# Directory of snapshots memory-mapped on startup. Unset disables snapshots.
+MEMORY_INDEX_SNAPSHOT_DIR = os.getenv("MEMORY_INDEX_SNAPSHOT_DIR")
+
+# Seconds without change notifications before a changed project is
+# reloaded, so an indexing run reloads once rather than once per file
+MEMORY_INDEX_RELOAD_DELAY = float(os.getenv("MEMORY_INDEX_RELOAD_DELAY", "5.0"))
+
+
+class MemoryIndex:
+    """
+    In-process copies of the chunks of frequently queried projects, so their
+    searches skip Postgres entirely.
+
+    Postgres stays the source of truth. Indexing notifies a channel when a
+    project's chunks change; the project is then served from Postgres until
+    it has been reloaded. Loaded projects are written to snapshot files that
+    are memory-mapped on the next startup when still current.
+    """
+
+    def __init__(
+        self,
+        project_names: List[str] = MEMORY_INDEX_PROJECTS,
+        snapshot_dir: Optional[str] = MEMORY_INDEX_SNAPSHOT_DIR,
+        max_chunks: int = MEMORY_INDEX_MAX_CHUNKS,
+        reload_delay: float = MEMORY_INDEX_RELOAD_DELAY,
+        metric: str = VECTOR_DISTANCE_METRIC,
+    ):
+        self.project_names = project_names
+        self.snapshot_dir = snapshot_dir
+        self.max_chunks = max_chunks
+        self.reload_delay = reload_delay
+        self.metric = metric
+
+        self._indexes: Dict[str, ProjectIndex] = {}
+        self._stale: Dict[str, float] = {}
+        # Names of the projects notified so far, configured or not, so
+        # projects created or indexed after startup are loaded too
+        self._project_names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Load the projects and follow their changes in the background"""
+        if not self.project_names or self._thread is not None:
+            return
+
+        self._thread = threading.Thread(
+            target=self._run, name="memory-index", daemon=True
+        )
+        self._thread.start()
+
+    def get(self, project_name: str) -> Optional[ProjectIndex]:
+        """The project's index if it is loaded and current, otherwise None"""
+        with self._lock:
+            if project_name in self._stale:
+                return None
+            return self._indexes.get(project_name)
+
+    def mark_stale(self, project_id: int) -> None:
+        """Serve a project from Postgres until it is (re)loaded"""
+        with self._lock:
+            name = self._project_names.get(project_id)
+            if name is None:
+                name = next(
+                    (n for n, i in self._indexes.items() if i.project_id == project_id),
+                    None,
+                )
+
+        if name is None:
+            # A project not seen yet, possibly a configured one created or
+            # indexed since startup
+            try:
+                with get_db() as db:
+                    name = (
+                        db.query(Project.name).filter(Project.id == project_id).scalar()
+                    )
+            except Exception as e:
+                logger.warning(f"Failed to look up project {project_id}: {str(e)}")
+                return
+
+        with self._lock:
+            if name is not None:
+                self._project_names[project_id] = name
+            if name in self.project_names:
+                self._stale[name] = time.monotonic() + self.reload_delay
+
+    def load(self, project_name: str) -> None:
+        """Load a project from its snapshot if current, else from Postgres"""
+        try:
+            with get_db() as db:
+                index = self._load_snapshot(db, project_name) or self._load_database(
+                    db, project_name
+                )
+        except Exception as e:
+            logger.error(f"Failed to load {project_name} into memory: {str(e)}")
+            return
+
+        with self._lock:
+            if index is None:
+                self._indexes.pop(project_name, None)
+            else:
+                self._indexes[project_name] = index
+            # Changes notified while loading are covered by the next reload
+            if self._stale.get(project_name, 0) <= time.monotonic():
+                self._stale.pop(project_name, None)
+
+        MEMORY_INDEX_CHUNKS.labels(project_name).set(
+            len(index.ids) if index is not None else 0
+        )
+
+    def _run(self) -> None:
+        for project_name in self.project_names:
+            self.load(project_name)
+
+        while True:
+            try:
+                self._listen()
+            except Exception as e:
+                logger.warning(f"Lost chunk change notifications: {str(e)}")
+
+            # Changes may have been missed while disconnected, including to
+            # projects not loaded yet
+            with self._lock:
+                for project_name in self.project_names:
+                    self._stale[project_name] = time.monotonic()
+            time.sleep(self.reload_delay)
+
+    def _listen(self) -> None:
+        # psycopg2 takes plain postgresql:// URLs, without a driver name
+        connection = psycopg2.connect(
+            engine.url.set(drivername="postgresql").render_as_string(
+                hide_password=False
+            )
+        )
+        connection.autocommit = True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHUNKS_CHANGED_CHANNEL}")
+
+            while True:
+                self._reload_due()
+
+                if select.select([connection], [], [], 1.0)[0]:
+                    connection.poll()
+                    while connection.notifies:
+                        notification = connection.notifies.pop(0)
+                        self.mark_stale(int(notification.payload))
+        finally:
+            connection.close()
+
+    def _reload_due(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            due = [name for name, at in self._stale.items() if at <= now]
+
+        for project_name in due:
+            self.load(project_name)
+
+    def _read_project(self, db: Session, project_name: str) -> Optional[Project]:
+        project = db.query(Project).filter(Project.name == project_name).first()
+        if project is not None:
+            with self._lock:
+                self._project_names[project.id] = project_name
+        if project is None or project.embedding_dim is None:
+            logger.warning(f"Project {project_name} is not indexed, not loading it")
+            return None
+
+        if project.chunk_count > self.max_chunks:
+            logger.warning(
+                f"Project {project_name} has {project.chunk_count} chunks, more "
+                f"than MEMORY_INDEX_MAX_CHUNKS ({self.max_chunks}); serving it "
+                "from Postgres"
+            )
+            return None
+
+        return project
+
+    def _load_database(self, db: Session, project_name: str) -> Optional[ProjectIndex]:
+        # One snapshot for the version, embeddings and metadata
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+
+        project = self._read_project(db, project_name)
+        if project is None:
+            return None
+
+        index = load_project_index(db, project, backend)
+        db.rollback()
+
+        MEMORY_INDEX_LOADS.labels("database").inc()
+        logger.info(f"Loaded {len(index.ids)} chunks of {project_name} into memory")
+
+        self._save_snapshot(project_name, index)
+        return index
+
+    def _snapshot_path(self, project_name: str, suffix: str) -> str:
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", project_name)
+        return os.path.join(self.snapshot_dir, f"{safe_name}{suffix}")
+
+    def _load_snapshot(self, db: Session, project_name: str) -> Optional[ProjectIndex]:
+        if not self.snapshot_dir:
+            return None
+
+        try:
+            with open(self._snapshot_path(project_name, ".json")) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        project = self._read_project(db, project_name)
+        db.rollback()
+        if project is None or (project.id, project.chunks_version) != (
+            meta["project_id"],
+            meta["version"],
+        ):
+            return None
+
+        prefix = f".{meta['version']}"
+        index = ProjectIndex(
+            meta["project_id"],
+            meta["version"],
+            np.load(self._snapshot_path(project_name, f"{prefix}.ids.npy")),
+            np.load(
+                self._snapshot_path(project_name, f"{prefix}.embeddings.npy"),
+                mmap_mode="r",
+            ),
+            np.load(self._snapshot_path(project_name, f"{prefix}.norms.npy")),
+            meta["chunks"],
+            project.path,
+            project.embedding_version_id,
+        )
+
+        MEMORY_INDEX_LOADS.labels("snapshot").inc()
+        logger.info(f"Mapped {len(index.ids)} chunks of {project_name} from snapshot")
+        return index
+
+    def _save_snapshot(self, project_name: str, index: ProjectIndex) -> None:
+        if not self.snapshot_dir:
+            return
+
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            prefix = f".{index.version}"
+            np.save(self._snapshot_path(project_name, f"{prefix}.ids.npy"), index.ids)
+            np.save(
+                self._snapshot_path(project_name, f"{prefix}.embeddings.npy"),
+                index.matrix,
+            )
+            np.save(
+                self._snapshot_path(project_name, f"{prefix}.norms.npy"), index.norms
+            )
+
+            # The metadata file points at the arrays, replace it last and
+            # atomically so readers never see a partial snapshot
+            meta_path = self._snapshot_path(project_name, ".json")
+            with open(meta_path + ".tmp", "w") as f:
+                json.dump(
+                    {
+                        "project_id": index.project_id,
+                        "version": index.version,
+                        "chunks": index.chunks,
+                    },
+                    f,
+                )
+            os.replace(meta_path + ".tmp", meta_path)
+
+            self._remove_old_snapshots(project_name, index.version)
+
+        except Exception as e:
+            logger.warning(f"Failed to save snapshot of {project_name}: {str(e)}")
+
+    def _remove_old_snapshots(self, project_name: str, version: int) -> None:
+        prefix = os.path.basename(self._snapshot_path(project_name, "."))
+        current = f"{prefix}{version}."
+        for name in os.listdir(self.snapshot_dir):
+            if (
+                name.startswith(prefix)
+                and name.endswith(".npy")
+                and not name.startswith(current)
+            ):
+                os.remove(os.path.join(self.snapshot_dir, name))
@@ -0,0 +1,455 @@
+import os
+import time
+from loguru import logger
+from typing import Any, Dict, Optional
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.orm import Session
+
+from src.agent.llm import EmbeddingSpace, LLMService
+from src.consts.vectors import EMBEDDING_MAX_ATTEMPTS
+from src.database.backends import StorageBackend, backend
+from src.database.pgvector import get_db, EmbeddingVersion, Project, CodeChunk
+from src.telemetry.metrics import (
+    EMBEDDING_MIGRATION_CHUNKS,
+    EMBEDDING_MIGRATION_CUTOVERS,
+)
+from src.telemetry.tracing import span
+
+# Chunks re-embedded per provider request while migrating a project
+EMBEDDING_MIGRATION_BATCH_SIZE = int(os.getenv("EMBEDDING_MIGRATION_BATCH_SIZE", "32"))
+
+# Chunks per second each indexing worker re-embeds at most while migrating,
+# on top of the scheduler's throttling of bulk work. 0 disables the limit.
+EMBEDDING_MIGRATION_RATE = float(os.getenv("EMBEDDING_MIGRATION_RATE", "20"))
+
+# Seconds to wait before migrating again after the provider failed, or when
+# a project's last chunks are held by indexing
+EMBEDDING_MIGRATION_RETRY_DELAY = float(
+    os.getenv("EMBEDDING_MIGRATION_RETRY_DELAY", "10.0")
+)
+
+
+def _migratable():
+    """Chunks still to re-embed, unless given up on after failed attempts"""
+    return CodeChunk.next_embedding.is_(None) & or_(
+        CodeChunk.next_embedding_attempts.is_(None),
+        CodeChunk.next_embedding_attempts < EMBEDDING_MAX_ATTEMPTS,
+    )
+
+
+def project_embedding_space(project: Any) -> Optional[EmbeddingSpace]:
+    """
+    The embedding space a project's chunks are embedded in.
+
+    Args:
+        project: Project, or a row with its embedding_model and embedding_dim
+
+    Returns:
+        The space, or None if the project has no embeddings yet
+    """
+    if project is None or project.embedding_dim is None:
+        return None
+    return EmbeddingSpace(project.embedding_model, project.embedding_dim)
+
+
+def get_embedding_version(db: Session, space: EmbeddingSpace) -> int:
+    """
+    The ID of the version of an embedding space, recorded if it is new.
+
+    Args:
+        db: Database session
+        space: Embedding model and dimensions
+
+    Returns:
+        ID of the embedding version
+    """
+    db.execute(
+        backend.insert(EmbeddingVersion)
+        .values(model=space.model, dims=space.dims)
+        .on_conflict_do_nothing(
+            index_elements=[EmbeddingVersion.model, EmbeddingVersion.dims]
+        )
+    )
+    return db.execute(
+        select(EmbeddingVersion.id).where(
+            EmbeddingVersion.model == space.model,
+            EmbeddingVersion.dims == space.dims,
+        )
+    ).scalar_one()
+
+
+def start_migration(db: Session, project_id: int, space: EmbeddingSpace) -> None:
+    """
+    Move a project to an embedding space. A project without chunks switches
+    right away. Otherwise it keeps being searched with the version its chunks
+    are embedded with, while EmbeddingMigrator re-embeds them with the new one
+    in the background. The caller is responsible for committing.
+
+    Args:
+        db: Database session
+        project_id: ID of the project
+        space: Embedding model and dimensions to move to
+    """
+    version_id = get_embedding_version(db, space)
+    project = db.execute(
+        select(
+            Project.embedding_model,
+            Project.embedding_dim,
+            Project.embedding_version_id,
+            Project.next_embedding_version_id,
+            Project.chunk_count,
+        ).where(Project.id == project_id)
+    ).one()
+
+    current = project.embedding_version_id
+    if current is None and project_embedding_space(project) == space:
+        # Indexed with this model before versions were recorded
+        db.execute(
+            update(CodeChunk)
+            .where(
+                CodeChunk.project_id == project_id,
+                CodeChunk.embedding.is_not(None),
+                CodeChunk.embedding_version_id.is_(None),
+            )
+            .values(embedding_version_id=version_id)
+        )
+        current = version_id
+
+    if current == version_id or not project.chunk_count:
+        if project.next_embedding_version_id is not None:
+            logger.info(
+                f"Embeddings of project {project_id} are {space.model} "
+                f"({space.dims} dims) again, stopping their migration"
+            )
+            _clear_next_embeddings(db, project_id)
+        db.execute(
+            update(Project)
+            .where(Project.id == project_id)
+            .values(
+                embedding_model=space.model,
+                embedding_dim=space.dims,
+                embedding_version_id=version_id,
+                next_embedding_version_id=None,
+            )
+        )
+        return
+
+    if project.next_embedding_version_id == version_id:
+        return
+
+    logger.info(
+        f"Embeddings of project {project_id} changed from "
+        f"{project.embedding_model} ({project.embedding_dim} dims) to "
+        f"{space.model} ({space.dims} dims), re-embedding them in the background"
+    )
+    if project.next_embedding_version_id is not None:
+        _clear_next_embeddings(db, project_id)
+    db.execute(
+        update(Project)
+        .where(Project.id == project_id)
+        .values(next_embedding_version_id=version_id)
+    )
+
+
+def _clear_next_embeddings(db: Session, project_id: int) -> None:
+    """Drop the embeddings of an abandoned migration"""
+    db.execute(
+        update(CodeChunk)
+        .where(
+            CodeChunk.project_id == project_id,
+            or_(
+                CodeChunk.next_embedding.is_not(None),
+                CodeChunk.next_embedding_attempts.is_not(None),
+            ),
+        )
+        .values(next_embedding=None, next_embedding_attempts=None)
+    )
+
+
+def get_migration_status(db: Session, project: Project) -> Optional[Dict[str, Any]]:
+    """
+    Progress of the migration of a project to a new embedding version.
+
+    Args:
+        db: Database session
+        project: Project
+
+    Returns:
+        Dictionary with the model and dimensions migrated to, and how many
+        chunks have been re-embedded and given up on, or None if no
+        migration is running
+    """
+    if project.next_embedding_version_id is None:
+        return None
+
+    version = db.get(EmbeddingVersion, project.next_embedding_version_id)
+    embedded, failed = db.execute(
+        select(
+            func.count(CodeChunk.next_embedding),
+            func.count().filter(
+                CodeChunk.next_embedding_attempts >= EMBEDDING_MAX_ATTEMPTS
+            ),
+        ).where(CodeChunk.project_id == project.id)
+    ).one()
+    return {
+        "model": version.model,
+        "dims": version.dims,
+        "chunks_embedded": embedded,
+        "chunks_failed": failed,
+        "chunks_total": project.chunk_count,
+        "coverage": embedded / project.chunk_count if project.chunk_count else 1.0,
+    }
+
+
+class EmbeddingMigrator:
+    """
+    Re-embeds the chunks of projects moving to a new embedding version, a
+    batch at a time, and switches each project over once all of its chunks
+    have been. Projects take turns, so one failing project doesn't hold up
+    the others, and chunks failing EMBEDDING_MAX_ATTEMPTS times are left
+    pending rather than holding up the switch.
+
+    New embeddings go to next_embedding, which is never searched. The switch
+    copies them over embedding and changes the project's version in one
+    transaction, so searches see either version entirely. Chunks are claimed
+    with SELECT ... FOR UPDATE SKIP LOCKED, so several workers can migrate
+    the same project.
+    """
+
+    def __init__(
+        self,
+        llm_service: LLMService,
+        storage_backend: StorageBackend = backend,
+        batch_size: int = EMBEDDING_MIGRATION_BATCH_SIZE,
+        rate: float = EMBEDDING_MIGRATION_RATE,
+    ):
+        self.llm_service = llm_service
+        self.backend = storage_backend
+        self.batch_size = batch_size
+        self.rate = rate
+
+        # Last chunk ID migrated of each project, where the next batch starts
+        self._positions: Dict[int, int] = {}
+        # Project migrated last, the next one after it goes next
+        self._last_project_id = 0
+
+    def run_once(self) -> Optional[float]:
+        """
+        Migrate one batch of chunks of a project being migrated.
+
+        Returns:
+            Seconds to wait before the next batch, or None if no project is
+            being migrated
+        """
+        start = time.monotonic()
+        try:
+            with get_db() as db:
+                project = db.execute(
+                    select(
+                        Project.id,
+                        Project.next_embedding_version_id,
+                        EmbeddingVersion.model,
+                        EmbeddingVersion.dims,
+                    )
+                    .join(
+                        EmbeddingVersion,
+                        EmbeddingVersion.id == Project.next_embedding_version_id,
+                    )
+                    .order_by(Project.id <= self._last_project_id, Project.id)
+                    .limit(1)
+                ).first()
+                if project is None:
+                    self._positions.clear()
+                    return None
+
+                self._last_project_id = project.id
+
+                migrated = self.migrate_batch(
+                    db,
+                    project.id,
+                    project.next_embedding_version_id,
+                    EmbeddingSpace(project.model, project.dims),
+                )
+
+        except Exception as e:
+            logger.warning(f"Embedding migration failed, retrying later: {str(e)}")
+            return EMBEDDING_MIGRATION_RETRY_DELAY
+
+        if not migrated:
+            return EMBEDDING_MIGRATION_RETRY_DELAY
+        if not self.rate:
+            return 0.0
+        return max(0.0, migrated / self.rate - (time.monotonic() - start))
+
+    def migrate_batch(
+        self, db: Session, project_id: int, version_id: int, space: EmbeddingSpace
+    ) -> int:
+        """
+        Re-embed the next batch of chunks of a project without an embedding
+        of its next version. Once a pass over the project finds none left,
+        the project is switched over.
+
+        Args:
+            db: Database session
+            project_id: ID of the project
+            version_id: ID of the embedding version migrated to
+            space: Embedding model and dimensions of that version
+
+        Returns:
+            Number of chunks re-embedded
+        """
+        after = self._positions.get(project_id, 0)
+        rows = db.execute(
+            select(CodeChunk.id, CodeChunk.content)
+            .where(
+                CodeChunk.project_id == project_id,
+                CodeChunk.id > after,
+                _migratable(),
+            )
+            .order_by(CodeChunk.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        ).fetchall()
+
+        if not rows:
+            db.rollback()
+            if after:
+                # Start over for chunks added, or locked by others, meanwhile
+                self._positions[project_id] = 0
+                return self.migrate_batch(db, project_id, version_id, space)
+
+            self.cutover(db, project_id, version_id)
+            return 0
+
+        # The migration may have been replaced since the project was read.
+        # Replacing it clears the chunks locked here after they're written.
+        next_version_id = db.execute(
+            select(Project.next_embedding_version_id).where(Project.id == project_id)
+        ).scalar()
+        if next_version_id != version_id:
+            db.rollback()
+            return 0
+
+        ids = [row.id for row in rows]
+        try:
+            with span("migration.embed", chunks=len(rows)):
+                embeddings = self.llm_service.generate_embeddings(
+                    [row.content for row in rows], space=space
+                )
+        except Exception:
+            db.rollback()
+            db.execute(
+                update(CodeChunk)
+                .where(CodeChunk.id.in_(ids))
+                .values(
+                    next_embedding_attempts=func.coalesce(
+                        CodeChunk.next_embedding_attempts, 0
+                    )
+                    + 1
+                )
+            )
+            db.commit()
+            raise
+
+        db.execute(
+            update(CodeChunk),
+            [
+                {"id": chunk_id, "next_embedding": embedding}
+                for chunk_id, embedding in zip(ids, embeddings)
+            ],
+        )
+        db.commit()
+
+        self._positions[project_id] = rows[-1].id
+        EMBEDDING_MIGRATION_CHUNKS.inc(len(rows))
+        return len(rows)
+
+    def cutover(self, db: Session, project_id: int, version_id: int) -> bool:
+        """
+        Switch a project over to its next embedding version if every chunk
+        has an embedding of it, or was given up on, in a single transaction.
+
+        Chunks are locked before the project, as indexing does. Chunks given
+        up on, and chunks stored since the check, embedded with the old
+        version, are left pending an embedding with the new one; indexing stores chunks
+        embedded with an old version as pending itself, once it sees the
+        project's version under its lock.
+
+        Args:
+            db: Database session
+            project_id: ID of the project
+            version_id: ID of the embedding version migrated to
+
+        Returns:
+            Whether the project was switched over
+        """
+        missing = db.execute(
+            select(func.count()).where(
+                CodeChunk.project_id == project_id,
+                _migratable(),
+            )
+        ).scalar_one()
+        if missing:
+            db.rollback()
+            return False
+
+        version = db.get(EmbeddingVersion, version_id)
+        db.execute(
+            update(CodeChunk)
+            .where(
+                CodeChunk.project_id == project_id,
+                CodeChunk.next_embedding.is_not(None),
+            )
+            .values(
+                embedding=CodeChunk.next_embedding,
+                next_embedding=None,
+                next_embedding_attempts=None,
+                embedding_version_id=version_id,
+                embedding_state="embedded",
+                embedding_attempts=0,
+            )
+        )
+        switched = db.execute(
+            update(Project)
+            .where(
+                Project.id == project_id,
+                Project.next_embedding_version_id == version_id,
+            )
+            .values(
+                embedding_model=version.model,
+                embedding_dim=version.dims,
+                embedding_version_id=version_id,
+                next_embedding_version_id=None,
+            )
+        ).rowcount
+        if not switched:
+            db.rollback()
+            return False
+
+        # Once the project is locked, chunks stored since the check are
+        # committed, and later ones will see the new version
+        db.execute(
+            update(CodeChunk)
+            .where(
+                CodeChunk.project_id == project_id,
+                CodeChunk.embedding_version_id.is_distinct_from(version_id),
+            )
+            .values(
+                embedding=None,
+                embedding_version_id=None,
+                embedding_state="pending",
+                embedding_attempts=0,
+                next_embedding_attempts=None,
+            )
+        )
+
+        self.backend.chunks_changed(db, project_id)
+        db.commit()
+
+        self._positions.pop(project_id, None)
+        EMBEDDING_MIGRATION_CUTOVERS.inc()
+        logger.info(
+            f"Project {project_id} switched over to {version.model} "
+            f"({version.dims} dims)"
+        )
+        return True
@@ -0,0 +1,238 @@
+import os
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from loguru import logger
+from typing import List, Dict, Any, Optional, Tuple
+from sqlalchemy.orm import Session
+
+from src.consts.vectors import VECTOR_DISTANCE_METRIC
+from src.database.pgvector import Project
+from src.agent.llm import EmbeddingSpace, LLMService
+from src.agent.scheduler import Priority
+from src.vectors.flat_index import ChunkRow, ProjectIndex
+from src.vectors.migration import project_embedding_space
+from src.vectors.scope import SearchScope
+from src.telemetry.metrics import OVERLAY_EMBEDDINGS
+from src.telemetry.tracing import span
+
+# Embeddings of buffer chunks kept across requests, so asking again about
+# the same unsaved buffer doesn't embed it again
+OVERLAY_EMBEDDING_CACHE_SIZE = int(os.getenv("OVERLAY_EMBEDDING_CACHE_SIZE", "4096"))
+
+
+class EmbeddingCache:
+    """Least recently used embeddings of texts, by their content"""
+
+    def __init__(self, size: int = OVERLAY_EMBEDDING_CACHE_SIZE):
+        self.size = size
+        self._embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, model: Optional[str], dims: int, text: str) -> str:
+        """Cache key of a text embedded by a model with some dimensions"""
+        return hashlib.sha256(f"{model}\0{dims}\0{text}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            embedding = self._embeddings.get(key)
+            if embedding is not None:
+                self._embeddings.move_to_end(key)
+            return embedding
+
+    def put(self, key: str, embedding: np.ndarray) -> None:
+        with self._lock:
+            self._embeddings[key] = embedding
+            self._embeddings.move_to_end(key)
+            while len(self._embeddings) > self.size:
+                self._embeddings.popitem(last=False)
+
+
+class BufferOverlay:
+    """
+    Unsaved buffers sent with a request, chunked and embedded for that
+    request only. Their chunks are searched together with the stored ones,
+    and shadow the stored chunks of the same files.
+    """
+
+    def __init__(self, indexes: Dict[str, ProjectIndex], metric: str):
+        """
+        Args:
+            indexes: Chunks of the buffers of each project, by project name
+            metric: Distance metric of the stored chunks
+        """
+        self.indexes = indexes
+        self.metric = metric
+
+    def shadowed(self, project_name: str) -> List[str]:
+        """Files of a project whose stored chunks the buffers replace"""
+        index = self.indexes.get(project_name)
+        return index.files.tolist() if index is not None else []
+
+    def search(
+        self,
+        project_name: str,
+        query_embedding: np.ndarray,
+        limit: int,
+        scope: Optional[SearchScope] = None,
+    ) -> List[ChunkRow]:
+        """
+        Find the buffer chunks of a project nearest to an embedding.
+
+        Args:
+            project_name: Name of the project
+            query_embedding: Embedding to search for
+            limit: Maximum number of results
+            scope: Optional files, directories and languages to search in,
+                relative to the project root
+
+        Returns:
+            Chunks with their distance, nearest first
+        """
+        index = self.indexes.get(project_name)
+        if index is None or len(query_embedding) != index.dims:
+            return []
+        return index.search(query_embedding, limit, self.metric, scope)
+
+
+class OverlayBuilder:
+    """Builds the overlay of the unsaved buffers sent with a request"""
+
+    def __init__(
+        self,
+        indexer: Any,
+        llm_service: LLMService,
+        cache: Optional[EmbeddingCache] = None,
+        metric: str = VECTOR_DISTANCE_METRIC,
+    ):
+        self.indexer = indexer
+        self.llm_service = llm_service
+        self.cache = cache or EmbeddingCache()
+        self.metric = metric
+
+    def build(
+        self,
+        db: Session,
+        project_names: List[str],
+        buffers: List[Dict[str, Any]],
+    ) -> Optional[BufferOverlay]:
+        """
+        Chunk and embed unsaved buffers. Each buffer belongs to the project
+        it names, or else to the searched project its absolute path is in,
+        or else to the first searched project.
+
+        Args:
+            db: Database session
+            project_names: Names of the projects searched
+            buffers: Buffers with file_path, content and optional project_name
+
+        Returns:
+            The overlay, or None if no buffer belongs to a searched project
+        """
+        projects = {
+            project.name: project
+            for project in db.query(Project).filter(Project.name.in_(project_names))
+        }
+
+        # Chunks of every buffer, by project
+        files: Dict[str, List] = {}
+        for buffer in buffers:
+            project, file_path = self._locate(
+                projects, project_names, buffer["file_path"], buffer.get("project_name")
+            )
+            if project is None:
+                logger.debug(f"Buffer {buffer['file_path']} is in no searched project")
+                continue
+
+            language, chunks = self.indexer.chunk_buffer(file_path, buffer["content"])
+            files.setdefault(project.name, []).extend(
+                [
+                    chunk["content"],
+                    chunk["start_line"],
+                    chunk["end_line"],
+                    file_path,
+                    language,
+                ]
+                for chunk in chunks
+            )
+
+        if not files:
+            return None
+
+        # Embedded like the query, in the space of the first project
+        with span("overlay.embed"):
+            embeddings = self._embed(
+                [chunk[0] for chunks in files.values() for chunk in chunks],
+                project_embedding_space(projects.get(project_names[0])),
+            )
+
+        indexes = {}
+        offset = 0
+        for name, chunks in files.items():
+            matrix = embeddings[offset : offset + len(chunks)]
+            # Negative IDs can't collide with stored chunks
+            ids = -np.arange(offset + 1, offset + len(chunks) + 1, dtype=np.int64)
+            indexes[name] = ProjectIndex(
+                projects[name].id,
+                projects[name].chunks_version,
+                ids,
+                matrix,
+                np.linalg.norm(matrix, axis=1),
+                chunks,
+                projects[name].path,
+            )
+            offset += len(chunks)
+
+        return BufferOverlay(indexes, self.metric)
+
+    def _locate(
+        self,
+        projects: Dict[str, Project],
+        project_names: List[str],
+        file_path: str,
+        project_name: Optional[str],
+    ) -> Tuple[Optional[Project], Optional[str]]:
+        """The project of a buffer, and its path relative to the project"""
+        if project_name is not None:
+            candidates = [project_name]
+        elif os.path.isabs(file_path):
+            candidates = project_names
+        else:
+            candidates = project_names[:1]
+
+        for name in candidates:
+            project = projects.get(name)
+            if project is None:
+                continue
+
+            if not os.path.isabs(file_path):
+                return project, os.path.normpath(file_path)
+
+            root = os.path.normpath(project.path)
+            if os.path.commonpath([root, os.path.normpath(file_path)]) == root:
+                return project, os.path.relpath(file_path, root)
+
+        return None, None
+
+    def _embed(
+        self, texts: List[str], space: Optional[EmbeddingSpace] = None
+    ) -> np.ndarray:
+        """Embed texts, with the cached embeddings of those seen before"""
+        space = space or self.llm_service.embedding_space
+        keys = [self.cache.key(space.model, space.dims, text) for text in texts]
+        cached = [self.cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(cached) if embedding is None]
+
+        OVERLAY_EMBEDDINGS.labels("cached").inc(len(texts) - len(missing))
+        OVERLAY_EMBEDDINGS.labels("embedded").inc(len(missing))
+
+        if missing:
+            embedded = self.llm_service.generate_embeddings(
+                [texts[i] for i in missing], priority=Priority.INTERACTIVE, space=space
+            )
+            for i, embedding in zip(missing, embedded):
+                cached[i] = embedding
+                self.cache.put(keys[i], embedding)
+
+        return np.asarray(cached, dtype=np.float32)
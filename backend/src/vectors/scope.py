@@ -0,0 +1,128 @@
+import os
+import numpy as np
+from typing import Any, List, Optional
+from sqlalchemy import and_, or_
+
+from src.database.pgvector import CodeFile
+
+
+class SearchScope:
+    """
+    Restricts a search to some files, directories and languages of a
+    project, and leaves out some files. Empty lists don't restrict anything.
+    """
+
+    def __init__(
+        self,
+        paths: Optional[List[str]] = None,
+        languages: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+    ):
+        self.paths = [self._normalize(path) for path in paths or []]
+        self.languages = [language.lower() for language in languages or []]
+        # Files relative to the project root
+        self.exclude = [self._normalize(path) for path in exclude or []]
+
+    def __bool__(self) -> bool:
+        return bool(self.paths or self.languages or self.exclude)
+
+    def _normalize(self, path: str) -> str:
+        path = os.path.normpath(path)
+        return "" if path == "." else path
+
+    def for_project(self, project_path: str) -> Optional["SearchScope"]:
+        """
+        The scope relative to a project's root. Absolute paths outside the
+        project are dropped.
+
+        Args:
+            project_path: Path to the project root
+
+        Returns:
+            The scope, or None if paths were given and none is in the project
+        """
+        if not self.paths:
+            return self
+
+        root = os.path.normpath(project_path)
+        paths = []
+        for path in self.paths:
+            if os.path.isabs(path):
+                if os.path.commonpath([root, path]) != root:
+                    continue
+                path = os.path.relpath(path, root)
+            paths.append(path)
+
+        if not paths:
+            return None
+        return SearchScope(paths, self.languages, self.exclude)
+
+    def excluding(self, file_paths: List[str]) -> "SearchScope":
+        """
+        The scope without some more files.
+
+        Args:
+            file_paths: Files relative to the project root
+
+        Returns:
+            The new scope
+        """
+        return SearchScope(self.paths, self.languages, self.exclude + file_paths)
+
+    def clause(self) -> Any:
+        """
+        SQL filter on CodeFile for the scope, to AND into a search.
+
+        Returns:
+            The filter, or None when the scope restricts nothing
+        """
+        conditions = []
+
+        if self.paths and "" not in self.paths:
+            # A path is a file, or a directory containing files
+            conditions.append(
+                or_(
+                    CodeFile.file_path.in_(self.paths),
+                    *[
+                        CodeFile.file_path.startswith(path + "/", autoescape=True)
+                        for path in self.paths
+                    ],
+                )
+            )
+
+        if self.languages:
+            conditions.append(CodeFile.language.in_(self.languages))
+
+        if self.exclude:
+            conditions.append(CodeFile.file_path.not_in(self.exclude))
+
+        if not conditions:
+            return None
+        return and_(*conditions)
+
+    def mask(self, file_paths: np.ndarray, languages: np.ndarray) -> np.ndarray:
+        """
+        Which chunks of an in-memory index are in the scope.
+
+        Args:
+            file_paths: File path of every chunk
+            languages: Language of every chunk
+
+        Returns:
+            Boolean array, True for chunks in the scope
+        """
+        mask = np.ones(len(file_paths), dtype=bool)
+
+        if self.paths and "" not in self.paths:
+            in_paths = np.isin(file_paths, self.paths)
+            for path in self.paths:
+                in_paths |= np.char.startswith(file_paths, path + "/")
+            mask &= in_paths
+
+        if self.languages:
+            mask &= np.isin(languages, self.languages)
+
+        if self.exclude:
+            mask &= ~np.isin(file_paths, self.exclude)
+
+        return mask
@@ -0,0 +1,536 @@
+"""
+Export a project's index to a snapshot file, and import it elsewhere without
+embedding anything again:
+
+    uv run -m src.vectors.snapshot export my-project my-project.tar.gz
+    uv run -m src.vectors.snapshot import my-project.tar.gz --project-path ~/src/my-project
+"""
+
+import io
+import os
+import sys
+import json
+import hashlib
+import tarfile
+import argparse
+import numpy as np
+from datetime import datetime, timezone
+from loguru import logger
+from typing import Any, Dict, Iterator, List, Optional
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from src.agent.llm import EmbeddingSpace, LLMService, normalize_embeddings
+from src.consts.vectors import EMBEDDING_NORMALIZE
+from src.database.backends import backend
+from src.database.pgvector import get_db, Project, CodeFile, CodeChunk, CodeSymbol
+from src.telemetry.tracing import span
+from src.vectors.migration import get_embedding_version
+
+# Version of the snapshot layout, checked on import
+SNAPSHOT_FORMAT = 1
+
+# Rows per part of a snapshot. Export and import hold one part in memory at
+# a time, whatever the size of the project.
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", "2000"))
+
+# Modification time of imported files not verified unchanged on disk, older
+# than any file, so indexing embeds them again. code_files.last_modified
+# can't be NULL in existing databases.
+NOT_INDEXED = datetime(1970, 1, 1)
+
+# Columns of files and symbols stored in snapshots
+FILE_COLUMNS = (
+    "file_path",
+    "language",
+    "last_modified",
+    "chunk_count",
+    "byte_count",
+    "token_count",
+    "skip_reason",
+)
+SYMBOL_COLUMNS = ("name", "kind", "line", "definition")
+
+# Project counters stored in snapshots
+PROJECT_COUNTERS = ("file_count", "chunk_count", "byte_count", "token_count")
+
+
+def _batches(rows: Iterator[Any], size: int) -> Iterator[List[Any]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _add(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(datetime.now().timestamp())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _jsonl(rows: List[Dict[str, Any]]) -> bytes:
+    return "".join(json.dumps(row) + "\n" for row in rows).encode("utf-8")
+
+
+def _npy(matrix: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, matrix)
+    return buffer.getvalue()
+
+
+def export_snapshot(
+    db: Session, project_name: str, output: str, batch_size: int = SNAPSHOT_BATCH_SIZE
+) -> Dict[str, Any]:
+    """
+    Write a project's files, chunks, embeddings and symbols to a snapshot.
+
+    A snapshot is a tar archive, gzipped if the output ends in ".gz", of a
+    manifest followed by parts of at most batch_size rows: files and
+    symbols as JSON lines, chunks as JSON lines with their embeddings as a
+    float32 .npy matrix next to them. Rows are streamed from the database
+    part by part.
+
+    Args:
+        db: Database session, not yet in a transaction
+        project_name: Name of the project
+        output: Path of the snapshot file
+        batch_size: Rows per part
+
+    Returns:
+        The manifest of the snapshot
+
+    Raises:
+        LookupError: If the project doesn't exist
+        ValueError: If the project has no embeddings yet
+    """
+    if backend.name == "postgres":
+        # Every table read from the same snapshot of the database
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+
+    project = db.query(Project).filter(Project.name == project_name).first()
+    if project is None:
+        raise LookupError(f"Project {project_name} not found")
+    if project.embedding_dim is None:
+        raise ValueError(f"Project {project_name} has not been indexed yet")
+
+    dims = project.embedding_dim
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "project": {
+            "name": project.name,
+            "path": project.path,
+            "repo_map": project.repo_map,
+            **{counter: getattr(project, counter) for counter in PROJECT_COUNTERS},
+        },
+        "embedding": {"model": project.embedding_model, "dims": dims},
+        "rows": {
+            "files": db.scalar(
+                select(func.count()).where(CodeFile.project_id == project.id)
+            ),
+            "chunks": db.scalar(
+                select(func.count()).where(CodeChunk.project_id == project.id)
+            ),
+            "symbols": db.scalar(
+                select(func.count()).where(CodeSymbol.project_id == project.id)
+            ),
+        },
+    }
+
+    with (
+        span("snapshot.export", project_name=project_name),
+        tarfile.open(output, "w:gz" if output.endswith(".gz") else "w") as tar,
+    ):
+        _add(tar, "manifest.json", json.dumps(manifest, indent=2).encode("utf-8"))
+
+        # Files are referred to by their position in the snapshot
+        positions: Dict[int, int] = {}
+        files = db.execute(
+            select(CodeFile.id, *[getattr(CodeFile, c) for c in FILE_COLUMNS])
+            .where(CodeFile.project_id == project.id)
+            .order_by(CodeFile.id)
+            .execution_options(yield_per=batch_size)
+        )
+        for part, batch in enumerate(_batches(files, batch_size)):
+            rows = []
+            for row in batch:
+                positions[row.id] = len(positions)
+                values = {c: getattr(row, c) for c in FILE_COLUMNS}
+                if values["last_modified"] is not None:
+                    values["last_modified"] = values["last_modified"].isoformat()
+                rows.append(values)
+            _add(tar, f"files/{part:05d}.jsonl", _jsonl(rows))
+
+        # In line order within each file, so imports can tell whether the
+        # files they're given are the ones that were indexed
+        chunks = db.execute(
+            select(
+                CodeChunk.file_id,
+                CodeChunk.start_line,
+                CodeChunk.end_line,
+                CodeChunk.content,
+                CodeChunk.embedding,
+                CodeChunk.embedding_state,
+            )
+            .where(CodeChunk.project_id == project.id)
+            .order_by(CodeChunk.file_id, CodeChunk.start_line, CodeChunk.id)
+            .execution_options(yield_per=batch_size)
+        )
+        for part, batch in enumerate(_batches(chunks, batch_size)):
+            rows = []
+            matrix = np.zeros((len(batch), dims), dtype=np.float32)
+            for i, row in enumerate(batch):
+                embedded = (
+                    row.embedding_state == "embedded"
+                    and row.embedding is not None
+                    and len(row.embedding) == dims
+                )
+                if embedded:
+                    matrix[i] = row.embedding
+                rows.append(
+                    {
+                        "file": positions[row.file_id],
+                        "start_line": row.start_line,
+                        "end_line": row.end_line,
+                        "content": row.content,
+                        "embedded": embedded,
+                    }
+                )
+            _add(tar, f"chunks/{part:05d}.jsonl", _jsonl(rows))
+            _add(tar, f"chunks/{part:05d}.npy", _npy(matrix))
+
+        symbols = db.execute(
+            select(
+                CodeSymbol.file_id, *[getattr(CodeSymbol, c) for c in SYMBOL_COLUMNS]
+            )
+            .where(CodeSymbol.project_id == project.id)
+            .order_by(CodeSymbol.id)
+            .execution_options(yield_per=batch_size)
+        )
+        for part, batch in enumerate(_batches(symbols, batch_size)):
+            rows = [
+                {
+                    "file": positions[row.file_id],
+                    **{c: getattr(row, c) for c in SYMBOL_COLUMNS},
+                }
+                for row in batch
+            ]
+            _add(tar, f"symbols/{part:05d}.jsonl", _jsonl(rows))
+
+    db.rollback()
+    logger.info(
+        f"Exported {manifest['rows']['chunks']} chunks of {project_name} to {output}"
+    )
+    return manifest
+
+
+class _FileDigests:
+    """
+    Digests of the content of each file as indexed, rebuilt from its chunks.
+    Chunks overlap and cover every line, so each line is taken from the
+    first chunk holding it.
+    """
+
+    def __init__(self):
+        self.digests: Dict[int, Optional[bytes]] = {}
+        self._file: Optional[int] = None
+        self._hash = None
+        self._next_line = 1
+
+    def add(self, chunk: Dict[str, Any]) -> None:
+        if chunk["file"] != self._file:
+            self._finish()
+            self._file = chunk["file"]
+            self._hash = hashlib.sha256()
+            self._next_line = 1
+
+        if self._hash is None:
+            return
+        if chunk["start_line"] > self._next_line:
+            # A gap, the file can't be verified
+            self._hash = None
+            return
+
+        lines = chunk["content"].split("\n")
+        for line in lines[self._next_line - chunk["start_line"] :]:
+            if self._next_line > 1:
+                self._hash.update(b"\n")
+            self._hash.update(line.encode("utf-8"))
+            self._next_line += 1
+
+    def _finish(self) -> None:
+        if self._file is not None:
+            self.digests[self._file] = (
+                self._hash.digest() if self._hash is not None else None
+            )
+
+    def finish(self) -> Dict[int, Optional[bytes]]:
+        self._finish()
+        self._file = None
+        return self.digests
+
+
+def _disk_digest(file_path: str) -> bytes:
+    # Lines split the way the indexer splits them
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+        return hashlib.sha256("\n".join(f.read().splitlines()).encode("utf-8")).digest()
+
+
+def import_snapshot(
+    db: Session,
+    snapshot: str,
+    embedding_model: Optional[str],
+    embedding_dims: int,
+    project_name: Optional[str] = None,
+    project_path: Optional[str] = None,
+    replace: bool = False,
+) -> Dict[str, Any]:
+    """
+    Load a snapshot into the database in a single transaction, bulk writing
+    chunks part by part.
+
+    Files found unchanged under the project path are marked as indexed at
+    their current modification time. All others, including every file when
+    the path doesn't exist, are marked as never indexed, so the next indexing run
+    re-embeds exactly the files that differ from the snapshot.
+
+    Args:
+        db: Database session
+        snapshot: Path of the snapshot file
+        embedding_model: Embedding model queries are embedded with here
+        embedding_dims: Dimensions queries are embedded with here
+        project_name: Name to import the project as, instead of its own
+        project_path: Where the project is checked out here, instead of
+            where it was when exported
+        replace: Whether to replace a project of the same name
+
+    Returns:
+        The manifest of the snapshot
+
+    Raises:
+        ValueError: If the snapshot is invalid, was embedded with another
+            model or dimensions, or the project exists and replace is False
+    """
+    with (
+        span("snapshot.import", snapshot=snapshot),
+        tarfile.open(snapshot, "r|*") as tar,
+    ):
+        members = iter(tar)
+        first = next(members, None)
+        if first is None or first.name != "manifest.json":
+            raise ValueError(f"{snapshot} is not a snapshot")
+        manifest = json.load(tar.extractfile(first))
+
+        if manifest.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported snapshot format {manifest.get('format')}")
+        embedding = manifest["embedding"]
+        if (embedding["model"], embedding["dims"]) != (
+            embedding_model,
+            embedding_dims,
+        ):
+            raise ValueError(
+                f"Snapshot was embedded with {embedding['model']} "
+                f"({embedding['dims']} dims), but queries here use "
+                f"{embedding_model} ({embedding_dims} dims)"
+            )
+
+        name = project_name or manifest["project"]["name"]
+        path = project_path or manifest["project"]["path"]
+        existing = db.scalar(select(Project.id).where(Project.name == name))
+        if existing is not None:
+            if not replace:
+                raise ValueError(f"Project {name} already exists")
+            for model in (CodeSymbol, CodeChunk, CodeFile, Project):
+                column = model.id if model is Project else model.project_id
+                db.execute(delete(model).where(column == existing))
+
+        version_id = get_embedding_version(
+            db, EmbeddingSpace(embedding_model, embedding_dims)
+        )
+        project_id = db.execute(
+            insert(Project)
+            .values(
+                name=name,
+                path=path,
+                repo_map=manifest["project"]["repo_map"],
+                embedding_model=embedding_model,
+                embedding_dim=embedding_dims,
+                embedding_version_id=version_id,
+                index_phase="completed",
+                index_finished_at=func.now(),
+                **{c: manifest["project"][c] for c in PROJECT_COUNTERS},
+            )
+            .returning(Project.id)
+        ).scalar_one()
+
+        file_ids: List[int] = []
+        file_paths: List[str] = []
+        digests = _FileDigests()
+        counts = {"files": 0, "chunks": 0, "symbols": 0}
+        chunks = None
+
+        for member in members:
+            kind, _, part = member.name.partition("/")
+            data = tar.extractfile(member).read()
+
+            if kind == "files":
+                rows = [json.loads(line) for line in data.splitlines()]
+                for row in rows:
+                    # Indexed again unless verified unchanged on disk below.
+                    # The exporter's times say nothing about the copies here,
+                    # which may be older and still differ.
+                    row["last_modified"] = NOT_INDEXED
+                    row["project_id"] = project_id
+                    file_paths.append(row["file_path"])
+                file_ids.extend(
+                    db.scalars(
+                        insert(CodeFile).returning(
+                            CodeFile.id, sort_by_parameter_order=True
+                        ),
+                        rows,
+                    ).all()
+                )
+                counts["files"] += len(rows)
+
+            elif kind == "chunks" and part.endswith(".jsonl"):
+                chunks = [json.loads(line) for line in data.splitlines()]
+
+            elif kind == "chunks" and part.endswith(".npy"):
+                matrix = np.load(io.BytesIO(data))
+                if chunks is None or matrix.shape != (len(chunks), embedding_dims):
+                    raise ValueError(f"Embeddings of {member.name} don't match")
+                if EMBEDDING_NORMALIZE:
+                    normalize_embeddings(matrix)
+
+                embedded = np.array([chunk["embedded"] for chunk in chunks], dtype=bool)
+                for rows, embeddings in (
+                    (np.flatnonzero(embedded), matrix[embedded]),
+                    (np.flatnonzero(~embedded), None),
+                ):
+                    backend.write_chunks(
+                        db,
+                        project_id,
+                        [file_ids[chunks[i]["file"]] for i in rows],
+                        [chunks[i] for i in rows],
+                        embeddings,
+                        version_id if embeddings is not None else None,
+                    )
+
+                for chunk in chunks:
+                    digests.add(chunk)
+                counts["chunks"] += len(chunks)
+                chunks = None
+
+            elif kind == "symbols":
+                rows = [json.loads(line) for line in data.splitlines()]
+                for row in rows:
+                    row["project_id"] = project_id
+                    row["file_id"] = file_ids[row.pop("file")]
+                db.execute(insert(CodeSymbol), rows)
+                counts["symbols"] += len(rows)
+
+        if counts != manifest["rows"]:
+            raise ValueError(
+                f"Snapshot is incomplete: expected {manifest['rows']}, read {counts}"
+            )
+
+    unchanged = _mark_unchanged(db, path, file_ids, file_paths, digests.finish())
+    backend.chunks_changed(db, project_id)
+    db.commit()
+
+    logger.info(
+        f"Imported {counts['chunks']} chunks of {name} from {snapshot}, "
+        f"{unchanged} of {counts['files']} files unchanged on disk"
+    )
+    return manifest
+
+
+def _mark_unchanged(
+    db: Session,
+    project_path: str,
+    file_ids: List[int],
+    file_paths: List[str],
+    digests: Dict[int, Optional[bytes]],
+) -> int:
+    """
+    Set the modification time of files whose content on disk is what was
+    indexed to their time on disk, so indexing skips them. Other files stay
+    marked as never indexed.
+
+    Returns:
+        Number of unchanged files
+    """
+    if not os.path.isdir(project_path):
+        return 0
+
+    unchanged = []
+    for position, digest in digests.items():
+        if digest is None:
+            continue
+        file_path = os.path.join(project_path, file_paths[position])
+        try:
+            mtime = os.stat(file_path).st_mtime
+            if _disk_digest(file_path) != digest:
+                continue
+        except OSError:
+            continue
+        unchanged.append(
+            {
+                "id": file_ids[position],
+                "last_modified": datetime.fromtimestamp(mtime),
+            }
+        )
+
+    for batch in _batches(iter(unchanged), SNAPSHOT_BATCH_SIZE):
+        db.execute(update(CodeFile), batch)
+    return len(unchanged)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Export a project")
+    export_parser.add_argument("project_name")
+    export_parser.add_argument("output", help="Snapshot file, gzipped if .gz")
+
+    import_parser = commands.add_parser("import", help="Import a snapshot")
+    import_parser.add_argument("snapshot")
+    import_parser.add_argument("--project-name", help="Name to import it as")
+    import_parser.add_argument("--project-path", help="Where the project is here")
+    import_parser.add_argument(
+        "--replace", action="store_true", help="Replace a project of the same name"
+    )
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="INFO")
+    backend.init_db()
+
+    try:
+        with get_db() as db:
+            if args.command == "export":
+                export_snapshot(db, args.project_name, args.output)
+            else:
+                # The model and dimensions indexing would embed with
+                llm_service = LLMService()
+                import_snapshot(
+                    db,
+                    args.snapshot,
+                    llm_service.embedding_model_name,
+                    llm_service.embedding_dims,
+                    args.project_name,
+                    args.project_path,
+                    args.replace,
+                )
+    except (LookupError, ValueError) as e:
+        parser.exit(1, f"{e}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,506 @@
+import os
+import re
+import ast
+import numpy as np
+import tiktoken
+from loguru import logger
+from typing import List, Dict, Any, Iterable, Optional
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from src.database.pgvector import Project, CodeFile, CodeChunk, CodeSymbol
+from src.vectors.overlay import BufferOverlay
+from src.vectors.scope import SearchScope
+from src.telemetry.metrics import SYMBOL_LOOKUPS
+
+# Tokens the repo map of a project is kept under. It is sent with every
+# question about the project.
+REPO_MAP_MAX_TOKENS = int(os.getenv("REPO_MAP_MAX_TOKENS", "1024"))
+
+# Names defined in more places than this are too ambiguous to look up, and
+# left to the vector search
+SYMBOL_MAX_DEFINITIONS = int(os.getenv("SYMBOL_MAX_DEFINITIONS", "3"))
+
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# Names in a question that look like code: in backticks, called, dotted,
+# snake_case, or camelCase/PascalCase
+MENTION = re.compile(
+    r"`([A-Za-z_][\w.:]*)`"
+    r"|\b([A-Za-z_]\w*)\("
+    r"|\b([A-Za-z_]\w*(?:[.:][A-Za-z_]\w*)+)"
+    r"|\b(\w*_\w*)"
+    r"|\b([A-Za-z][a-z0-9]*[A-Z]\w*)"
+)
+
+# Keywords and builtins of the indexed languages, never symbols
+KEYWORDS = frozenset(
+    """
+    and as assert async await break case catch class const continue def default
+    defer del delete do elif else elseif end enum except export extends false
+    final finally fn for from func function go if impl import in instanceof
+    interface is lambda let local loop match mod new nil none nonlocal not null
+    or package pass private protected pub public raise repeat return self
+    static struct super switch then this throw true try type typeof undefined
+    union unsafe until use var void while with yield int char float double long
+    bool boolean string str list dict len print range none true false cls
+    """.split()
+)
+
+# Definitions by language, as patterns matched against each line, with the
+# kind of symbol they define
+DEFINITION_PATTERNS = {
+    "python": [
+        (r"^\s*(?:async\s+)?def\s+(\w+)", "function"),
+        (r"^\s*class\s+(\w+)", "class"),
+    ],
+    "javascript": [
+        (
+            r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\*?\s*([\w$]+)",
+            "function",
+        ),
+        (r"^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+([\w$]+)", "class"),
+        (
+            r"^\s*(?:export\s+)?(?:const|let|var)\s+([\w$]+)\s*=\s*(?:async\s+)?"
+            r"(?:function|\([^)]*\)\s*=>|[\w$]+\s*=>)",
+            "function",
+        ),
+    ],
+    "lua": [
+        (r"^\s*(?:local\s+)?function\s+(?:[\w.]+[.:])?(\w+)", "function"),
+        (r"^\s*(?:local\s+)?(?:[\w.]+\.)?(\w+)\s*=\s*function\b", "function"),
+    ],
+    "go": [
+        (r"^func\s+(?:\([^)]*\)\s*)?(\w+)", "function"),
+        (r"^type\s+(\w+)", "type"),
+    ],
+    "rust": [
+        (
+            r"^\s*(?:pub(?:\([^)]*\))?\s+)?(?:const\s+)?(?:async\s+)?(?:unsafe\s+)?"
+            r"fn\s+(\w+)",
+            "function",
+        ),
+        (
+            r"^\s*(?:pub(?:\([^)]*\))?\s+)?(?:struct|enum|trait|type|union)\s+(\w+)",
+            "type",
+        ),
+    ],
+    "java": [
+        (
+            r"^\s*(?:(?:public|private|protected|static|final|abstract|sealed)\s+)*"
+            r"(?:class|interface|enum|record)\s+(\w+)",
+            "class",
+        ),
+        (
+            r"^\s*(?:(?:public|private|protected|static|final|abstract|"
+            r"synchronized)\s+)+[\w<>\[\],.? ]+?\s+(\w+)\s*\(",
+            "method",
+        ),
+    ],
+    "c": [
+        (r"^(?:[\w*&:<>]+\s+)+\**(\w+)\s*\([^;]*$", "function"),
+        (r"^\s*(?:typedef\s+)?(?:struct|enum|union)\s+(\w+)", "type"),
+        (r"^#\s*define\s+(\w+)", "macro"),
+    ],
+}
+DEFINITION_PATTERNS["typescript"] = DEFINITION_PATTERNS["javascript"] + [
+    (r"^\s*(?:export\s+)?(?:declare\s+)?(?:interface|type|enum)\s+([\w$]+)", "type"),
+]
+DEFINITION_PATTERNS["cpp"] = DEFINITION_PATTERNS["c"] + [
+    (r"^\s*(?:template\s*<[^>]*>\s*)?class\s+(\w+)", "class"),
+]
+DEFINITION_PATTERNS = {
+    language: [(re.compile(pattern), kind) for pattern, kind in patterns]
+    for language, patterns in DEFINITION_PATTERNS.items()
+}
+
+
+def extract_symbols(content: str, language: str) -> List[Dict[str, Any]]:
+    """
+    Extract the definitions of a file, and the names it references.
+
+    Python is parsed, other languages are matched line by line against
+    patterns of their definitions, which finds the common forms much like
+    ctags does. Every identifier is a reference, once per file at the first
+    line it appears on.
+
+    Args:
+        content: Contents of the file
+        language: Language of the file, as the indexer names it
+
+    Returns:
+        List of symbols with name, kind (None for references), line and
+        definition
+    """
+    definitions = _python_definitions(content) if language == "python" else None
+    return extract_line_symbols(content.splitlines(), language, definitions)
+
+
+def extract_line_symbols(
+    lines: Iterable[str],
+    language: str,
+    definitions: Optional[List[tuple]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Extract symbols in one pass over the lines of a file. Definitions are
+    matched by the patterns of the language unless given.
+
+    Args:
+        lines: Lines of the file
+        language: Language of the file
+        definitions: Definitions already found, as (name, kind, line), to
+            use instead of the patterns
+
+    Returns:
+        Same as extract_symbols
+    """
+    symbols = LineSymbols(language, definitions)
+    for line in lines:
+        symbols.add(line)
+    return symbols.symbols()
+
+
+class LineSymbols:
+    """
+    Symbols of a file fed a line at a time, for files streamed from disk
+    while they are chunked. Only the symbols found are kept, never lines.
+    """
+
+    def __init__(self, language: str, definitions: Optional[List[tuple]] = None):
+        self.patterns = (
+            DEFINITION_PATTERNS.get(language, []) if definitions is None else []
+        )
+        self.definitions = list(definitions or [])
+        self.references: List[Dict[str, Any]] = []
+        self._seen = set()
+        self._line_number = 0
+
+    def add(self, line: str) -> None:
+        """Extract the symbols of the next line"""
+        self._line_number += 1
+        for pattern, kind in self.patterns:
+            match = pattern.match(line)
+            if match:
+                self.definitions.append((match.group(1), kind, self._line_number))
+                break
+
+        for match in IDENTIFIER.finditer(line):
+            name = match.group()
+            if len(name) < 3 or name in self._seen or name.lower() in KEYWORDS:
+                continue
+            self._seen.add(name)
+            self.references.append(
+                {
+                    "name": name,
+                    "kind": None,
+                    "line": self._line_number,
+                    "definition": False,
+                }
+            )
+
+    def symbols(self) -> List[Dict[str, Any]]:
+        """The symbols of the lines added so far, as extract_symbols returns them"""
+        return [
+            {"name": name, "kind": kind, "line": line, "definition": True}
+            for name, kind, line in self.definitions
+            if name not in KEYWORDS
+        ] + self.references
+
+
+def _python_definitions(content: str) -> Optional[List[tuple]]:
+    """Definitions of Python source, or None if it doesn't parse"""
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError):
+        return None
+
+    definitions = []
+
+    def visit(node: ast.AST, in_class: bool) -> None:
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, ast.ClassDef):
+                definitions.append((child.name, "class", child.lineno))
+                visit(child, True)
+            elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                kind = "method" if in_class else "function"
+                definitions.append((child.name, kind, child.lineno))
+                visit(child, False)
+
+    visit(tree, False)
+
+    # Module level constants and aliases
+    for node in tree.body:
+        targets = node.targets if isinstance(node, ast.Assign) else []
+        if isinstance(node, ast.AnnAssign):
+            targets = [node.target]
+        for target in targets:
+            if isinstance(target, ast.Name):
+                definitions.append((target.id, "variable", node.lineno))
+
+    return definitions
+
+
+class SymbolIndex:
+    """
+    Definitions and references of every indexed file, for exact lookups of
+    the names questions mention without embedding them, and a repo map
+    outlining each project.
+    """
+
+    def __init__(self, max_map_tokens: int = REPO_MAP_MAX_TOKENS):
+        self.max_map_tokens = max_map_tokens
+        self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def store(
+        self,
+        db: Session,
+        project_id: int,
+        file_id: int,
+        symbols: List[Dict[str, Any]],
+    ) -> None:
+        """
+        Replace the symbols of a file, in the session's transaction.
+
+        Args:
+            db: Database session
+            project_id: ID of the project the file belongs to
+            file_id: ID of the file
+            symbols: Symbols as extract_symbols returns them
+        """
+        db.execute(delete(CodeSymbol).where(CodeSymbol.file_id == file_id))
+        if symbols:
+            db.execute(
+                insert(CodeSymbol),
+                [
+                    {"project_id": project_id, "file_id": file_id, **symbol}
+                    for symbol in symbols
+                ],
+            )
+
+    def mentions(self, query: str) -> List[str]:
+        """
+        Names in a question that look like code, in the order they appear.
+        Dotted names are looked up by their last part.
+
+        Args:
+            query: The question
+
+        Returns:
+            List of names
+        """
+        names = []
+        for match in MENTION.finditer(query):
+            name = next(group for group in match.groups() if group)
+            name = re.split(r"[.:]", name)[-1]
+            if len(name) >= 3 and name.lower() not in KEYWORDS and name not in names:
+                names.append(name)
+        return names
+
+    def lookup(
+        self,
+        db: Session,
+        project_names: List[str],
+        names: List[str],
+    ) -> List[Dict[str, Any]]:
+        """
+        Find where names are defined.
+
+        Args:
+            db: Database session
+            project_names: Names of the projects to look in
+            names: Names of the symbols
+
+        Returns:
+            Definitions with project_name, file_path, language, name, kind
+            and line, in project and file order
+        """
+        rows = db.execute(
+            select(
+                Project.name.label("project_name"),
+                CodeFile.file_path,
+                CodeFile.language,
+                CodeSymbol.file_id,
+                CodeSymbol.name,
+                CodeSymbol.kind,
+                CodeSymbol.line,
+            )
+            .join(CodeFile, CodeSymbol.file_id == CodeFile.id)
+            .join(Project, CodeSymbol.project_id == Project.id)
+            .where(
+                Project.name.in_(project_names),
+                CodeSymbol.name.in_(names),
+                CodeSymbol.definition.is_(True),
+            )
+            .order_by(Project.name, CodeFile.file_path, CodeSymbol.line)
+        ).fetchall()
+
+        order = {name: i for i, name in enumerate(project_names)}
+        return sorted(
+            (dict(row._mapping) for row in rows),
+            key=lambda row: order[row["project_name"]],
+        )
+
+    def resolve(
+        self,
+        db: Session,
+        project_names: List[str],
+        query: str,
+        scope: Optional[SearchScope] = None,
+        overlay: Optional[BufferOverlay] = None,
+        limit: int = 5,
+    ) -> List[int]:
+        """
+        Find the chunks defining the symbols a question mentions.
+
+        Names defined in more than SYMBOL_MAX_DEFINITIONS places are
+        skipped, as are definitions outside the scope and in files replaced
+        by unsaved buffers, which may have moved.
+
+        Args:
+            db: Database session
+            project_names: Names of the projects to look in
+            query: The question
+            scope: Optional files, directories and languages to look in
+            overlay: Optional unsaved buffers
+            limit: Maximum number of chunks
+
+        Returns:
+            IDs of the chunks, in the order the names are mentioned
+        """
+        names = self.mentions(query)
+        if not names:
+            return []
+
+        definitions = self.lookup(db, project_names, names)
+        definitions = self._in_scope(db, definitions, scope, overlay)
+
+        by_name: Dict[str, List[Dict[str, Any]]] = {}
+        for definition in definitions:
+            by_name.setdefault(definition["name"], []).append(definition)
+
+        chunk_ids = []
+        for name in names:
+            found = by_name.get(name, [])
+            if not found:
+                continue
+            if len(found) > SYMBOL_MAX_DEFINITIONS:
+                SYMBOL_LOOKUPS.labels("ambiguous").inc()
+                continue
+
+            SYMBOL_LOOKUPS.labels("found").inc()
+            for definition in found:
+                chunk_id = self._defining_chunk(
+                    db, definition["file_id"], definition["line"]
+                )
+                if chunk_id is not None and chunk_id not in chunk_ids:
+                    chunk_ids.append(chunk_id)
+
+        if chunk_ids:
+            logger.debug(f"Resolved {names} to chunks {chunk_ids[:limit]}")
+        return chunk_ids[:limit]
+
+    def _in_scope(
+        self,
+        db: Session,
+        definitions: List[Dict[str, Any]],
+        scope: Optional[SearchScope],
+        overlay: Optional[BufferOverlay],
+    ) -> List[Dict[str, Any]]:
+        """Definitions in the scope and not in files of unsaved buffers"""
+        if not definitions or not (scope or overlay):
+            return definitions
+
+        paths = dict(
+            db.execute(
+                select(Project.name, Project.path).where(
+                    Project.name.in_({row["project_name"] for row in definitions})
+                )
+            ).all()
+        )
+
+        kept = []
+        for project_name, path in paths.items():
+            rows = [row for row in definitions if row["project_name"] == project_name]
+            project_scope = (scope or SearchScope()).for_project(path)
+            if project_scope is None:
+                continue
+            if overlay is not None:
+                project_scope = project_scope.excluding(overlay.shadowed(project_name))
+
+            mask = project_scope.mask(
+                np.array([row["file_path"] for row in rows], dtype=str),
+                np.array([row["language"] for row in rows], dtype=str),
+            )
+            kept.extend(row for row, keep in zip(rows, mask) if keep)
+
+        kept_ids = {id(row) for row in kept}
+        return [row for row in definitions if id(row) in kept_ids]
+
+    def _defining_chunk(self, db: Session, file_id: int, line: int) -> Optional[int]:
+        """The chunk of a file that starts closest above a line"""
+        return db.execute(
+            select(CodeChunk.id)
+            .where(
+                CodeChunk.file_id == file_id,
+                CodeChunk.start_line <= line,
+                CodeChunk.end_line >= line,
+            )
+            .order_by(CodeChunk.start_line.desc())
+            .limit(1)
+        ).scalar()
+
+    def build_repo_map(self, db: Session, project_id: int) -> str:
+        """
+        Outline the definitions of a project, file by file. Files whose
+        definitions other files reference most come first, and the outline
+        stops at the token budget.
+
+        Args:
+            db: Database session
+            project_id: ID of the project
+
+        Returns:
+            The repo map
+        """
+        # Files referencing each name
+        references = dict(
+            db.execute(
+                select(CodeSymbol.name, func.count(CodeSymbol.file_id.distinct()))
+                .where(
+                    CodeSymbol.project_id == project_id,
+                    CodeSymbol.definition.is_(False),
+                )
+                .group_by(CodeSymbol.name)
+            ).all()
+        )
+
+        rows = db.execute(
+            select(CodeFile.file_path, CodeSymbol.name, CodeSymbol.kind)
+            .join(CodeFile, CodeSymbol.file_id == CodeFile.id)
+            .where(
+                CodeSymbol.project_id == project_id,
+                CodeSymbol.definition.is_(True),
+            )
+            .order_by(CodeFile.file_path, CodeSymbol.line)
+        ).fetchall()
+
+        files: Dict[str, List[str]] = {}
+        scores: Dict[str, int] = {}
+        for row in rows:
+            files.setdefault(row.file_path, []).append(f"  {row.kind} {row.name}")
+            # The defining file itself usually references the name too
+            scores[row.file_path] = scores.get(row.file_path, 0) + max(
+                references.get(row.name, 0) - 1, 0
+            )
+
+        lines = []
+        tokens = 0
+        for file_path in sorted(files, key=lambda path: (-scores[path], path)):
+            for line in [f"{file_path}:"] + files[file_path]:
+                line_tokens = len(self.encoding.encode(line)) + 1
+                if tokens + line_tokens > self.max_map_tokens:
+                    return "\n".join(lines)
+                lines.append(line)
+                tokens += line_tokens
+
+        return "\n".join(lines)
@@ -1,152 +1,668 @@
+import numpy as np
 from loguru import logger
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Callable, Iterable, Optional, Tuple, Union
 from sqlalchemy.orm import Session
-from sqlalchemy import select, func
+from sqlalchemy import case, select, update
 
-from src.database.pgvector import Project, CodeFile, CodeChunk
-from src.agent.llm import LLMService
+from src.consts.vectors import (
+    EMBEDDING_MAX_ATTEMPTS,
+    EMBEDDING_RETRY_BATCH_SIZE,
+    HNSW_EF_SEARCH,
+)
+from src.database.backends import StorageBackend, backend
+from src.database.pgvector import EmbeddingVersion, Project, CodeFile, CodeChunk
+from src.agent.llm import EmbeddingSpace, LLMService
+from src.agent.scheduler import Priority
+from src.vectors.memory_index import MemoryIndex
+from src.vectors.migration import project_embedding_space
+from src.vectors.overlay import BufferOverlay
+from src.vectors.scope import SearchScope
+from src.telemetry.metrics import (
+    INDEX_CHUNKS_STORED,
+    INDEX_DB_WRITE_SECONDS,
+    INDEX_EMBEDDING_FAILURES,
+    INDEX_EMBEDDING_RETRIES,
+    INDEX_TOKENS_EMBEDDED,
+    MEMORY_INDEX_SEARCHES,
+    QUERY_EMBEDDING_SECONDS,
+    VECTOR_SEARCH_SECONDS,
+)
+from src.telemetry.tracing import span
 
 
 class VectorStore:
-    def __init__(self):
-        self.llm_service = LLMService()
+    def __init__(
+        self,
+        llm_service: Optional[LLMService] = None,
+        memory_index: Optional[MemoryIndex] = None,
+        storage_backend: StorageBackend = backend,
+    ):
+        # Share the caller's service so all embeddings in a process go
+        # through the same scheduler
+        self.llm_service = llm_service or LLMService()
+        self.memory_index = memory_index
+        self.backend = storage_backend
+
+        # Embedding spaces by version ID, which never change
+        self._spaces: Dict[int, EmbeddingSpace] = {}
 
     def store_code_chunks(
         self,
         db: Session,
-        project_name: str,
+        project_id: int,
+        file_id: int,
         file_path: str,
-        language: str,
         chunks: List[Dict[str, Any]],
+        file_size: int = 0,
+        skip_reason: Optional[str] = None,
     ) -> None:
         """
-        Store code chunks with their embeddings in the database.
+        Store code chunks with their embeddings in the database, and adjust
+        the file and project counters in the same transaction.
 
         Args:
             db: Database session
-            project_name: Name of the project
+            project_id: ID of the project the file belongs to
+            file_id: ID of the file the chunks belong to
             file_path: Path to the file relative to project root
-            language: Programming language of the file
-            chunks: List of code chunks with start_line, end_line, and content
+            chunks: List of code chunks with start_line, end_line, content
+                and token_count
+            file_size: Size of the file in bytes
+            skip_reason: Why the file was left unindexed, with no chunks
+        """
+        self.store_chunk_batches(
+            db,
+            project_id,
+            file_id,
+            file_path,
+            [chunks] if chunks else [],
+            file_size,
+            skip_reason=skip_reason,
+        )
+
+    def store_chunk_batches(
+        self,
+        db: Session,
+        project_id: int,
+        file_id: int,
+        file_path: str,
+        batches: Iterable[List[Dict[str, Any]]],
+        file_size: int = 0,
+        skip_reason: Optional[str] = None,
+    ) -> int:
+        """
+        Store the chunks of a file batch by batch, embedding each batch as
+        it comes, so only one batch of a large file is held at a time. The
+        file's chunks, counters and the project counters are committed in a
+        single transaction once the last batch is written.
+
+        Args:
+            db: Database session
+            project_id: ID of the project the file belongs to
+            file_id: ID of the file the chunks belong to
+            file_path: Path to the file relative to project root
+            batches: Batches of code chunks, as store_code_chunks takes them
+            file_size: Size of the file in bytes
+            skip_reason: Why the file was left unindexed, with no chunks
+
+        Returns:
+            Number of chunks stored
         """
         try:
-            # Get or create project
-            project = db.query(Project).filter(Project.name == project_name).first()
-            if not project:
-                logger.error(f"Project {project_name} not found")
-                return
+            with span("vector_store.store_code_chunks", file_path=file_path):
+                chunk_count = 0
+                token_count = 0
+                embedded = False
+                previous = None
 
-            # Get or create file
-            code_file = (
-                db.query(CodeFile)
-                .filter(
-                    CodeFile.project_id == project.id, CodeFile.file_path == file_path
-                )
-                .first()
-            )
+                # Embed with the project's embedding version. If the provider
+                # fails the chunks are stored without embeddings, pending
+                # retry_embeddings.
+                project = db.execute(
+                    select(
+                        Project.embedding_model,
+                        Project.embedding_dim,
+                        Project.embedding_version_id,
+                    ).where(Project.id == project_id)
+                ).one()
 
-            if not code_file:
-                logger.error(f"File {file_path} not found for project {project_name}")
-                return
-
-            # Delete existing chunks for this file
-            db.query(CodeChunk).filter(CodeChunk.file_id == code_file.id).delete()
-
-            # Create embeddings for all chunks in a batch
-            chunk_contents = [chunk["content"] for chunk in chunks]
-            embeddings = self.llm_service.generate_embeddings(chunk_contents)
-
-            # Store chunks with embeddings
-            for i, chunk in enumerate(chunks):
-                code_chunk = CodeChunk(
-                    project_id=project.id,
-                    file_id=code_file.id,
-                    start_line=chunk["start_line"],
-                    end_line=chunk["end_line"],
-                    content=chunk["content"],
-                    embedding=embeddings[i],
-                )
-                db.add(code_chunk)
+                for chunks in batches:
+                    batch_tokens = sum(chunk.get("token_count", 0) for chunk in chunks)
+                    chunk_count += len(chunks)
+                    token_count += batch_tokens
 
-            db.commit()
-            logger.info(f"Stored {len(chunks)} chunks for {file_path}")
+                    # The first batch is embedded before taking any row locks
+                    chunk_contents = [chunk["content"] for chunk in chunks]
+                    try:
+                        embeddings = self.llm_service.generate_embeddings(
+                            chunk_contents, space=project_embedding_space(project)
+                        )
+                        INDEX_TOKENS_EMBEDDED.inc(batch_tokens)
+                        embedded = True
+                    except Exception as e:
+                        logger.warning(
+                            f"Storing {len(chunks)} chunks of {file_path} without "
+                            f"embeddings, they will be retried: {str(e)}"
+                        )
+                        embeddings = None
+                        INDEX_EMBEDDING_FAILURES.inc(len(chunks))
+
+                    with span("vector_store.write_chunks", INDEX_DB_WRITE_SECONDS):
+                        if previous is None:
+                            previous = self._replace_file_chunks(db, file_id)
+                        self.backend.write_chunks(
+                            db,
+                            project_id,
+                            file_id,
+                            chunks,
+                            embeddings,
+                            project.embedding_version_id,
+                        )
+
+                with span("vector_store.write_chunks", INDEX_DB_WRITE_SECONDS):
+                    if previous is None:
+                        previous = self._replace_file_chunks(db, file_id)
+
+                    # Update per-file and per-project counters with the difference
+                    db.execute(
+                        update(CodeFile)
+                        .where(CodeFile.id == file_id)
+                        .values(
+                            chunk_count=chunk_count,
+                            byte_count=file_size,
+                            token_count=token_count,
+                            skip_reason=skip_reason,
+                        )
+                    )
+                    version_id = db.execute(
+                        update(Project)
+                        .where(Project.id == project_id)
+                        .values(
+                            file_count=Project.file_count
+                            + (1 if previous.byte_count is None else 0),
+                            chunk_count=Project.chunk_count
+                            + chunk_count
+                            - (previous.chunk_count or 0),
+                            byte_count=Project.byte_count
+                            + file_size
+                            - (previous.byte_count or 0),
+                            token_count=Project.token_count
+                            + token_count
+                            - (previous.token_count or 0),
+                        )
+                        .returning(Project.embedding_version_id)
+                    ).scalar_one()
+
+                    # The project switched to a new embedding version since
+                    # the chunks were embedded: embed them again with it
+                    if embedded and version_id != project.embedding_version_id:
+                        db.execute(
+                            update(CodeChunk)
+                            .where(CodeChunk.file_id == file_id)
+                            .values(
+                                embedding=None,
+                                embedding_version_id=None,
+                                embedding_state="pending",
+                            )
+                        )
+                    self.backend.chunks_changed(db, project_id)
+
+                    db.commit()
+
+            INDEX_CHUNKS_STORED.inc(chunk_count)
+            logger.info(f"Stored {chunk_count} chunks for {file_path}")
+            return chunk_count
 
         except Exception as e:
             db.rollback()
             logger.error(f"Failed to store code chunks: {str(e)}")
             raise
 
+    def _replace_file_chunks(self, db: Session, file_id: int) -> Any:
+        """
+        Lock a file row and delete its chunks, ahead of writing new ones.
+
+        Args:
+            db: Database session
+            file_id: ID of the file
+
+        Returns:
+            Row of what the file contributed to its project's counters
+        """
+        # Lock the file row and read what it contributed previously
+        previous = db.execute(
+            select(
+                CodeFile.chunk_count,
+                CodeFile.byte_count,
+                CodeFile.token_count,
+            )
+            .where(CodeFile.id == file_id)
+            .with_for_update()
+        ).one()
+
+        # Delete existing chunks for this file
+        db.query(CodeChunk).filter(CodeChunk.file_id == file_id).delete(
+            synchronize_session=False
+        )
+        return previous
+
+    def retry_embeddings(
+        self,
+        db: Session,
+        project_id: int,
+        should_stop: Optional[Callable[[], bool]] = None,
+        batch_size: int = EMBEDDING_RETRY_BATCH_SIZE,
+    ) -> int:
+        """
+        Embed the chunks of a project that were stored without embeddings.
+
+        Chunks are retried in batches, fewest attempts first, until none are
+        pending or the provider fails again. Each failed attempt is counted,
+        and chunks reaching EMBEDDING_MAX_ATTEMPTS are marked failed.
+
+        Args:
+            db: Database session
+            project_id: ID of the project
+            should_stop: Optional callback checked before each batch
+            batch_size: Chunks per provider request
+
+        Returns:
+            Number of chunks embedded
+        """
+        embedded = 0
+
+        while not (should_stop and should_stop()):
+            pending = db.execute(
+                select(CodeChunk.id, CodeChunk.content)
+                .where(
+                    CodeChunk.project_id == project_id,
+                    CodeChunk.embedding_state == "pending",
+                )
+                .order_by(CodeChunk.embedding_attempts, CodeChunk.id)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            ).fetchall()
+            if not pending:
+                break
+
+            # Read once the chunks are locked, which a switch to a new
+            # embedding version waits for
+            project = db.execute(
+                select(
+                    Project.embedding_model,
+                    Project.embedding_dim,
+                    Project.embedding_version_id,
+                ).where(Project.id == project_id)
+            ).one()
+
+            ids = [row.id for row in pending]
+            try:
+                embeddings = self.llm_service.generate_embeddings(
+                    [row.content for row in pending],
+                    space=project_embedding_space(project),
+                )
+            except Exception as e:
+                logger.warning(f"Retrying {len(ids)} chunk embeddings failed: {e}")
+                db.execute(
+                    update(CodeChunk)
+                    .where(CodeChunk.id.in_(ids))
+                    .values(
+                        embedding_attempts=CodeChunk.embedding_attempts + 1,
+                        embedding_state=case(
+                            (
+                                CodeChunk.embedding_attempts + 1
+                                >= EMBEDDING_MAX_ATTEMPTS,
+                                "failed",
+                            ),
+                            else_="pending",
+                        ),
+                    )
+                )
+                db.commit()
+                INDEX_EMBEDDING_FAILURES.inc(len(ids))
+                break
+
+            db.execute(
+                update(CodeChunk),
+                [
+                    {
+                        "id": chunk_id,
+                        "embedding": embedding,
+                        "embedding_state": "embedded",
+                        "embedding_version_id": project.embedding_version_id,
+                    }
+                    for chunk_id, embedding in zip(ids, embeddings)
+                ],
+            )
+            self.backend.chunks_changed(db, project_id)
+            db.commit()
+
+            embedded += len(ids)
+            INDEX_EMBEDDING_RETRIES.inc(len(ids))
+
+        if embedded:
+            logger.info(f"Embedded {embedded} previously failed chunks")
+        return embedded
+
     def query_vectors(
-        self, db: Session, project_name: str, query: str, limit: int = 5
+        self,
+        db: Session,
+        project_name: Union[str, List[str]],
+        query: str,
+        limit: int = 5,
+        scope: Optional[SearchScope] = None,
+        overlay: Optional[BufferOverlay] = None,
     ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
         """
         Query the vector store for relevant code chunks based on the query.
 
         Args:
             db: Database session
-            project_name: Name of the project
+            project_name: Name of the project, or names of several projects
+                to search together
             query: Query string
             limit: Maximum number of results to return
+            scope: Optional files, directories and languages to search in
+            overlay: Optional unsaved buffers to search instead of the
+                stored chunks of their files
 
         Returns:
             Tuple containing:
-              - List of relevant code chunks with file_path, language, and content
-              - List of relevant files with file_path and relevance score
+              - List of relevant code chunks with project_name, file_path,
+                language, and content
+              - List of relevant files with project_name and file_path
         """
         try:
-            # Generate query embedding
-            query_embedding = self.llm_service.generate_embeddings([query])[0]
+            with span("vector_store.query_vectors", project_name=project_name):
+                primary = (
+                    project_name if isinstance(project_name, str) else project_name[0]
+                )
+                space, version_id = self.query_space(db, primary)
+                query_embedding = self.embed_query(query, space)
+                return self.search_vectors(
+                    db,
+                    project_name,
+                    query_embedding,
+                    limit,
+                    scope=scope,
+                    overlay=overlay,
+                    embedding_version_id=version_id,
+                )
 
-            # Get project
+        except Exception as e:
+            logger.error(f"Failed to query vectors: {str(e)}")
+            raise
+
+    def embed_query(
+        self, query: str, space: Optional[EmbeddingSpace] = None
+    ) -> np.ndarray:
+        """
+        Embed a query ahead of interactive work.
+
+        Args:
+            query: Query string
+            space: Embedding model and dimensions of the chunks to search,
+                see query_space; the configured ones by default
+
+        Returns:
+            The query's embedding
+        """
+        with span("vector_store.embed_query", QUERY_EMBEDDING_SECONDS):
+            return self.llm_service.generate_embeddings(
+                [query], priority=Priority.INTERACTIVE, space=space
+            )[0]
+
+    def query_space(
+        self, db: Session, project_name: str
+    ) -> Tuple[Optional[EmbeddingSpace], Optional[int]]:
+        """
+        The embedding space queries about a project are embedded in: that of
+        the version its chunks are embedded with, which isn't the configured
+        one while the project is being migrated to it.
+
+        Args:
+            db: Database session
+            project_name: Name of the project
+
+        Returns:
+            Tuple of the embedding space and the ID of its version, both
+            None for unknown projects. Projects indexed before versions were
+            recorded have a space but no version.
+        """
+        index = self.memory_index.get(project_name) if self.memory_index else None
+        if index is not None and index.embedding_version_id is not None:
+            version_id = index.embedding_version_id
+        else:
+            project = db.execute(
+                select(
+                    Project.embedding_model,
+                    Project.embedding_dim,
+                    Project.embedding_version_id,
+                ).where(Project.name == project_name)
+            ).first()
+            if project is None or project.embedding_version_id is None:
+                return project_embedding_space(project), None
+            version_id = project.embedding_version_id
+
+        if version_id not in self._spaces:
+            version = db.get(EmbeddingVersion, version_id)
+            self._spaces[version_id] = EmbeddingSpace(version.model, version.dims)
+        return self._spaces[version_id], version_id
+
+    def get_chunks(
+        self, db: Session, chunk_ids: List[int]
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Fetch chunks by ID, e.g. to reuse the results of an earlier search.
+        Chunks deleted since, by reindexing their file, are left out.
+
+        Args:
+            db: Database session
+            chunk_ids: IDs of the chunks, in the order to return them
+
+        Returns:
+            Same as query_vectors
+        """
+        rows = db.execute(
+            select(
+                CodeChunk.id,
+                CodeChunk.content,
+                CodeChunk.start_line,
+                CodeChunk.end_line,
+                CodeFile.file_path,
+                CodeFile.language,
+                Project.name,
+            )
+            .join(CodeFile, CodeChunk.file_id == CodeFile.id)
+            .join(Project, CodeChunk.project_id == Project.id)
+            .where(CodeChunk.id.in_(chunk_ids))
+        ).fetchall()
+
+        by_id = {row.id: row for row in rows}
+        return self._format_results(
+            [
+                (by_id[chunk_id].name, by_id[chunk_id])
+                for chunk_id in chunk_ids
+                if chunk_id in by_id
+            ]
+        )
+
+    def search_vectors(
+        self,
+        db: Session,
+        project_name: Union[str, List[str]],
+        query_embedding: np.ndarray,
+        limit: int = 5,
+        ef_search: Optional[int] = HNSW_EF_SEARCH,
+        scope: Optional[SearchScope] = None,
+        overlay: Optional[BufferOverlay] = None,
+        embedding_version_id: Optional[int] = None,
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Find the code chunks nearest to an embedding. Several projects are
+        searched one by one and their chunks ranked together by distance,
+        which assumes they were embedded with the same model.
+
+        Args:
+            db: Database session
+            project_name: Name of the project, or names of several projects
+            query_embedding: Embedding to search for
+            limit: Maximum number of results to return
+            ef_search: HNSW candidate list size for this search, None keeps
+                the session's setting
+            scope: Optional files, directories and languages to search in
+            overlay: Optional unsaved buffers to search instead of the
+                stored chunks of their files
+            embedding_version_id: Embedding version the embedding is of, see
+                query_space. Only chunks of that version are searched, and
+                projects embedded with another one are skipped.
+
+        Returns:
+            Same as query_vectors
+        """
+        project_names = (
+            [project_name] if isinstance(project_name, str) else project_name
+        )
+
+        results = []
+        for name in project_names:
+            rows = self._search_project(
+                db,
+                name,
+                query_embedding,
+                limit,
+                ef_search,
+                scope,
+                overlay,
+                embedding_version_id,
+            )
+            results.extend((name, row) for row in rows)
+
+        results.sort(key=lambda result: result[1].distance)
+        return self._format_results(results[:limit])
+
+    def _search_project(
+        self,
+        db: Session,
+        project_name: str,
+        query_embedding: np.ndarray,
+        limit: int,
+        ef_search: Optional[int],
+        scope: Optional[SearchScope],
+        overlay: Optional[BufferOverlay] = None,
+        embedding_version_id: Optional[int] = None,
+    ) -> List[Any]:
+        """
+        Find the chunks of one project nearest to an embedding, in memory when
+        the project is loaded in the memory index and current, otherwise with
+        the storage backend. Chunks of unsaved buffers replace the stored
+        chunks of their files.
+
+        Args:
+            db: Database session
+            project_name: Name of the project
+            query_embedding: Embedding to search for
+            limit: Maximum number of results to return
+            ef_search: HNSW candidate list size for this search
+            scope: Optional files, directories and languages to search in
+            overlay: Optional unsaved buffers
+            embedding_version_id: Embedding version to search, if pinned
+
+        Returns:
+            Result rows with their distance, nearest first
+        """
+        index = self.memory_index.get(project_name) if self.memory_index else None
+        if index is not None and embedding_version_id not in (
+            None,
+            index.embedding_version_id,
+        ):
+            index = None
+
+        if index is None:
             project = db.query(Project).filter(Project.name == project_name).first()
             if not project:
                 logger.error(f"Project {project_name} not found")
-                return [], []
+                return []
+            if embedding_version_id not in (None, project.embedding_version_id):
+                logger.warning(
+                    f"Project {project_name} is embedded with another model "
+                    "than the query, not searching it"
+                )
+                return []
 
-            # Query for most similar chunks
-            stmt = (
-                select(
-                    CodeChunk.id,
-                    CodeChunk.content,
-                    CodeChunk.start_line,
-                    CodeChunk.end_line,
-                    CodeFile.file_path,
-                    CodeFile.language,
+        if scope:
+            scope = scope.for_project(index.path if index else project.path)
+            if scope is None:
+                return []
+
+        buffers = []
+        shadowed = overlay.shadowed(project_name) if overlay else []
+        if shadowed:
+            buffers = overlay.search(project_name, query_embedding, limit, scope)
+            scope = (scope or SearchScope()).excluding(shadowed)
+
+        if index is not None:
+            query_embedding = self._fit_dims(query_embedding, index.dims)
+            with span("vector_store.search", VECTOR_SEARCH_SECONDS, tier="memory"):
+                results = index.search(
+                    query_embedding, limit, self.memory_index.metric, scope
                 )
-                .join(CodeFile, CodeChunk.file_id == CodeFile.id)
-                .where(CodeChunk.project_id == project.id)
-                .order_by(CodeChunk.embedding.l2_distance(query_embedding))
-                .limit(limit)
+            MEMORY_INDEX_SEARCHES.labels("memory").inc()
+            return results + buffers
+
+        # Query for most similar chunks
+        query_embedding = self._fit_dims(query_embedding, project.embedding_dim)
+        with span("vector_store.search", VECTOR_SEARCH_SECONDS):
+            results = self.backend.search(
+                db, project, query_embedding, limit, ef_search, scope
             )
 
-            results = db.execute(stmt).fetchall()
+        MEMORY_INDEX_SEARCHES.labels(self.backend.name).inc()
+        return list(results) + buffers
 
-            # Format results
-            chunks = []
-            files = {}
+    def _format_results(
+        self, results: List[Tuple[str, Any]]
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Format search results, nearest first, as query_vectors returns them.
 
-            for row in results:
-                chunks.append(
-                    {
-                        "content": row.content,
-                        "file_path": row.file_path,
-                        "language": row.language,
-                        "start_line": row.start_line,
-                        "end_line": row.end_line,
-                    }
-                )
+        Args:
+            results: Tuples of project name and result row
 
-                # Track unique files and their best relevance score
-                file_path = row.file_path
+        Returns:
+            Same as query_vectors
+        """
+        chunks = []
+        files = {}
 
-                if file_path not in files:
-                    files[file_path] = {"file_path": file_path}
+        for project_name, row in results:
+            chunks.append(
+                {
+                    "id": row.id,
+                    "project_name": project_name,
+                    "content": row.content,
+                    "file_path": row.file_path,
+                    "language": row.language,
+                    "start_line": row.start_line,
+                    "end_line": row.end_line,
+                }
+            )
 
-            # Convert files dictionary to list and sort by relevance
-            file_list = list(files.values())
+            # Track unique files in order of their nearest chunk
+            key = (project_name, row.file_path)
 
-            return chunks, file_list
+            if key not in files:
+                files[key] = {"project_name": project_name, "file_path": row.file_path}
 
-        except Exception as e:
-            logger.error(f"Failed to query vectors: {str(e)}")
-            raise
+        return chunks, list(files.values())
+
+    def _fit_dims(self, query_embedding: np.ndarray, dims: Optional[int]) -> np.ndarray:
+        """
+        Match a query embedding to a project's stored dimensions. Projects
+        indexed before dimensions were configurable hold zero-padded vectors,
+        which a zero-padded query matches exactly.
+        """
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        if not dims or len(query_embedding) >= dims:
+            return query_embedding[:dims]
+        return np.pad(query_embedding, (0, dims - len(query_embedding)))
@@ -0,0 +1,287 @@
+import os
+import re
+import fnmatch
+from loguru import logger
+from typing import List, Iterator, Optional, Tuple
+
+from src.telemetry.metrics import INDEX_FILES_SKIPPED, INDEX_FILES_WALKED
+
+# Skip what .gitignore and .ignore files (and .git/info/exclude) ignore
+INDEX_USE_IGNORE_FILES = os.getenv("INDEX_USE_IGNORE_FILES", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# Ignore files read in every directory, later ones taking precedence
+IGNORE_FILES = (".gitignore", ".ignore")
+
+
+def translate_pattern(pattern: str) -> str:
+    """
+    Translate a gitignore pattern into a regular expression over paths
+    relative to the directory of its ignore file.
+
+    Args:
+        pattern: The pattern, without negation or trailing slash
+
+    Returns:
+        The regular expression, to match whole paths with
+    """
+    # Patterns with a slash other than a trailing one are relative to the
+    # ignore file, others match at any depth
+    anchored = "/" in pattern
+    if pattern.startswith("/"):
+        pattern = pattern[1:]
+
+    regex = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        if pattern.startswith("**/", i):
+            regex.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == n:
+            regex.append("/.*")
+            i += 3
+        elif pattern.startswith("**", i):
+            regex.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            regex.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            regex.append("[^/]")
+            i += 1
+        elif pattern[i] == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                regex.append(re.escape("["))
+                i += 1
+                continue
+            members = pattern[i + 1 : end].replace("\\", "\\\\")
+            if members[0] in "!^":
+                members = "^" + members[1:]
+            regex.append(f"[{members}]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < n:
+            regex.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            regex.append(re.escape(pattern[i]))
+            i += 1
+
+    prefix = "" if anchored else "(?:.*/)?"
+    return prefix + "".join(regex)
+
+
+class IgnoreRules:
+    """
+    The patterns of one ignore file, with gitignore semantics: the last
+    matching pattern decides, "!" re-includes, a trailing "/" matches only
+    directories, and patterns containing "/" are relative to the file's
+    directory.
+    """
+
+    def __init__(self, base: str, lines: List[str]):
+        """
+        Args:
+            base: Directory of the ignore file, relative to the project root
+                ("" for the root)
+            lines: Lines of the ignore file
+        """
+        self.base = base
+        self.rules = []
+
+        for line in lines:
+            line = line.rstrip("\n")
+            # Trailing spaces are ignored unless escaped
+            if not line.endswith("\\ "):
+                line = line.rstrip(" ")
+            if not line or line.startswith("#"):
+                continue
+
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            elif line.startswith("\\"):
+                # Escaped leading "!" or "#"
+                line = line[1:]
+
+            directory_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+
+            self.rules.append(
+                (re.compile(translate_pattern(line)), negate, directory_only)
+            )
+
+        # Without negations, a single combined expression per kind of entry
+        # answers any path
+        self.combined = None
+        if not any(negate for _, negate, _ in self.rules):
+            self.combined = (
+                self._combine([rule for rule, _, _ in self.rules]),
+                self._combine([rule for rule, _, only in self.rules if not only]),
+            )
+
+    @classmethod
+    def load(cls, base: str, path: str) -> Optional["IgnoreRules"]:
+        """The rules of an ignore file, or None if it is missing or empty"""
+        try:
+            with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                rules = cls(base, f.readlines())
+        except OSError:
+            return None
+        return rules if rules.rules else None
+
+    def _combine(self, rules: List[re.Pattern]) -> Optional[re.Pattern]:
+        if not rules:
+            return None
+        return re.compile("|".join(f"(?:{rule.pattern})" for rule in rules))
+
+    def match(self, rel_path: str, is_dir: bool) -> Optional[bool]:
+        """
+        Whether the rules ignore a path.
+
+        Args:
+            rel_path: Path relative to the project root, with "/" separators
+            is_dir: Whether the path is a directory
+
+        Returns:
+            True if ignored, False if re-included, None if no rule matches
+        """
+        if self.base:
+            rel_path = rel_path[len(self.base) + 1 :]
+
+        if self.combined is not None:
+            combined = self.combined[0 if is_dir else 1]
+            return True if combined and combined.fullmatch(rel_path) else None
+
+        for rule, negate, directory_only in reversed(self.rules):
+            if directory_only and not is_dir:
+                continue
+            if rule.fullmatch(rel_path):
+                return not negate
+        return None
+
+
+def is_ignored(rules: List[IgnoreRules], rel_path: str, is_dir: bool) -> bool:
+    """Whether the ignore files of a path's directories ignore it, the
+    deepest deciding"""
+    for ignore_rules in reversed(rules):
+        ignored = ignore_rules.match(rel_path, is_dir)
+        if ignored is not None:
+            return ignored
+    return False
+
+
+def walk_files(
+    project_path: str,
+    file_extensions: List[str],
+    exclude_patterns: List[str],
+    use_ignore_files: bool = INDEX_USE_IGNORE_FILES,
+) -> Iterator[Tuple[str, os.stat_result]]:
+    """
+    Walk a project and yield the files that should be indexed, with their
+    stat results so they don't have to be stat'ed again.
+
+    Directories excluded by name or ignored are never entered. Symbolic
+    links to directories aren't followed.
+
+    Args:
+        project_path: Path to the project root
+        file_extensions: Extensions of the files to include
+        exclude_patterns: Patterns of file and directory names to exclude
+        use_ignore_files: Whether to skip what ignore files ignore
+
+    Returns:
+        Iterator of absolute file paths and their stat results
+    """
+    excluded = (
+        re.compile("|".join(fnmatch.translate(pattern) for pattern in exclude_patterns))
+        if exclude_patterns
+        else None
+    )
+
+    # Most extensions are a single suffix looked up in a set, others like
+    # ".d.ts" are checked in full
+    extensions = frozenset(file_extensions)
+    compound = tuple(
+        ext
+        for ext in file_extensions
+        if not (ext.startswith(".") and ext.count(".") == 1)
+    )
+
+    root_rules = []
+    if use_ignore_files:
+        exclude = IgnoreRules.load(
+            "", os.path.join(project_path, ".git", "info", "exclude")
+        )
+        if exclude is not None:
+            root_rules.append(exclude)
+
+    # Depth first, with the ignore rules of each directory's ancestors
+    stack = [(project_path, "", root_rules)]
+    while stack:
+        directory, rel_dir, rules = stack.pop()
+
+        if use_ignore_files:
+            rules = list(rules)
+            for name in IGNORE_FILES:
+                ignore_rules = IgnoreRules.load(rel_dir, os.path.join(directory, name))
+                if ignore_rules is not None:
+                    rules.append(ignore_rules)
+
+        try:
+            entries = list(os.scandir(directory))
+        except OSError as e:
+            logger.warning(f"Skipping unreadable directory {directory}: {str(e)}")
+            continue
+
+        subdirectories = []
+        walked = 0
+        for entry in entries:
+            name = entry.name
+            rel_path = f"{rel_dir}/{name}" if rel_dir else name
+
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if excluded and excluded.match(name):
+                        continue
+                    if rules and is_ignored(rules, rel_path, True):
+                        continue
+                    subdirectories.append((entry.path, rel_path, rules))
+                    continue
+
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+
+            walked += 1
+            _, ext = os.path.splitext(name)
+            if ext not in extensions and not (compound and name.endswith(compound)):
+                INDEX_FILES_SKIPPED.labels("excluded").inc()
+                continue
+
+            if excluded and excluded.match(name):
+                INDEX_FILES_SKIPPED.labels("excluded").inc()
+                continue
+
+            if rules and is_ignored(rules, rel_path, False):
+                INDEX_FILES_SKIPPED.labels("ignored").inc()
+                continue
+
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            yield entry.path, stat
+
+        INDEX_FILES_WALKED.inc(walked)
+
+        # Popped in name order
+        subdirectories.sort(key=lambda subdirectory: subdirectory[0], reverse=True)
+        stack.extend(subdirectories)
@@ -0,0 +1,112 @@
+import numpy as np
+from unittest.mock import MagicMock
+
+from src.agent.sessions import ChatSessions
+from src.consts.vectors import VECTOR_DIMS
+from src.database.pgvector import ChatMessage, ChatSession
+from src.vectors.scope import SearchScope
+from src.vectors.vector_store import VectorStore
+
+
+# One chunk per axis of the first three dimensions
+EMBEDDINGS = np.eye(3, VECTOR_DIMS, dtype=np.float32)
+FILES = {"src/main.py": "x = 1\nx = 2\nx = 3"}
+
+
+def test_retrieve_reuses_context(test_db, make_project):
+    """
+    Test that follow-ups on the same topic reuse the session's context,
+    and that a new topic or scope searches again.
+    """
+    make_project(FILES, embed=lambda contents: EMBEDDINGS)
+    embeddings = EMBEDDINGS
+    llm_service = MagicMock()
+    sessions = ChatSessions(VectorStore(llm_service))
+    session = sessions.create(test_db, "test-project")
+
+    def retrieve(embedding, languages=None):
+        llm_service.generate_embeddings.return_value = embedding[None, :]
+        scope = SearchScope(languages=languages)
+        chunks, _ = sessions.retrieve(
+            test_db, session, "question", ["test-project"], scope, limit=1
+        )
+        sessions.add_turn(test_db, session, "question", "answer")
+        return [chunk["content"] for chunk in chunks]
+
+    assert retrieve(embeddings[0]) == ["x = 1"]
+
+    # Close enough to the first question: no search, same context
+    nearby = embeddings[0] + 0.2 * embeddings[1]
+    assert retrieve(nearby) == ["x = 1"]
+    assert llm_service.generate_embeddings.call_args[0][0] == ["question\nquestion"]
+
+    # Another topic
+    assert retrieve(embeddings[1]) == ["x = 2"]
+
+    # Same topic but a different scope
+    assert retrieve(embeddings[1], ["lua"]) == []
+
+
+def test_compact(test_db, make_project):
+    """
+    Test that history over the token budget is folded into the summary,
+    keeping the last question and answer verbatim.
+    """
+    make_project(FILES)
+    llm_service = MagicMock()
+    llm_service.summarize_conversation.return_value = "they talked"
+    sessions = ChatSessions(VectorStore(llm_service), token_budget=20)
+    session = sessions.create(test_db, "test-project")
+
+    assert not sessions.add_turn(test_db, session, "first question", "short")
+    assert sessions.add_turn(
+        test_db, session, "second question", "a much longer answer " * 4
+    )
+
+    assert sessions.compact(test_db, session.id)
+    (summary, compacted), _ = llm_service.summarize_conversation.call_args
+    assert summary is None
+    assert compacted == [
+        {"role": "user", "content": "first question"},
+        {"role": "assistant", "content": "short"},
+    ]
+
+    test_db.expire_all()
+    session = sessions.get(test_db, session.id)
+    assert session.summary == "they talked"
+    assert [message["content"] for message in sessions.history(test_db, session)] == [
+        "second question",
+        "a much longer answer " * 4,
+    ]
+    assert test_db.query(ChatMessage).count() == 4
+
+    # The last exchange is never compacted
+    assert not sessions.compact(test_db, session.id)
+
+
+def test_compact_without_lock(test_db, make_project):
+    """
+    Test that turns can be stored while a compaction is summarizing, and
+    that a compaction applied meanwhile wins over a concurrent one.
+    """
+    make_project(FILES)
+    llm_service = MagicMock()
+    sessions = ChatSessions(VectorStore(llm_service), token_budget=20)
+    session = sessions.create(test_db, "test-project")
+    sessions.add_turn(test_db, session, "first question", "short")
+    sessions.add_turn(test_db, session, "second question", "a much longer answer " * 4)
+
+    def summarize_concurrently(summary, messages, max_words):
+        # A turn is stored, then another compaction is applied first
+        sessions.add_turn(test_db, session, "third question", "answer")
+        test_db.query(ChatSession).update({"summary": "applied first"})
+        test_db.commit()
+        return "they talked"
+
+    llm_service.summarize_conversation.side_effect = summarize_concurrently
+    assert not sessions.compact(test_db, session.id)
+
+    test_db.expire_all()
+    assert sessions.get(test_db, session.id).summary == "applied first"
+    assert test_db.query(ChatMessage).filter(ChatMessage.summarized).count() == 0
+    assert test_db.query(ChatMessage).count() == 6
@@ -0,0 +1,151 @@
+import pytest
+import numpy as np
+from datetime import datetime
+from pathlib import Path
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+from typing import Callable, Dict, List, Optional
+
+# Import after setting environment variable
+from src.agent.llm import EmbeddingSpace
+from src.consts.vectors import VECTOR_DIMS
+from src.database.backends import backend
+from src.database.pgvector import Base, CodeFile, Project, engine
+from src.vectors.migration import start_migration
+from src.vectors.symbols import SymbolIndex, extract_symbols
+
+
+@pytest.fixture(scope="function")
+def test_db():
+    """
+    Create a clean test database for each test function, on whichever
+    backend DATABASE_URL points to
+    """
+    # Create extension and tables
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("DROP EXTENSION IF EXISTS vector CASCADE"))
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+            conn.commit()
+
+        print("created extension")
+
+    # Create all tables
+    Base.metadata.drop_all(bind=engine)
+    print("dropped tables")
+    Base.metadata.create_all(bind=engine)
+    print("created tables")
+
+    # Create a test session
+    TestingSessionLocal = sessionmaker(bind=engine)
+    test_session = TestingSessionLocal()
+
+    yield test_session
+
+    # Clean up
+    test_session.close()
+
+
+@pytest.fixture(scope="function")
+def make_project(test_db):
+    """
+    Factory of projects stored in the test database the way indexing stores
+    them. Takes the contents of the project's files by path, and returns the
+    project.
+    """
+
+    def make(
+        files: Dict[str, str],
+        name: str = "test-project",
+        path: str = "/path/to/test-project",
+        embed: Optional[Callable[[List[str]], np.ndarray]] = None,
+        space: Optional[EmbeddingSpace] = None,
+        chunk_lines: int = 1,
+        chunk_step: Optional[int] = None,
+        symbols: bool = False,
+        write_files: bool = False,
+        last_modified: Optional[datetime] = None,
+        **fields,
+    ) -> Project:
+        """
+        Args:
+            files: Contents of the files by path relative to the project
+            name: Name of the project
+            path: Path of the project
+            embed: Embeds the contents of a file's chunks, all ones if None
+            space: Embedding space the project is indexed with, recording
+                its version on the chunks
+            chunk_lines: Lines per chunk
+            chunk_step: Lines between the starts of chunks, chunk_lines if
+                None
+            symbols: Whether to store the files' symbols
+            write_files: Whether to write the files under path
+            last_modified: Modification time of the files, now if None
+            **fields: Other columns of the project
+        """
+        project = Project(
+            name=name,
+            path=str(path),
+            embedding_dim=VECTOR_DIMS,
+            file_count=len(files),
+            **fields,
+        )
+        test_db.add(project)
+        test_db.commit()
+        if space is not None:
+            start_migration(test_db, project.id, space)
+            test_db.commit()
+
+        for file_path, content in files.items():
+            if write_files:
+                disk_path = Path(path) / file_path
+                disk_path.parent.mkdir(parents=True, exist_ok=True)
+                disk_path.write_text(content + "\n")
+
+            code_file = CodeFile(
+                project_id=project.id,
+                file_path=file_path,
+                language="python",
+                last_modified=last_modified or datetime.now(),
+            )
+            test_db.add(code_file)
+            test_db.commit()
+
+            lines = content.split("\n")
+            chunks = [
+                {
+                    "start_line": start,
+                    "end_line": min(start + chunk_lines - 1, len(lines)),
+                    "content": "\n".join(lines[start - 1 : start + chunk_lines - 1]),
+                }
+                for start in range(1, len(lines) + 1, chunk_step or chunk_lines)
+            ]
+            contents = [chunk["content"] for chunk in chunks]
+            embeddings = (
+                embed(contents)
+                if embed is not None
+                else np.ones((len(chunks), VECTOR_DIMS), dtype=np.float32)
+            )
+            backend.write_chunks(
+                test_db,
+                project.id,
+                code_file.id,
+                chunks,
+                embeddings,
+                project.embedding_version_id,
+            )
+            if symbols:
+                SymbolIndex().store(
+                    test_db,
+                    project.id,
+                    code_file.id,
+                    extract_symbols(content, "python"),
+                )
+            project.chunk_count += len(chunks)
+            test_db.commit()
+
+        backend.chunks_changed(test_db, project.id)
+        test_db.commit()
+        return project
+
+    return make
@@ -1,48 +1,12 @@
-import os
 import pytest
 import numpy as np
 from datetime import datetime
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import IntegrityError
 
 # Import after setting environment variable
 from src.consts.vectors import VECTOR_DIMS
-from src.database.pgvector import Base, Project, CodeFile, CodeChunk
-
-
-@pytest.fixture(scope="function")
-def test_db():
-    """
-    Create a clean test database for each test function
-    """
-    # Get test database URL
-    test_db_url = os.getenv("DATABASE_URL", "")
-
-    # Create test engine
-    test_engine = create_engine(test_db_url)
-
-    # Create extension and tables
-    with test_engine.connect() as conn:
-        conn.execute(text("DROP EXTENSION IF EXISTS vector CASCADE"))
-        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
-        conn.commit()
-
-    print("created extension")
-
-    # Create all tables
-    Base.metadata.drop_all(bind=test_engine)
-    print("dropped tables")
-    Base.metadata.create_all(bind=test_engine)
-    print("created tables")
-
-    # Create a test session
-    TestingSessionLocal = sessionmaker(bind=test_engine)
-    test_session = TestingSessionLocal()
-
-    yield test_session
-
-    # Clean up
-    test_session.close()
+from src.database.backends import backend
+from src.database.pgvector import Project, CodeFile, CodeChunk
 
 
 def test_project_creation(test_db):
@@ -97,6 +61,30 @@ def test_code_file_creation(test_db):
     assert db_file.language == "python"
 
 
+def test_code_file_unique_per_project(test_db):
+    """
+    Test that a file path can only be stored once per project, which is
+    what the indexer's upserts rely on.
+    """
+    project = Project(name="test-project", path="/path/to/test-project")
+    test_db.add(project)
+    test_db.commit()
+
+    for _ in range(2):
+        test_db.add(
+            CodeFile(
+                project_id=project.id,
+                file_path="src/main.py",
+                language="python",
+                last_modified=datetime.now(),
+            )
+        )
+
+    with pytest.raises(IntegrityError):
+        test_db.commit()
+    test_db.rollback()
+
+
 def test_code_chunk_with_embedding(test_db):
     """
     Test creating a code chunk with an embedding based in a project and
@@ -218,3 +206,44 @@ def test_relationships(test_db):
 
     # Test chunk -> project relationship
     assert db_chunk2.project.name == "test-project"
+
+
+def test_write_chunks(test_db):
+    """
+    Test that chunks written by the storage backend (a binary COPY on
+    Postgres) read back through the ORM with their embeddings intact and
+    server-side defaults applied.
+    """
+    project = Project(name="test-project", path="/path/to/test-project")
+    test_db.add(project)
+    test_db.commit()
+
+    code_file = CodeFile(
+        project_id=project.id,
+        file_path="src/main.py",
+        language="python",
+        last_modified=datetime.now(),
+    )
+    test_db.add(code_file)
+    test_db.commit()
+
+    embeddings = np.random.rand(2, VECTOR_DIMS).astype(np.float32)
+    chunks = [
+        {"start_line": 1, "end_line": 2, "content": "def héllo():\n    pass"},
+        {"start_line": 3, "end_line": 3, "content": "héllo()"},
+    ]
+    backend.write_chunks(test_db, project.id, code_file.id, chunks, embeddings)
+    test_db.commit()
+
+    db_chunks = (
+        test_db.query(CodeChunk)
+        .filter(CodeChunk.file_id == code_file.id)
+        .order_by(CodeChunk.start_line)
+        .all()
+    )
+
+    assert [chunk.content for chunk in db_chunks] == [c["content"] for c in chunks]
+    assert all(chunk.created_at is not None for chunk in db_chunks)
+    np.testing.assert_array_equal(
+        np.array([chunk.embedding for chunk in db_chunks]), embeddings
+    )
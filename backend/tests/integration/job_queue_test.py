@@ -0,0 +1,89 @@
+import time
+import numpy as np
+from unittest.mock import MagicMock
+
+from src.agent.llm import EmbeddingSpace
+from src.consts.vectors import VECTOR_DIMS
+from src.jobs.queue import JobQueue
+from src.jobs.worker import start_worker_threads
+from src.vectors.vector_store import VectorStore
+
+
+def test_enqueue_deduplicates_pending_jobs(test_db):
+    """
+    Test that queueing a project twice while a job is pending returns the
+    same job, updated with the latest options.
+    """
+    queue = JobQueue()
+
+    first = queue.enqueue(test_db, "test-project", "/old/path", [".py"], [])
+    second = queue.enqueue(test_db, "test-project", "/new/path", [".lua"], [".git"])
+
+    assert first.id == second.id
+    test_db.refresh(second)
+    assert second.project_path == "/new/path"
+    assert second.file_extensions == [".lua"]
+
+
+def test_claim_excludes_projects_with_running_jobs(test_db):
+    """
+    Test that a project's next job cannot be claimed while another job for
+    the same project is running, but other projects' jobs can.
+    """
+    queue = JobQueue()
+
+    running = queue.enqueue(test_db, "test-project", "/path", [".py"], [])
+    assert queue.claim(test_db, "worker-1").id == running.id
+
+    queue.enqueue(test_db, "test-project", "/path", [".py"], [])
+    other = queue.enqueue(test_db, "other-project", "/other", [".py"], [])
+
+    assert queue.claim(test_db, "worker-2").id == other.id
+    assert queue.claim(test_db, "worker-3") is None
+
+
+def test_cancel(test_db):
+    """
+    Test that pending jobs are cancelled outright while running jobs are
+    flagged for their worker to stop.
+    """
+    queue = JobQueue()
+
+    running = queue.enqueue(test_db, "test-project", "/path", [".py"], [])
+    queue.claim(test_db, "worker-1")
+    pending = queue.enqueue(test_db, "other-project", "/other", [".py"], [])
+
+    assert queue.cancel(test_db, pending.id).status == "cancelled"
+
+    running = queue.cancel(test_db, running.id)
+    assert running.status == "running"
+    assert queue.heartbeat(test_db, running.id) is True
+
+
+def test_worker_threads_run_jobs(test_db, tmp_path):
+    """
+    Test that workers started inside the API's process run queued jobs with
+    the process's vector store.
+    """
+    (tmp_path / "main.py").write_text("print('hello')\n")
+    llm_service = MagicMock(embedding_space=EmbeddingSpace("model", VECTOR_DIMS))
+    llm_service.generate_embeddings.side_effect = lambda texts, **kwargs: np.ones(
+        (len(texts), VECTOR_DIMS), dtype=np.float32
+    )
+
+    queue = JobQueue()
+    job = queue.enqueue(test_db, "test-project", str(tmp_path), [".py"], [])
+    stop, threads = start_worker_threads(1, VectorStore(llm_service))
+    try:
+        for _ in range(100):
+            test_db.expire_all()
+            if queue.get(test_db, job.id).status == "completed":
+                break
+            time.sleep(0.05)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    assert queue.get(test_db, job.id).status == "completed"
+    assert llm_service.generate_embeddings.called
@@ -0,0 +1,218 @@
+import numpy as np
+from unittest.mock import MagicMock
+
+from src.agent.llm import EmbeddingSpace
+from src.consts.vectors import EMBEDDING_MAX_ATTEMPTS, VECTOR_DIMS
+from src.database.backends import backend
+from src.database.pgvector import Project, CodeChunk
+from src.vectors.migration import (
+    EmbeddingMigrator,
+    get_migration_status,
+    start_migration,
+)
+from src.vectors.vector_store import VectorStore
+
+OLD = EmbeddingSpace("old-model", VECTOR_DIMS)
+NEW = EmbeddingSpace("new-model", VECTOR_DIMS)
+
+
+def embed(texts, priority=None, space=None):
+    """Embeddings along the first axis for the old model, the second for others"""
+    embeddings = np.zeros((len(texts), VECTOR_DIMS), dtype=np.float32)
+    embeddings[:, 0 if space == OLD else 1] = 1.0
+    return embeddings
+
+
+# Indexed with the old model
+FILES = {"src/main.py": "x = 1\nx = 2\nx = 3"}
+
+
+def embed_old(contents):
+    """Embeddings of the old model"""
+    return embed(contents, space=OLD)
+
+
+def test_migration_switches_over(test_db, make_project):
+    """
+    Test that a project keeps being searched with its old embeddings while
+    they are re-embedded in batches, and switches to the new ones at once.
+    """
+    project = make_project(FILES, embed=embed_old, space=OLD)
+    old_version = project.embedding_version_id
+    assert old_version is not None
+
+    start_migration(test_db, project.id, NEW)
+    test_db.commit()
+    test_db.refresh(project)
+    assert project.embedding_model == "old-model"
+    assert project.embedding_version_id == old_version
+    assert get_migration_status(test_db, project)["chunks_embedded"] == 0
+
+    llm_service = MagicMock()
+    llm_service.generate_embeddings.side_effect = embed
+    migrator = EmbeddingMigrator(llm_service, batch_size=2, rate=0)
+    vector_store = VectorStore(llm_service)
+
+    # A batch is re-embedded with the new model, and not searched yet
+    assert migrator.run_once() == 0.0
+    assert llm_service.generate_embeddings.call_args.kwargs["space"] == NEW
+    test_db.expire_all()
+    assert get_migration_status(test_db, project)["chunks_embedded"] == 2
+
+    chunks, _ = vector_store.search_vectors(
+        test_db, "test-project", embed(["q"], space=OLD)[0], limit=3
+    )
+    assert len(chunks) == 3
+    _, embeddings = backend.read_chunk_embeddings(test_db, project.id, VECTOR_DIMS)
+    assert np.allclose(embeddings, embed(chunks, space=OLD))
+
+    # The last batch, then the switch
+    migrator.run_once()
+    migrator.run_once()
+    assert migrator.run_once() is None
+
+    test_db.expire_all()
+    project = test_db.get(Project, project.id)
+    assert project.embedding_model == "new-model"
+    assert project.embedding_version_id not in (None, old_version)
+    assert project.next_embedding_version_id is None
+    assert get_migration_status(test_db, project) is None
+
+    stored = test_db.query(CodeChunk).filter(CodeChunk.project_id == project.id)
+    assert {chunk.embedding_version_id for chunk in stored} == {
+        project.embedding_version_id
+    }
+    assert all(chunk.next_embedding is None for chunk in stored)
+
+    _, embeddings = backend.read_chunk_embeddings(test_db, project.id, VECTOR_DIMS)
+    assert np.allclose(embeddings, embed(chunks, space=NEW))
+    chunks, _ = vector_store.search_vectors(
+        test_db,
+        "test-project",
+        embed(["q"], space=NEW)[0],
+        limit=3,
+        embedding_version_id=project.embedding_version_id,
+    )
+    assert len(chunks) == 3
+
+    # Queries embedded with the old version no longer search the project
+    chunks, _ = vector_store.search_vectors(
+        test_db,
+        "test-project",
+        embed(["q"], space=OLD)[0],
+        limit=3,
+        embedding_version_id=old_version,
+    )
+    assert chunks == []
+
+
+def test_migration_is_abandoned(test_db, make_project):
+    """
+    Test that moving back to the project's model stops its migration and
+    drops the embeddings made for it.
+    """
+    project = make_project(FILES, embed=embed_old, space=OLD)
+    start_migration(test_db, project.id, NEW)
+    test_db.commit()
+
+    llm_service = MagicMock()
+    llm_service.generate_embeddings.side_effect = embed
+    EmbeddingMigrator(llm_service, batch_size=2, rate=0).run_once()
+
+    start_migration(test_db, project.id, OLD)
+    test_db.commit()
+    test_db.expire_all()
+
+    assert test_db.get(Project, project.id).next_embedding_version_id is None
+    assert (
+        test_db.query(CodeChunk).filter(CodeChunk.next_embedding.is_not(None)).count()
+        == 0
+    )
+
+
+def test_chunks_embedded_with_old_version_stay_pending(test_db, make_project):
+    """
+    Test that chunks embedded with a version the project switched away from
+    before they were stored are stored pending an embedding with the new one.
+    """
+    project = make_project(FILES, embed=embed_old, space=OLD)
+    code_file = project.files[0]
+    start_migration(test_db, project.id, NEW)
+    test_db.commit()
+
+    def embed_and_switch(texts, priority=None, space=None):
+        # The project switches over while the file is being embedded
+        EmbeddingMigrator(MagicMock()).cutover(
+            test_db, project.id, project.next_embedding_version_id
+        )
+        return embed(texts, space=space)
+
+    # Every chunk has been re-embedded
+    test_db.query(CodeChunk).update(
+        {"next_embedding": embed(["x"], space=NEW)[0]}, synchronize_session=False
+    )
+    test_db.commit()
+
+    llm_service = MagicMock()
+    llm_service.generate_embeddings.side_effect = embed_and_switch
+    chunks = [{"start_line": 1, "end_line": 1, "content": "x = 2", "token_count": 3}]
+    VectorStore(llm_service).store_code_chunks(
+        test_db, project.id, code_file.id, "src/main.py", chunks, 5
+    )
+
+    test_db.expire_all()
+    stored = test_db.query(CodeChunk).filter(CodeChunk.file_id == code_file.id).one()
+    assert stored.embedding_state == "pending"
+    assert stored.embedding is None
+
+
+def test_failing_chunks_do_not_block_migrations(test_db, make_project):
+    """
+    Test that projects take turns while one keeps failing, and that chunks
+    failing EMBEDDING_MAX_ATTEMPTS times are left pending at the switch.
+    """
+    project = make_project(FILES, embed=embed_old, space=OLD)
+    start_migration(test_db, project.id, NEW)
+
+    other = make_project(
+        {"src/other.py": "y = 1"},
+        name="other-project",
+        path="/path/to/other-project",
+        embed=embed_old,
+        space=OLD,
+    )
+    start_migration(test_db, other.id, NEW)
+    test_db.commit()
+
+    # The new model rejects one chunk of the first project
+    def embed_or_reject(texts, priority=None, space=None):
+        if "x = 2" in texts:
+            raise ValueError("rejected")
+        return embed(texts, space=space)
+
+    llm_service = MagicMock()
+    llm_service.generate_embeddings.side_effect = embed_or_reject
+    migrator = EmbeddingMigrator(llm_service, batch_size=1, rate=0)
+
+    # The other project switches over while the first one keeps failing
+    for _ in range(4):
+        migrator.run_once()
+    test_db.expire_all()
+    assert test_db.get(Project, other.id).embedding_model == "new-model"
+    assert test_db.get(Project, project.id).embedding_model == "old-model"
+
+    for _ in range(EMBEDDING_MAX_ATTEMPTS + 10):
+        if migrator.run_once() is None:
+            break
+
+    test_db.expire_all()
+    for migrated in (project, other):
+        migrated = test_db.get(Project, migrated.id)
+        assert migrated.embedding_model == "new-model"
+        assert migrated.next_embedding_version_id is None
+
+    states = {
+        chunk.content: chunk.embedding_state
+        for chunk in test_db.query(CodeChunk).filter(CodeChunk.project_id == project.id)
+    }
+    assert states == {"x = 1": "embedded", "x = 2": "pending", "x = 3": "embedded"}
@@ -0,0 +1,125 @@
+import os
+import pytest
+import numpy as np
+from sqlalchemy import update
+from datetime import datetime
+
+from src.consts.vectors import VECTOR_DIMS
+from src.database.backends import backend
+from src.database.pgvector import Project, CodeFile, CodeChunk, CodeSymbol
+from src.vectors.snapshot import NOT_INDEXED, export_snapshot, import_snapshot
+
+FILES = {
+    "src/indexer.py": "class CodebaseIndexer:\n    pass\n\n\ndef chunk_file():\n    pass",
+    "src/main.py": "indexer = CodebaseIndexer()",
+}
+
+
+def make_snapshot_project(make_project, test_db, project_path):
+    """A project indexed from files on disk, with overlapping chunks, the
+    first of each file pending an embedding"""
+    project = make_project(
+        FILES,
+        path=project_path,
+        embed=lambda contents: np.random.default_rng(len(contents)).random(
+            (len(contents), VECTOR_DIMS), dtype=np.float32
+        ),
+        chunk_lines=3,
+        chunk_step=2,
+        symbols=True,
+        write_files=True,
+        last_modified=datetime(2020, 1, 1),
+        embedding_model="test-model",
+    )
+    test_db.execute(
+        update(CodeChunk)
+        .where(CodeChunk.project_id == project.id, CodeChunk.start_line == 1)
+        .values(embedding=None, embedding_version_id=None, embedding_state="pending")
+    )
+    test_db.commit()
+    return project
+
+
+def test_export_import(test_db, tmp_path, make_project):
+    """Test that an imported project has the exported chunks, embeddings and
+    symbols, and that only files changed on disk are left to reindex"""
+    project_path = tmp_path / "project"
+    project = make_snapshot_project(make_project, test_db, project_path)
+    snapshot = str(tmp_path / "snapshot.tar.gz")
+
+    symbols = (
+        test_db.query(CodeSymbol).filter(CodeSymbol.project_id == project.id).count()
+    )
+
+    manifest = export_snapshot(test_db, "test-project", snapshot, batch_size=2)
+    assert manifest["rows"] == {"files": 2, "chunks": 4, "symbols": symbols}
+
+    # Changed here, but older than the exported copy
+    (project_path / "src/main.py").write_text("indexer = None\n")
+    os.utime(project_path / "src/main.py", (0, datetime(2019, 1, 1).timestamp()))
+
+    import_snapshot(
+        test_db,
+        snapshot,
+        "test-model",
+        VECTOR_DIMS,
+        project_name="copy",
+        project_path=str(project_path),
+    )
+
+    copy = test_db.query(Project).filter(Project.name == "copy").one()
+    assert copy.embedding_model == "test-model"
+    assert copy.path == str(project_path)
+
+    def chunks(project_id):
+        return [
+            (chunk.file.file_path, chunk.start_line, chunk.embedding_state)
+            for chunk in test_db.query(CodeChunk)
+            .filter(CodeChunk.project_id == project_id)
+            .order_by(CodeChunk.file_id, CodeChunk.start_line)
+        ]
+
+    assert chunks(copy.id) == chunks(project.id)
+    ids, embeddings = backend.read_chunk_embeddings(test_db, project.id, VECTOR_DIMS)
+    copy_ids, copy_embeddings = backend.read_chunk_embeddings(
+        test_db, copy.id, VECTOR_DIMS
+    )
+    assert len(copy_ids) == len(ids) == 2
+    assert np.allclose(
+        copy_embeddings,
+        embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True),
+        atol=1e-6,
+    )
+    assert (
+        test_db.query(CodeSymbol).filter(CodeSymbol.project_id == copy.id).count()
+        == symbols
+    )
+
+    # Unchanged files are up to date with the disk, changed ones are left to
+    # reindex however old they are
+    modified = {
+        code_file.file_path: code_file.last_modified
+        for code_file in test_db.query(CodeFile).filter(CodeFile.project_id == copy.id)
+    }
+    assert modified["src/indexer.py"] == datetime.fromtimestamp(
+        os.stat(project_path / "src/indexer.py").st_mtime
+    )
+    assert modified["src/main.py"] == NOT_INDEXED
+
+
+def test_import_validates(test_db, tmp_path, make_project):
+    """Test that snapshots of another embedding space, or over an existing
+    project, are refused"""
+    make_snapshot_project(make_project, test_db, tmp_path / "project")
+    snapshot = str(tmp_path / "snapshot.tar")
+    export_snapshot(test_db, "test-project", snapshot)
+
+    with pytest.raises(ValueError, match="embedded with"):
+        import_snapshot(test_db, snapshot, "other-model", VECTOR_DIMS, "copy")
+
+    with pytest.raises(ValueError, match="already exists"):
+        import_snapshot(test_db, snapshot, "test-model", VECTOR_DIMS)
+    test_db.rollback()
+
+    import_snapshot(test_db, snapshot, "test-model", VECTOR_DIMS, replace=True)
+    assert test_db.query(Project).count() == 1
@@ -0,0 +1,54 @@
+from src.vectors.scope import SearchScope
+from src.vectors.symbols import SymbolIndex
+
+FILES = {
+    "src/indexer.py": "class CodebaseIndexer:\n    pass\n\n\ndef chunk_file():\n    pass",
+    "src/main.py": "indexer = CodebaseIndexer()",
+    "src/worker.py": "from src.indexer import CodebaseIndexer",
+}
+
+
+def test_resolve(test_db, make_project):
+    """Test that mentioned symbols resolve to the chunks defining them"""
+    symbol_index = SymbolIndex()
+    project = make_project(FILES, chunk_lines=10, symbols=True)
+    chunk_ids = {
+        code_file.file_path: code_file.chunks[0].id for code_file in project.files
+    }
+
+    definitions = symbol_index.lookup(test_db, ["test-project"], ["chunk_file"])
+    assert [(row["file_path"], row["kind"], row["line"]) for row in definitions] == [
+        ("src/indexer.py", "function", 5)
+    ]
+
+    assert symbol_index.resolve(
+        test_db, ["test-project"], "What does chunk_file() return?"
+    ) == [chunk_ids["src/indexer.py"]]
+    assert symbol_index.resolve(test_db, ["test-project"], "What is indexing?") == []
+
+    # Definitions outside the scope are left out
+    scope = SearchScope(["src/main.py"])
+    assert (
+        symbol_index.resolve(
+            test_db, ["test-project"], "Where is CodebaseIndexer?", scope
+        )
+        == []
+    )
+
+
+def test_build_repo_map(test_db, make_project):
+    """Test that the repo map lists the most referenced files first"""
+    symbol_index = SymbolIndex()
+    project = make_project(FILES, chunk_lines=10, symbols=True)
+
+    repo_map = symbol_index.build_repo_map(test_db, project.id)
+    assert repo_map.splitlines()[:3] == [
+        "src/indexer.py:",
+        "  class CodebaseIndexer",
+        "  function chunk_file",
+    ]
+    assert "src/main.py:\n  variable indexer" in repo_map
+
+    # The map is cut at the token budget
+    symbol_index.max_map_tokens = 8
+    assert symbol_index.build_repo_map(test_db, project.id) == "src/indexer.py:"
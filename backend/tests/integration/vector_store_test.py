@@ -0,0 +1,267 @@
+import numpy as np
+from datetime import datetime
+from unittest.mock import MagicMock
+
+from src.agent.llm import EmbeddingSpace
+from src.consts.vectors import EMBEDDING_MAX_ATTEMPTS, VECTOR_DIMS
+from src.database.backends import backend
+from src.database.pgvector import Project, CodeFile, CodeChunk
+from src.vectors.indexer import CodebaseIndexer
+from src.vectors.overlay import OverlayBuilder
+from src.vectors.scope import SearchScope
+from src.vectors.vector_store import VectorStore
+
+
+def test_retry_embeddings(test_db):
+    """
+    Test that chunks stored without embeddings count failed retries, are
+    given up on after EMBEDDING_MAX_ATTEMPTS, and are embedded once the
+    provider works again.
+    """
+    project = Project(name="test-project", path="/path/to/test-project")
+    test_db.add(project)
+    test_db.commit()
+
+    code_file = CodeFile(
+        project_id=project.id,
+        file_path="src/main.py",
+        language="python",
+        last_modified=datetime.now(),
+    )
+    test_db.add(code_file)
+    test_db.commit()
+
+    chunks = [
+        {"start_line": 1, "end_line": 1, "content": "import os"},
+        {"start_line": 2, "end_line": 2, "content": "print(os.getcwd())"},
+    ]
+    backend.write_chunks(test_db, project.id, code_file.id, chunks, None)
+    test_db.commit()
+
+    llm_service = MagicMock()
+    vector_store = VectorStore(llm_service)
+
+    # The provider keeps failing: one attempt per run until given up on
+    llm_service.generate_embeddings.side_effect = Exception("unavailable")
+    for _ in range(EMBEDDING_MAX_ATTEMPTS - 1):
+        assert vector_store.retry_embeddings(test_db, project.id) == 0
+
+    states = {
+        chunk.embedding_state
+        for chunk in test_db.query(CodeChunk).filter(CodeChunk.file_id == code_file.id)
+    }
+    assert states == {"failed"}
+
+    # Failed chunks are reported, and pending ones are embedded on the next run
+    test_db.query(CodeChunk).update({"embedding_state": "pending"})
+    test_db.commit()
+
+    llm_service.generate_embeddings.side_effect = None
+    llm_service.generate_embeddings.return_value = np.ones(
+        (2, VECTOR_DIMS), dtype=np.float32
+    )
+    assert vector_store.retry_embeddings(test_db, project.id) == 2
+
+    test_db.expire_all()
+    stored = test_db.query(CodeChunk).filter(CodeChunk.file_id == code_file.id).all()
+    assert all(chunk.embedding_state == "embedded" for chunk in stored)
+    assert all(len(chunk.embedding) == VECTOR_DIMS for chunk in stored)
+
+
+def test_search_vectors(test_db):
+    """
+    Test that searches return a project's nearest chunks first, and see
+    chunks written after a previous search.
+    """
+    project = Project(
+        name="test-project", path="/path/to/test-project", embedding_dim=VECTOR_DIMS
+    )
+    test_db.add(project)
+    test_db.commit()
+
+    code_file = CodeFile(
+        project_id=project.id,
+        file_path="src/main.py",
+        language="python",
+        last_modified=datetime.now(),
+    )
+    test_db.add(code_file)
+    test_db.commit()
+
+    embeddings = np.eye(3, VECTOR_DIMS, dtype=np.float32)
+    chunks = [
+        {"start_line": line, "end_line": line, "content": f"x = {line}"}
+        for line in range(1, 4)
+    ]
+    backend.write_chunks(test_db, project.id, code_file.id, chunks[:2], embeddings[:2])
+    backend.chunks_changed(test_db, project.id)
+    test_db.commit()
+
+    vector_store = VectorStore(MagicMock())
+    found, files = vector_store.search_vectors(
+        test_db, "test-project", embeddings[1], limit=2
+    )
+    assert [chunk["content"] for chunk in found] == ["x = 2", "x = 1"]
+    assert files == [{"project_name": "test-project", "file_path": "src/main.py"}]
+
+    backend.write_chunks(test_db, project.id, code_file.id, chunks[2:], embeddings[2:])
+    backend.chunks_changed(test_db, project.id)
+    test_db.commit()
+    test_db.expire_all()
+
+    found, _ = vector_store.search_vectors(
+        test_db, "test-project", embeddings[2], limit=1
+    )
+    assert [chunk["content"] for chunk in found] == ["x = 3"]
+
+
+def test_search_across_projects(test_db):
+    """
+    Test that several projects are searched in one query with their chunks
+    ranked together, and that scopes apply to each project.
+    """
+    embeddings = np.eye(3, VECTOR_DIMS, dtype=np.float32)
+    for name, files in (
+        ("first", [("src/a.py", "python", 0)]),
+        ("second", [("src/b.py", "python", 1), ("lib/c.lua", "lua", 2)]),
+    ):
+        project = Project(name=name, path=f"/repos/{name}", embedding_dim=VECTOR_DIMS)
+        test_db.add(project)
+        test_db.commit()
+
+        for file_path, language, row in files:
+            code_file = CodeFile(
+                project_id=project.id,
+                file_path=file_path,
+                language=language,
+                last_modified=datetime.now(),
+            )
+            test_db.add(code_file)
+            test_db.commit()
+
+            chunk = {"start_line": 1, "end_line": 1, "content": file_path}
+            backend.write_chunks(
+                test_db, project.id, code_file.id, [chunk], embeddings[row : row + 1]
+            )
+        backend.chunks_changed(test_db, project.id)
+        test_db.commit()
+
+    vector_store = VectorStore(MagicMock())
+    query = np.array([0.3, 0.9, 0.5] + [0.0] * (VECTOR_DIMS - 3), dtype=np.float32)
+
+    chunks, files = vector_store.search_vectors(
+        test_db, ["first", "second"], query, limit=3
+    )
+    assert [(c["project_name"], c["file_path"]) for c in chunks] == [
+        ("second", "src/b.py"),
+        ("second", "lib/c.lua"),
+        ("first", "src/a.py"),
+    ]
+
+    chunks, _ = vector_store.search_vectors(
+        test_db,
+        ["first", "second"],
+        query,
+        limit=3,
+        scope=SearchScope(["src"], ["python"]),
+    )
+    assert [c["file_path"] for c in chunks] == ["src/b.py", "src/a.py"]
+
+    chunks, _ = vector_store.search_vectors(
+        test_db, ["first", "second"], query, scope=SearchScope(["/repos/first"])
+    )
+    assert [c["project_name"] for c in chunks] == ["first"]
+
+
+def test_search_with_overlay(test_db):
+    """
+    Test that unsaved buffers are searched instead of the stored chunks of
+    their files, and embedded once for repeated queries.
+    """
+    project = Project(
+        name="test-project", path="/path/to/test-project", embedding_dim=VECTOR_DIMS
+    )
+    test_db.add(project)
+    test_db.commit()
+
+    embeddings = np.eye(3, VECTOR_DIMS, dtype=np.float32)
+    for row, file_path in enumerate(["src/main.py", "src/util.py"]):
+        code_file = CodeFile(
+            project_id=project.id,
+            file_path=file_path,
+            language="python",
+            last_modified=datetime.now(),
+        )
+        test_db.add(code_file)
+        test_db.commit()
+
+        chunk = {"start_line": 1, "end_line": 1, "content": f"saved {file_path}"}
+        backend.write_chunks(
+            test_db, project.id, code_file.id, [chunk], embeddings[row : row + 1]
+        )
+    backend.chunks_changed(test_db, project.id)
+    test_db.commit()
+
+    llm_service = MagicMock()
+    llm_service.embedding_model_name = "test-model"
+    llm_service.embedding_dims = VECTOR_DIMS
+    llm_service.generate_embeddings.return_value = embeddings[2:]
+    vector_store = VectorStore(llm_service)
+    builder = OverlayBuilder(CodebaseIndexer(vector_store), llm_service)
+
+    for _ in range(2):
+        overlay = builder.build(
+            test_db,
+            ["test-project"],
+            [
+                {
+                    "file_path": "/path/to/test-project/src/main.py",
+                    "content": "unsaved = True",
+                }
+            ],
+        )
+        chunks, files = vector_store.search_vectors(
+            test_db, "test-project", embeddings[2], limit=3, overlay=overlay
+        )
+        assert [chunk["content"] for chunk in chunks] == [
+            "unsaved = True",
+            "saved src/util.py",
+        ]
+        assert chunks[0]["file_path"] == "src/main.py"
+
+    assert llm_service.generate_embeddings.call_count == 1
+
+
+def test_index_streamed_file(test_db, tmp_path, monkeypatch):
+    """
+    Test that a file above INDEX_STREAM_FILE_BYTES is embedded and written in
+    batches, and stored with all its chunks, counters and symbols.
+    """
+    monkeypatch.setattr("src.vectors.indexer.INDEX_STREAM_FILE_BYTES", 0)
+    monkeypatch.setattr("src.vectors.indexer.INDEX_STREAM_BATCH_CHUNKS", 2)
+    content = "\n".join(f"def function{i}():\n    return {i}" for i in range(10))
+    (tmp_path / "large.py").write_text(content)
+
+    llm_service = MagicMock(embedding_space=EmbeddingSpace("model", VECTOR_DIMS))
+    llm_service.generate_embeddings.side_effect = lambda texts, **kwargs: np.ones(
+        (len(texts), VECTOR_DIMS), dtype=np.float32
+    )
+    indexer = CodebaseIndexer(VectorStore(llm_service))
+    indexer.chunk_size = 10
+    indexer.chunk_overlap = 0
+    assert indexer.index_codebase(str(tmp_path), "test-project", [".py"], [])
+
+    batches = [
+        len(call.args[0]) for call in llm_service.generate_embeddings.call_args_list
+    ]
+    assert len(batches) > 1 and all(size <= 2 for size in batches)
+
+    test_db.expire_all()
+    project = test_db.query(Project).filter(Project.name == "test-project").one()
+    stored = test_db.query(CodeChunk).filter(CodeChunk.project_id == project.id)
+    assert project.chunk_count == stored.count() == sum(batches)
+    assert {chunk.embedding_state for chunk in stored} == {"embedded"}
+    assert [
+        row["name"]
+        for row in indexer.symbol_index.lookup(test_db, ["test-project"], ["function9"])
+    ] == ["function9"]
@@ -0,0 +1,166 @@
+import time
+import asyncio
+import threading
+import pytest
+
+from src.agent.admission import (
+    AdmissionController,
+    Deadline,
+    DeadlineExceeded,
+    Rejected,
+    RequestCancelled,
+    RequestGate,
+    _current_deadline,
+)
+from src.agent.scheduler import EmbeddingScheduler, Priority
+
+
+def test_admission_limits_tenants_and_queues():
+    """Test that requests over a tenant's limit wait, and are rejected once
+    its queue is full"""
+
+    async def scenario():
+        admission = AdmissionController(
+            max_concurrency=4, tenant_max_concurrency=1, max_queued=1
+        )
+
+        await admission.acquire("a")
+        # Other tenants aren't held up by a busy one
+        await admission.acquire("b")
+
+        waiting = asyncio.ensure_future(admission.acquire("a"))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+
+        with pytest.raises(Rejected):
+            await admission.acquire("a")
+
+        admission.release("a")
+        await asyncio.wait_for(waiting, timeout=1)
+
+    asyncio.run(scenario())
+
+
+def test_admission_rejects_after_queue_timeout():
+    """Test that a request waiting too long is rejected and leaves the queue"""
+
+    async def scenario():
+        admission = AdmissionController(
+            max_concurrency=1, max_queued=4, queue_timeout=0.05
+        )
+        await admission.acquire("a")
+
+        with pytest.raises(Rejected):
+            await admission.acquire("b")
+        assert not admission._waiters
+
+        admission.release("a")
+        await admission.acquire("b")
+
+    asyncio.run(scenario())
+
+
+def test_identical_requests_share_work():
+    """Test that identical requests made at the same time are answered by
+    one run of the work"""
+    runs = []
+    gate = threading.Event()
+
+    def work(deadline):
+        runs.append(1)
+        gate.wait(timeout=5)
+        yield "context"
+        yield "answer"
+
+    async def scenario():
+        request_gate = RequestGate(AdmissionController(tenant_max_concurrency=1))
+        first = asyncio.ensure_future(request_gate.collect("a", "query", work))
+        while not runs:
+            await asyncio.sleep(0.01)
+
+        # Joins the running work instead of queueing behind it
+        second = asyncio.ensure_future(request_gate.collect("a", "query", work))
+        await asyncio.sleep(0.05)
+        gate.set()
+
+        return await asyncio.wait_for(asyncio.gather(first, second), timeout=5)
+
+    assert asyncio.run(scenario()) == [["context", "answer"]] * 2
+    assert len(runs) == 1
+
+
+def test_work_is_cancelled_when_clients_leave():
+    """Test that work stops once no request waits for it, and its slot is
+    given back"""
+    cancelled = threading.Event()
+
+    def work(deadline):
+        deadline.on_cancel(cancelled.set)
+        while True:
+            time.sleep(0.01)
+            yield "token"
+
+    async def scenario():
+        admission = AdmissionController(max_concurrency=1)
+        request_gate = RequestGate(admission)
+
+        disconnected = asyncio.Event()
+
+        async def is_disconnected():
+            return disconnected.is_set()
+
+        request = asyncio.ensure_future(
+            request_gate.collect("a", None, work, is_disconnected)
+        )
+        await asyncio.sleep(0.05)
+        disconnected.set()
+
+        with pytest.raises(RequestCancelled):
+            await asyncio.wait_for(request, timeout=5)
+        assert cancelled.wait(timeout=5)
+
+        # The next request gets the slot once the work has stopped
+        await asyncio.wait_for(admission.acquire("a"), timeout=5)
+
+    asyncio.run(scenario())
+
+
+def test_deadline_drops_queued_embeddings():
+    """Test that embeddings of a request past its deadline stop waiting and
+    are never sent to the provider"""
+    served = []
+    started = threading.Event()
+    gate = threading.Event()
+
+    def embed_batch(texts):
+        if texts[0] == "bulk":
+            started.set()
+            gate.wait(timeout=5)
+        served.append(texts[0])
+        return [[1.0] for _ in texts]
+
+    scheduler = EmbeddingScheduler(embed_batch, max_concurrency=1)
+    bulk = threading.Thread(target=scheduler.embed, args=(["bulk"], Priority.BULK))
+    bulk.start()
+    assert started.wait(timeout=5)
+
+    errors = []
+
+    def query():
+        # Each thread has its own current deadline
+        _current_deadline.set(Deadline(timeout=0.05))
+        try:
+            scheduler.embed(["query"], Priority.INTERACTIVE)
+        except DeadlineExceeded as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=query)
+    thread.start()
+    thread.join(timeout=5)
+    assert errors
+
+    gate.set()
+    bulk.join(timeout=5)
+    scheduler.embed(["next"], Priority.INTERACTIVE)
+
+    assert served == ["bulk", "next"]
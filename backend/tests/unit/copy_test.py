@@ -0,0 +1,69 @@
+import struct
+import numpy as np
+
+from src.database.copy import COPY_HEADER, COPY_TRAILER, encode_code_chunks
+
+
+def test_encode_code_chunks():
+    """
+    Test that chunks are encoded as a binary COPY stream, with embeddings
+    in pgvector's binary format.
+    """
+    chunks = [
+        {"start_line": 1, "end_line": 3, "content": "def main():\n    pass"},
+        {"start_line": 4, "end_line": 4, "content": "main()"},
+    ]
+    embeddings = np.array([[0.5, -1.0, 2.0], [0.0, 1.0, 0.25]], dtype=np.float32)
+
+    payload = encode_code_chunks(7, 9, chunks, embeddings, 3)
+
+    assert payload.startswith(COPY_HEADER)
+    assert payload.endswith(COPY_TRAILER)
+
+    offset = len(COPY_HEADER)
+    for chunk, embedding in zip(chunks, embeddings):
+        (field_count,) = struct.unpack_from(">h", payload, offset)
+        offset += 2
+        assert field_count == 9
+
+        fields = []
+        for _ in range(field_count):
+            (length,) = struct.unpack_from(">i", payload, offset)
+            offset += 4
+            fields.append(payload[offset : offset + length])
+            offset += length
+
+        project_id, file_id, start_line, end_line = (
+            struct.unpack(">i", field)[0] for field in fields[:4]
+        )
+        assert (project_id, file_id) == (7, 9)
+        assert (start_line, end_line) == (chunk["start_line"], chunk["end_line"])
+        assert fields[4].decode("utf-8") == chunk["content"]
+
+        dims, unused = struct.unpack_from(">HH", fields[5])
+        assert (dims, unused) == (3, 0)
+        np.testing.assert_array_equal(
+            np.frombuffer(fields[5], dtype=">f4", offset=4), embedding
+        )
+        assert fields[6] == b"embedded"
+        assert struct.unpack(">i", fields[7]) == (0,)
+        assert struct.unpack(">i", fields[8]) == (3,)
+
+    assert offset == len(payload) - len(COPY_TRAILER)
+
+
+def test_encode_code_chunks_pending():
+    """Test that chunks without embeddings are encoded as pending with NULLs"""
+    chunks = [{"start_line": 1, "end_line": 1, "content": "x = 1"}]
+
+    payload = encode_code_chunks(7, 9, chunks, None)
+
+    expected_tail = (
+        struct.pack(">i", -1)
+        + struct.pack(">i", 7)
+        + b"pending"
+        + struct.pack(">ii", 4, 1)
+        + struct.pack(">i", -1)
+        + COPY_TRAILER
+    )
+    assert payload.endswith(expected_tail)
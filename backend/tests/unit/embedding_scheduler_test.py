@@ -0,0 +1,101 @@
+import time
+import threading
+import pytest
+
+from src.agent.scheduler import EmbeddingScheduler, Priority
+
+
+def make_embedder(order, started=None, gate=None):
+    """Embedding function that records which batches it served, in order"""
+
+    def embed_batch(texts):
+        if gate is not None and texts[0] == "bulk-0":
+            started.set()
+            gate.wait(timeout=5)
+        order.append(texts[0])
+        return [[float(len(text))] for text in texts]
+
+    return embed_batch
+
+
+def test_embed_preserves_order_across_batches():
+    """Test that bulk requests split into batches come back in order"""
+    scheduler = EmbeddingScheduler(
+        make_embedder([]), max_concurrency=3, bulk_batch_size=2
+    )
+
+    texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+    embeddings = scheduler.embed(texts, Priority.BULK)
+
+    assert embeddings.tolist() == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+
+
+def test_interactive_preempts_queued_bulk():
+    """Test that an interactive query is served before queued bulk batches"""
+    order = []
+    started = threading.Event()
+    gate = threading.Event()
+    scheduler = EmbeddingScheduler(
+        make_embedder(order, started, gate), max_concurrency=1, bulk_batch_size=1
+    )
+
+    # Occupy the only provider slot with the first bulk batch, queue the rest
+    bulk = threading.Thread(
+        target=scheduler.embed,
+        args=([f"bulk-{i}" for i in range(3)], Priority.BULK),
+    )
+    bulk.start()
+    assert started.wait(timeout=5)
+
+    interactive = threading.Thread(
+        target=scheduler.embed, args=(["query"], Priority.INTERACTIVE)
+    )
+    interactive.start()
+
+    # Give the interactive query time to be queued behind the busy slot
+    while not scheduler._queue or scheduler._queue[0][0] != Priority.INTERACTIVE:
+        time.sleep(0.01)
+
+    gate.set()
+    bulk.join(timeout=5)
+    interactive.join(timeout=5)
+
+    assert order == ["bulk-0", "query", "bulk-1", "bulk-2"]
+
+
+def test_bulk_errors_are_raised_and_back_off():
+    """Test that provider errors reach the caller and pause bulk work"""
+
+    def failing(texts):
+        raise RuntimeError("rate limited")
+
+    scheduler = EmbeddingScheduler(failing, max_concurrency=1)
+
+    with pytest.raises(RuntimeError):
+        scheduler.embed(["text"], Priority.BULK)
+
+    assert scheduler._bulk_limit(time.monotonic()) == 0
+
+
+def test_interactive_results_do_not_wait_for_load_signal():
+    """
+    Test that interactive embeddings are returned before load is published,
+    and that failing to publish it doesn't fail them.
+    """
+    returned = threading.Event()
+
+    class LoadSignal:
+        def publish(self):
+            assert returned.wait(timeout=5)
+            raise RuntimeError("database unavailable")
+
+        def is_busy(self):
+            return False
+
+    scheduler = EmbeddingScheduler(
+        make_embedder([]), max_concurrency=1, load_signal=LoadSignal()
+    )
+
+    assert scheduler.embed(["query"], Priority.INTERACTIVE).tolist() == [[5.0]]
+    returned.set()
+    assert scheduler.embed(["query"], Priority.INTERACTIVE).tolist() == [[5.0]]
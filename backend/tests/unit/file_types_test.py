@@ -0,0 +1,53 @@
+import os
+import random
+import string
+
+from src.vectors import file_types
+from src.vectors.file_types import read_lines, skip_reason
+
+
+def write(tmp_path, name, content):
+    path = os.path.join(tmp_path, name)
+    mode = "wb" if isinstance(content, bytes) else "w"
+    with open(path, mode) as f:
+        f.write(content)
+    return path, os.path.getsize(path)
+
+
+def test_skip_reason(tmp_path, monkeypatch):
+    """Test which files are left unindexed, and why"""
+    code = "def main():\n    return 1\n" * 50
+    assert skip_reason(*write(tmp_path, "main.py", code)) is None
+    assert skip_reason(*write(tmp_path, "empty.py", "")) is None
+
+    assert skip_reason(*write(tmp_path, "app.min.js", code)) == "generated"
+    assert (
+        skip_reason(
+            *write(tmp_path, "api.go", "// Code generated by protoc. DO NOT EDIT.\n")
+        )
+        == "generated"
+    )
+    assert skip_reason(*write(tmp_path, "blob.py", b"\x7fELF\0\0\1")) == "binary"
+    assert skip_reason(*write(tmp_path, "bundle.js", "var a=1;" * 2000)) == "minified"
+
+    rng = random.Random(0)
+    data = "\n".join(
+        "".join(
+            rng.choice(string.ascii_letters + string.digits + "+/") for _ in range(76)
+        )
+        for _ in range(100)
+    )
+    assert skip_reason(*write(tmp_path, "data.js", data)) == "binary"
+
+    monkeypatch.setattr(file_types, "INDEX_MAX_FILE_BYTES", 100)
+    assert skip_reason(*write(tmp_path, "big.py", code)) == "too_large"
+
+
+def test_read_lines(tmp_path):
+    """Test that memory mapped lines match the file's lines"""
+    content = "first\r\nsecond\n\nünïcode\nlast"
+    path, _ = write(tmp_path, "main.py", content)
+    assert list(read_lines(path)) == content.replace("\r\n", "\n").split("\n")
+
+    path, _ = write(tmp_path, "empty.py", "")
+    assert list(read_lines(path)) == []
@@ -1,8 +1,10 @@
 import pytest
+from datetime import datetime, timedelta
 from unittest.mock import MagicMock
 
 # Import after setting env vars
 from src.vectors.indexer import CodebaseIndexer
+from src.vectors.symbols import extract_symbols
 
 
 @pytest.fixture
@@ -49,3 +51,86 @@ def test_get_language_for_extension(indexer):
     assert indexer._get_language_for_extension(".ts") == "typescript"
     assert indexer._get_language_for_extension(".cpp") == "cpp"
     assert indexer._get_language_for_extension(".unknown") == "text"
+
+
+def test_chunk_token_counts(indexer):
+    """Test that chunks report how many tokens they hold"""
+    content = "def function1():\n    return 'hello'"
+    chunks = indexer._chunk_file(content)
+
+    expected = sum(len(indexer.encoding.encode(line)) for line in content.splitlines())
+    assert chunks[0]["token_count"] == expected
+
+
+def test_get_index_status_in_progress(indexer):
+    """Test that status is read from project counters and reports progress"""
+    project = MagicMock(
+        file_count=10,
+        chunk_count=40,
+        byte_count=2048,
+        token_count=9000,
+        index_phase="indexing",
+        files_total=100,
+        files_scanned=25,
+        index_started_at=datetime.now() - timedelta(seconds=10),
+        index_finished_at=None,
+        updated_at=None,
+        next_embedding_version_id=None,
+    )
+    db = MagicMock()
+    db.query.return_value.filter.return_value.first.return_value = project
+    db.execute.return_value.all.side_effect = [[("pending", 3)], [("too_large", 2)]]
+
+    status = indexer.get_index_status("test-project", db)
+
+    assert status["status"] == "indexing"
+    assert status["file_count"] == 10
+    assert status["chunk_count"] == 40
+    assert status["progress"]["files_scanned"] == 25
+    assert status["progress"]["files_total"] == 100
+    assert status["progress"]["files_per_second"] > 0
+    assert status["progress"]["eta_seconds"] > 0
+    assert status["embeddings"] == {"pending": 3, "failed": 0}
+    assert status["skipped_files"] == {"too_large": 2}
+
+    # Status is a single project lookup, plus counts over the partial indexes
+    # of chunks without embeddings and skipped files; never a count over all
+    # chunks or files
+    db.query.assert_called_once()
+    assert db.execute.call_count == 2
+
+
+def test_chunk_lines_keeps_every_line(indexer):
+    """Test that chunks streamed line by line cover the whole file"""
+    indexer.chunk_size = 10
+    indexer.chunk_overlap = 4
+
+    lines = [f"line {i}" for i in range(1, 21)]
+    chunks = indexer._chunk_lines(iter(lines))
+
+    assert chunks == indexer._chunk_file("\n".join(lines))
+    assert chunks[-1]["end_line"] == 20
+    for chunk in chunks:
+        assert chunk["content"] == "\n".join(
+            lines[chunk["start_line"] - 1 : chunk["end_line"]]
+        )
+
+
+def test_stream_file(indexer, tmp_path, monkeypatch):
+    """Test that large files are chunked in batches, with their symbols"""
+    monkeypatch.setattr("src.vectors.indexer.INDEX_STREAM_BATCH_CHUNKS", 2)
+    indexer.chunk_size = 10
+    indexer.chunk_overlap = 0
+    content = "\n".join(f"def function{i}():\n    return {i}" for i in range(10))
+    path = tmp_path / "large.py"
+    path.write_text(content)
+
+    indexer.symbol_index = MagicMock()
+    batches = list(indexer._stream_file(MagicMock(), 1, 2, str(path), "python"))
+
+    assert all(len(batch) <= 2 for batch in batches)
+    assert [chunk for batch in batches for chunk in batch] == indexer._chunk_file(
+        content
+    )
+    (_, _, _, symbols), _ = indexer.symbol_index.store.call_args
+    assert symbols == extract_symbols(content, "python")
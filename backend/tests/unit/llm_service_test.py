@@ -1,11 +1,15 @@
 import os
 import pytest
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, MagicMock
 import numpy as np
-from langchain.schema import AIMessage
+from langchain_core.messages import AIMessageChunk
 
 from src.consts.vectors import VECTOR_DIMS
 
+from src.agent.context_cache import REFRESH_MARGIN, ContextCache
+
 # Import after patching environment
 with patch.dict(os.environ, {"LLM_PROVIDER": "test", "EMBEDDING_PROVIDER": "test"}):
     from src.agent.llm import LLMService
@@ -15,7 +19,12 @@ with patch.dict(os.environ, {"LLM_PROVIDER": "test", "EMBEDDING_PROVIDER": "test
 def mock_llm():
     """Mock LLM that returns a predictable response"""
     mock = MagicMock()
-    mock.return_value = AIMessage(content="This is a mock LLM response")
+    mock.stream.side_effect = lambda messages: iter(
+        [
+            AIMessageChunk(content="This is a mock "),
+            AIMessageChunk(content="LLM response"),
+        ]
+    )
     return mock
 
 
@@ -45,7 +54,88 @@ def test_generate_response(mock_llm):
             )
 
             assert response == "This is a mock LLM response"
-            assert mock_llm.call_count == 1
+            assert mock_llm.stream.call_count == 1
+
+
+def test_generate_response_with_summary(mock_llm):
+    """Test that a conversation summary is sent with the query"""
+    with patch.object(LLMService, "_initialize_llm", return_value=mock_llm):
+        with patch.object(LLMService, "_initialize_embedding_model"):
+            service = LLMService()
+
+            service.generate_response(
+                query="And the caller?",
+                context="def hello(): print('hello')",
+                chat_history=[
+                    {"role": "user", "content": "What does hello do?"},
+                    {"role": "assistant", "content": "It prints hello."},
+                    {"role": "user", "content": "And the caller?"},
+                ],
+                summary="The user is reading hello.py",
+            )
+
+            messages = mock_llm.stream.call_args[0][0]
+            assert [message.type for message in messages] == [
+                "system",
+                "human",
+                "ai",
+                "human",
+            ]
+            assert "The user is reading hello.py" in messages[-1].content
+
+
+def test_prompt_prefix_is_stable(mock_llm):
+    """
+    Test that only the last message changes between queries, so providers
+    can cache the prompt before it.
+    """
+    with patch.object(LLMService, "_initialize_llm", return_value=mock_llm):
+        with patch.object(LLMService, "_initialize_embedding_model"):
+            service = LLMService()
+
+            history = [
+                {"role": "user", "content": "What does hello do?"},
+                {"role": "assistant", "content": "It prints hello."},
+            ]
+            first = service._build_messages(
+                "Who calls it?", "def a(): hello()", history + [{}], None, "a map"
+            )
+            second = service._build_messages(
+                "Is it tested?", "def test(): hello()", history + [{}], "sum", "a map"
+            )
+
+            assert first[:-1] == second[:-1]
+            assert "a map" in first[0].content
+            assert "def a(): hello()" in first[-1].content
+            assert "Who calls it?" in first[-1].content
+
+
+def test_context_cache(mock_llm):
+    """
+    Test that large system prompts are sent as a provider cache, created
+    once, and small ones are sent as they are.
+    """
+    with patch.object(LLMService, "_initialize_llm", return_value=mock_llm):
+        with patch.object(LLMService, "_initialize_embedding_model"):
+            service = LLMService()
+
+    create = MagicMock(return_value="cachedContents/overview")
+    service.context_cache = ContextCache(
+        create, lambda text: len(text.split()), ttl=3600, min_tokens=100
+    )
+
+    for _ in range(2):
+        service.generate_response("Who calls hello?", "", project_context="word " * 100)
+        messages = mock_llm.stream.call_args[0][0]
+        assert [message.type for message in messages] == ["human"]
+        assert mock_llm.stream.call_args[1] == {
+            "cached_content": "cachedContents/overview"
+        }
+    assert create.call_count == 1
+
+    service.generate_response("Who calls hello?", "", project_context="small")
+    assert mock_llm.stream.call_args[0][0][0].type == "system"
+    assert mock_llm.stream.call_args[1] == {}
 
 
 def test_generate_embeddings(mock_embedding_model):
@@ -75,7 +165,9 @@ def test_error_handling():
             LLMService, "_initialize_embedding_model"
         ) as mock_init_embedding:
             # Setup to raise exceptions
-            mock_init_llm.return_value = MagicMock(side_effect=Exception("LLM error"))
+            mock_init_llm.return_value = MagicMock(
+                stream=MagicMock(side_effect=Exception("LLM error"))
+            )
             mock_init_embedding.return_value = MagicMock(
                 embed_documents=MagicMock(side_effect=Exception("Embedding error"))
             )
@@ -88,7 +180,57 @@ def test_error_handling():
             )
             assert "I'm sorry, I encountered an error" in response
 
-            # Test embedding generation error handling
-            embeddings = service.generate_embeddings(["test text"])
-            assert len(embeddings) == 1
-            assert len(embeddings[0]) == VECTOR_DIMS  # Should return fallback embedding
+            # Embedding errors are raised, never returned as placeholder vectors
+            with pytest.raises(Exception, match="Embedding error"):
+                service.generate_embeddings(["test text"])
+
+
+def test_embeddings_are_normalized_float32():
+    """Test that embeddings come back as a unit length float32 matrix"""
+    mock_embedding_model = MagicMock()
+    mock_embedding_model.embed_documents.return_value = [
+        [3.0, 4.0] + [0.0] * (VECTOR_DIMS - 2),
+        [0.0] * VECTOR_DIMS,
+    ]
+
+    with patch.object(LLMService, "_initialize_llm"):
+        with patch.object(
+            LLMService, "_initialize_embedding_model", return_value=mock_embedding_model
+        ):
+            service = LLMService()
+            embeddings = service.generate_embeddings(["text", "empty"])
+
+    assert embeddings.dtype == np.float32
+    assert embeddings.shape == (2, VECTOR_DIMS)
+    np.testing.assert_allclose(embeddings[0][:2], [0.6, 0.8], rtol=1e-6)
+    assert not embeddings[1].any()
+
+
+def test_context_cache_created_once():
+    """
+    Test that concurrent requests for a prompt create a single cache, and
+    that TTLs within the refresh margin are raised.
+    """
+    started = threading.Event()
+    release = threading.Event()
+
+    def create(prompt, ttl):
+        started.set()
+        release.wait(5)
+        return "cachedContents/overview"
+
+    create_mock = MagicMock(side_effect=create)
+    cache = ContextCache(create_mock, lambda text: 100, ttl=30, min_tokens=10)
+    assert cache.ttl == 2 * REFRESH_MARGIN
+
+    with ThreadPoolExecutor(4) as pool:
+        results = [pool.submit(cache.get, "prompt") for _ in range(4)]
+        started.wait(5)
+        release.set()
+        assert [result.result() for result in results] == [
+            "cachedContents/overview"
+        ] * 4
+
+    assert create_mock.call_count == 1
+    assert cache.get("prompt") == "cachedContents/overview"
+    assert create_mock.call_count == 1
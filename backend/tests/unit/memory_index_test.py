@@ -0,0 +1,135 @@
+import numpy as np
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+# Import after setting env vars
+from src.vectors.flat_index import ProjectIndex
+from src.vectors.memory_index import MemoryIndex
+from src.vectors.scope import SearchScope
+from src.vectors.vector_store import VectorStore
+
+
+def make_index(version=3):
+    matrix = np.array([[1.0, 0.0], [0.0, 1.0], [0.6, 0.8]], dtype=np.float32)
+    return ProjectIndex(
+        project_id=1,
+        version=version,
+        ids=np.array([10, 11, 12]),
+        matrix=matrix,
+        norms=np.linalg.norm(matrix, axis=1),
+        chunks=[
+            ["a = 1", 1, 1, "src/a.py", "python"],
+            ["b = 2", 1, 1, "src/b.py", "python"],
+            ["c = 3", 1, 1, "src/c.py", "python"],
+        ],
+    )
+
+
+def test_project_index_search():
+    """
+    Test that searches return the nearest chunks first for every metric.
+    """
+    index = make_index()
+
+    for metric in ("cosine", "l2", "inner_product"):
+        rows = index.search(np.array([0.0, 1.0]), 2, metric)
+        assert [row.id for row in rows] == [11, 12]
+        assert rows[0].file_path == "src/b.py"
+
+
+def test_snapshot_round_trip(tmp_path):
+    """
+    Test that snapshots are memory-mapped back when the project's chunks
+    have not changed since, and ignored once they have.
+    """
+    memory_index = MemoryIndex(["test-project"], snapshot_dir=str(tmp_path))
+    memory_index._save_snapshot("test-project", make_index())
+
+    db = MagicMock()
+    project = SimpleNamespace(
+        id=1,
+        chunks_version=3,
+        embedding_dim=2,
+        embedding_version_id=None,
+        chunk_count=3,
+        path="/repo",
+    )
+    db.query.return_value.filter.return_value.first.return_value = project
+
+    loaded = memory_index._load_snapshot(db, "test-project")
+    assert isinstance(loaded.matrix, np.memmap)
+    assert [row.id for row in loaded.search(np.array([1.0, 0.0]), 1, "cosine")] == [10]
+
+    project.chunks_version = 4
+    assert memory_index._load_snapshot(db, "test-project") is None
+
+
+def test_search_vectors_uses_memory_index():
+    """
+    Test that loaded projects are searched in memory, and that changed
+    projects fall back to Postgres until they are reloaded.
+    """
+    memory_index = MemoryIndex(["test-project"])
+    memory_index._indexes["test-project"] = make_index()
+    vector_store = VectorStore(MagicMock(), memory_index)
+
+    db = MagicMock()
+    chunks, files = vector_store.search_vectors(db, "test-project", [0.0, 1.0], 1)
+    assert chunks[0]["id"] == 11
+    assert files == [{"project_name": "test-project", "file_path": "src/b.py"}]
+    db.execute.assert_not_called()
+
+    memory_index.mark_stale(1)
+    db.query.return_value.filter.return_value.first.return_value = None
+    assert vector_store.search_vectors(db, "test-project", [0.0, 1.0], 1) == ([], [])
+    db.query.assert_called_once()
+
+
+def test_project_index_scope():
+    """
+    Test that in-memory searches only return chunks of the files,
+    directories and languages in scope.
+    """
+    index = make_index()
+    index.chunks[2][3] = "lib/c.lua"
+    index.chunks[2][4] = "lua"
+    index = ProjectIndex(1, 3, index.ids, index.matrix, index.norms, index.chunks)
+
+    query = np.array([0.6, 0.8])
+    assert [row.id for row in index.search(query, 3, "cosine")] == [12, 11, 10]
+
+    rows = index.search(query, 3, "cosine", SearchScope(["src"]))
+    assert [row.id for row in rows] == [11, 10]
+    assert rows[0].distance < rows[1].distance
+
+    rows = index.search(query, 3, "cosine", SearchScope(["src/a.py", "lib"]))
+    assert [row.id for row in rows] == [12, 10]
+
+    assert index.search(query, 3, "cosine", SearchScope(languages=["go"])) == []
+
+
+def test_projects_indexed_after_startup_are_loaded():
+    """
+    Test that changes to a configured project that wasn't loaded, such as
+    one indexed after startup, schedule its load, and that other projects'
+    changes are looked up once and ignored.
+    """
+    memory_index = MemoryIndex(["test-project"], reload_delay=0)
+
+    db = MagicMock()
+    db.query.return_value.filter.return_value.scalar.side_effect = [
+        "test-project",
+        "other-project",
+    ]
+    with patch("src.vectors.memory_index.get_db") as get_db:
+        get_db.return_value.__enter__.return_value = db
+        memory_index.mark_stale(1)
+        memory_index.mark_stale(2)
+        memory_index.mark_stale(2)
+
+    assert list(memory_index._stale) == ["test-project"]
+    assert db.query.call_count == 2
+
+    with patch.object(memory_index, "load") as load:
+        memory_index._reload_due()
+    load.assert_called_once_with("test-project")
@@ -0,0 +1,73 @@
+from src.vectors.symbols import SymbolIndex, extract_symbols
+
+
+def definitions(content, language):
+    return [
+        (symbol["name"], symbol["kind"], symbol["line"])
+        for symbol in extract_symbols(content, language)
+        if symbol["definition"]
+    ]
+
+
+def test_extract_python_symbols():
+    """Test that Python definitions are parsed and references recorded once"""
+    content = (
+        "TIMEOUT = 5\n"
+        "\n"
+        "class CodebaseIndexer:\n"
+        "    def index_codebase(self):\n"
+        "        return chunk_file(TIMEOUT)\n"
+        "\n"
+        "async def chunk_file(size):\n"
+        "    return size\n"
+    )
+
+    assert definitions(content, "python") == [
+        ("CodebaseIndexer", "class", 3),
+        ("index_codebase", "method", 4),
+        ("chunk_file", "function", 7),
+        ("TIMEOUT", "variable", 1),
+    ]
+
+    references = [
+        (symbol["name"], symbol["line"])
+        for symbol in extract_symbols(content, "python")
+        if not symbol["definition"]
+    ]
+    assert ("chunk_file", 5) in references
+    assert ("TIMEOUT", 1) in references
+    # Keywords and short names aren't symbols
+    assert not {"def", "return", "self"} & {name for name, _ in references}
+
+
+def test_extract_pattern_symbols():
+    """Test definitions of languages matched by patterns"""
+    lua = (
+        "local M = {}\n\nfunction M.ask(question)\nend\n\nlocal function send()\nend\n"
+    )
+    assert definitions(lua, "lua") == [("ask", "function", 3), ("send", "function", 6)]
+
+    go = "type Server struct {}\n\nfunc (s *Server) Serve() error {\n}\n"
+    assert definitions(go, "go") == [("Server", "type", 1), ("Serve", "function", 3)]
+
+    typescript = "export interface Options {}\nexport const run = async () => {}\n"
+    assert definitions(typescript, "typescript") == [
+        ("Options", "type", 1),
+        ("run", "function", 2),
+    ]
+
+    # Unparseable Python falls back to the patterns
+    assert definitions("def broken(:\n", "python") == [("broken", "function", 1)]
+
+
+def test_mentions():
+    """Test which names of a question are looked up"""
+    index = SymbolIndex()
+
+    assert index.mentions("Where is CodebaseIndexer defined?") == ["CodebaseIndexer"]
+    assert index.mentions("What does `build_prompt` do with self.symbol_index?") == [
+        "build_prompt",
+        "symbol_index",
+    ]
+    assert index.mentions("How does search() work?") == ["search"]
+    assert index.mentions("How does indexing work?") == []
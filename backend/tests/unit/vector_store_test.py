@@ -0,0 +1,133 @@
+import numpy as np
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from sqlalchemy.dialects import postgresql
+
+# Import after setting env vars
+from src.vectors.scope import SearchScope
+from src.vectors.vector_store import VectorStore
+
+
+def test_search_vectors_sets_ef_search():
+    """
+    Test that searches set the HNSW candidate list size for their
+    transaction and rank chunks by the configured distance metric.
+    """
+    db = MagicMock()
+    db.query.return_value.filter.return_value.first.return_value = SimpleNamespace(
+        id=1, embedding_dim=2, embedding_version_id=None
+    )
+    db.execute.return_value.fetchall.return_value = [
+        SimpleNamespace(
+            id=7,
+            content="def main(): pass",
+            start_line=1,
+            end_line=1,
+            file_path="src/main.py",
+            language="python",
+            distance=0.1,
+        )
+    ]
+
+    vector_store = VectorStore(MagicMock())
+    chunks, files = vector_store.search_vectors(
+        db, "test-project", [0.1, 0.2], limit=3, ef_search=80
+    )
+
+    set_statement, search_statement = [
+        call.args[0] for call in db.execute.call_args_list
+    ]
+    assert str(set_statement) == "SET LOCAL hnsw.ef_search = 80"
+    sql = str(search_statement.compile(dialect=postgresql.dialect()))
+    assert "CAST(code_chunks.embedding AS VECTOR(2)) <=>" in sql
+    assert "vector_dims(code_chunks.embedding)" in sql
+
+    assert chunks[0]["id"] == 7
+    assert files == [{"project_name": "test-project", "file_path": "src/main.py"}]
+
+
+def test_binary_search_reranks_candidates():
+    """
+    Test that binary quantized searches fetch extra candidates by hamming
+    distance and rank them by full precision distance, with the query
+    zero-padded to the project's dimensions.
+    """
+    db = MagicMock()
+    db.query.return_value.filter.return_value.first.return_value = SimpleNamespace(
+        id=1, embedding_dim=4, embedding_version_id=None
+    )
+    db.execute.return_value.fetchall.return_value = []
+
+    vector_store = VectorStore(MagicMock())
+    with patch("src.database.backends.VECTOR_INDEX_PRECISION", "binary"):
+        vector_store.search_vectors(db, "test-project", [0.1, 0.2], limit=3)
+
+    search_statement = db.execute.call_args.args[0]
+    compiled = search_statement.compile(dialect=postgresql.dialect())
+    sql = str(compiled)
+    assert "CAST(binary_quantize(code_chunks.embedding) AS BIT(4)) <~>" in sql
+    assert "ORDER BY code_chunks.embedding <=>" in sql
+    assert compiled.params["param_2"] == 12
+    np.testing.assert_allclose(compiled.params["embedding_1"], [0.1, 0.2, 0.0, 0.0])
+
+
+def test_store_code_chunks_without_embeddings():
+    """
+    Test that chunks are stored pending an embedding, not with placeholder
+    vectors, when the embedding provider fails.
+    """
+    db = MagicMock()
+    db.execute.return_value.one.return_value = SimpleNamespace(
+        chunk_count=None,
+        byte_count=None,
+        token_count=None,
+        embedding_model="test-model",
+        embedding_dim=2,
+        embedding_version_id=None,
+    )
+    llm_service = MagicMock()
+    llm_service.generate_embeddings.side_effect = Exception("rate limited")
+
+    vector_store = VectorStore(llm_service)
+    chunks = [{"start_line": 1, "end_line": 1, "content": "x = 1", "token_count": 4}]
+    with patch.object(vector_store.backend, "write_chunks") as write_chunks:
+        vector_store.store_code_chunks(db, 1, 2, "src/x.py", chunks, 5)
+
+    write_chunks.assert_called_once_with(db, 1, 2, chunks, None, None)
+    db.commit.assert_called_once()
+
+
+def test_scoped_search_filters_during_index_scan():
+    """
+    Test that scopes are applied as a filter on the chunks themselves, with
+    an iterative index scan, and that absolute paths are made relative to
+    the project root.
+    """
+    db = MagicMock()
+    db.query.return_value.filter.return_value.first.return_value = SimpleNamespace(
+        id=1, embedding_dim=2, embedding_version_id=None, path="/repo"
+    )
+    db.execute.return_value.fetchall.return_value = []
+
+    vector_store = VectorStore(MagicMock())
+    scope = SearchScope(["/repo/src/", "/elsewhere/lib"], ["Python"])
+    vector_store.search_vectors(db, "test-project", [0.1, 0.2], limit=3, scope=scope)
+
+    statements = [call.args[0] for call in db.execute.call_args_list]
+    assert str(statements[0]) == "SET LOCAL hnsw.iterative_scan = strict_order"
+    compiled = statements[-1].compile(dialect=postgresql.dialect())
+    sql = str(compiled)
+    assert "code_chunks.file_id IN (SELECT code_files.id" in sql
+    assert "code_files.file_path LIKE" in sql
+    params = [
+        value for value in compiled.params.values() if not isinstance(value, np.ndarray)
+    ]
+    assert ["src"] in params
+    assert ["python"] in params
+
+    # Only absolute paths outside the project: nothing to search
+    db.execute.reset_mock()
+    vector_store.search_vectors(
+        db, "test-project", [0.1, 0.2], scope=SearchScope(["/elsewhere"])
+    )
+    db.execute.assert_not_called()
@@ -0,0 +1,78 @@
+import os
+
+from src.vectors.walker import IgnoreRules, walk_files
+
+
+def write(root, rel_path, content=""):
+    path = os.path.join(root, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def walk(root, **kwargs):
+    return sorted(
+        os.path.relpath(path, root)
+        for path, _ in walk_files(
+            str(root), [".py", ".d.ts"], ["node_modules"], **kwargs
+        )
+    )
+
+
+def test_ignore_rules():
+    """Test gitignore pattern semantics"""
+    rules = IgnoreRules(
+        "",
+        [
+            "# comment",
+            "*.log",
+            "/build",
+            "docs/**/gen",
+            "cache/",
+            "secret?.py",
+            "!keep.log",
+        ],
+    )
+
+    assert rules.match("app.log", False) is True
+    assert rules.match("src/app.log", False) is True
+    assert rules.match("src/keep.log", False) is False
+    assert rules.match("build", True) is True
+    assert rules.match("src/build", True) is None
+    assert rules.match("docs/gen", True) is True
+    assert rules.match("docs/a/b/gen", True) is True
+    assert rules.match("cache", True) is True
+    assert rules.match("cache", False) is None
+    assert rules.match("secret1.py", False) is True
+    assert rules.match("src/main.py", False) is None
+
+    # Rules of nested ignore files are relative to their directory
+    nested = IgnoreRules("src", ["/generated.py"])
+    assert nested.match("src/generated.py", False) is True
+    assert nested.match("src/lib/generated.py", False) is None
+
+
+def test_walk_files(tmp_path):
+    """Test that walks skip excluded, ignored and other files"""
+    write(tmp_path, ".gitignore", "dist/\n*_pb2.py\n")
+    write(tmp_path, "src/main.py")
+    write(tmp_path, "src/types.d.ts")
+    write(tmp_path, "src/api_pb2.py")
+    write(tmp_path, "src/readme.md")
+    write(tmp_path, "src/.ignore", "local.py\n")
+    write(tmp_path, "src/local.py")
+    write(tmp_path, "dist/bundle.py")
+    write(tmp_path, "node_modules/lib/index.py")
+
+    assert walk(tmp_path) == ["src/main.py", "src/types.d.ts"]
+    assert walk(tmp_path, use_ignore_files=False) == [
+        "dist/bundle.py",
+        "src/api_pb2.py",
+        "src/local.py",
+        "src/main.py",
+        "src/types.d.ts",
+    ]
+
+    # Stat results come with the files
+    path, stat = next(walk_files(str(tmp_path / "src"), [".py"], [], False))
+    assert stat.st_size == os.stat(path).st_size
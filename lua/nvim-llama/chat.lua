@@ -0,0 +1,203 @@
+local window = require("nvim-llama.window")
+local client = require("nvim-llama.client")
+local settings = require("nvim-llama.settings")
+
+-- Chat with the indexed codebase through the backend, in a buffer the
+-- response is streamed into as it is generated.
+local M = {}
+
+local state = {
+    buf = nil,
+    -- Backend session keeping the conversation
+    session_id = nil,
+    -- Request currently streaming, if any
+    request = nil,
+}
+
+local function notify(message, level)
+    vim.notify("nvim-llama: " .. message, level or vim.log.levels.INFO)
+end
+
+-- Append text to the end of the chat buffer, continuing its last line
+local function append(text)
+    local buf = state.buf
+    if not buf or not vim.api.nvim_buf_is_valid(buf) then
+        return
+    end
+
+    local last = vim.api.nvim_buf_line_count(buf) - 1
+
+    -- Windows with the cursor on the last line follow the response
+    local following = {}
+    for _, win in ipairs(vim.fn.win_findbuf(buf)) do
+        if vim.api.nvim_win_get_cursor(win)[1] > last then
+            table.insert(following, win)
+        end
+    end
+
+    local current = vim.api.nvim_buf_get_lines(buf, last, last + 1, false)[1] or ""
+    local lines = vim.split(current .. text, "\n", { plain = true })
+    vim.api.nvim_buf_set_lines(buf, last, last + 1, false, lines)
+
+    for _, win in ipairs(following) do
+        vim.api.nvim_win_set_cursor(win, { vim.api.nvim_buf_line_count(buf), 0 })
+    end
+end
+
+local function open_buffer()
+    if state.buf and vim.api.nvim_buf_is_valid(state.buf) then
+        if #vim.fn.win_findbuf(state.buf) == 0 then
+            vim.cmd("vsplit")
+            vim.cmd("vertical resize 80")
+            vim.api.nvim_win_set_buf(0, state.buf)
+        end
+        return
+    end
+
+    state.buf = window.create_chat_window()
+    vim.api.nvim_buf_set_name(state.buf, "nvim-llama://chat")
+    vim.api.nvim_buf_set_option(state.buf, "filetype", "markdown")
+    vim.keymap.set("n", "<C-c>", M.cancel, { buffer = state.buf, desc = "Cancel the response" })
+end
+
+local function on_event(event)
+    if event.type == "token" then
+        append(event.content)
+    elseif event.type == "context" and event.context_files and #event.context_files > 0 then
+        local paths = {}
+        for _, file in ipairs(event.context_files) do
+            table.insert(paths, file.file_path)
+        end
+        append("_Context: " .. table.concat(paths, ", ") .. "_\n\n")
+    elseif event.type == "error" then
+        append("\n\n**Error:** " .. event.message)
+    end
+end
+
+-- Modified buffers of files in the project, so answers see unsaved edits
+local function unsaved_buffers(root)
+    local buffers = {}
+    if not settings.current.send_unsaved_buffers then
+        return buffers
+    end
+
+    root = vim.fn.fnamemodify(root, ":p")
+    for _, buf in ipairs(vim.api.nvim_list_bufs()) do
+        local path = vim.api.nvim_buf_get_name(buf)
+        if vim.api.nvim_buf_is_loaded(buf)
+            and vim.api.nvim_buf_get_option(buf, "buftype") == ""
+            and vim.api.nvim_buf_get_option(buf, "modified")
+            and path ~= ""
+            and vim.startswith(path, root)
+        then
+            local lines = vim.api.nvim_buf_get_lines(buf, 0, -1, false)
+            table.insert(buffers, { file_path = path, content = table.concat(lines, "\n") })
+        end
+    end
+    return buffers
+end
+
+local function send(question)
+    local name, path = client.project()
+    local request = {
+        project_name = name,
+        query = question,
+        session_id = state.session_id,
+        buffers = unsaved_buffers(path),
+    }
+
+    -- Output still arriving after a cancel is dropped
+    local current
+    current = client.stream_chat(request, function(event)
+        if state.request == current then
+            on_event(event)
+        end
+    end, function(err)
+        if state.request ~= current then
+            return
+        end
+
+        state.request = nil
+        if err then
+            append("\n\n**Error:** " .. err)
+        end
+        append("\n")
+    end)
+    state.request = current
+end
+
+function M.ask(question)
+    if state.request then
+        notify("A response is still streaming, cancel it with :LlamaCancel", vim.log.levels.WARN)
+        return
+    end
+
+    open_buffer()
+    append("\n## " .. question .. "\n\n")
+
+    if state.session_id then
+        send(question)
+        return
+    end
+
+    -- The conversation is kept by the backend from the first question on
+    local creating = { cancel = function() end }
+    state.request = creating
+    client.create_session(function(ok, response)
+        if ok then
+            state.session_id = response.id
+        end
+
+        -- Cancelled while the session was created
+        if state.request ~= creating then
+            return
+        end
+        state.request = nil
+
+        if not ok then
+            append("**Error:** " .. response .. "\n")
+            return
+        end
+
+        send(question)
+    end)
+end
+
+function M.cancel()
+    if not state.request then
+        return
+    end
+
+    state.request.cancel()
+    state.request = nil
+    append("\n\n_Cancelled_\n")
+end
+
+-- Forget the conversation, the next question starts a new one
+function M.reset()
+    M.cancel()
+    state.session_id = nil
+end
+
+function M.index()
+    local last_status
+    client.index_project(function(ok, response)
+        if not ok then
+            notify(response, vim.log.levels.ERROR)
+            return
+        end
+
+        if response.status == last_status then
+            return
+        end
+        last_status = response.status
+
+        if response.status == "failed" then
+            notify("Indexing failed: " .. tostring(response.error), vim.log.levels.ERROR)
+        else
+            notify("Indexing " .. response.project_name .. ": " .. response.status)
+        end
+    end)
+end
+
+return M
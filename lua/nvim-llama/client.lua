@@ -0,0 +1,170 @@
+local job = require('nvim-llama.job')
+local settings = require('nvim-llama.settings')
+
+-- Client of the nvim-llama backend API. Requests are made by curl processes
+-- spawned through libuv, so the editor never waits on the network.
+local M = {}
+
+local function url(path)
+    return settings.current.backend_url:gsub("/+$", "") .. path
+end
+
+-- Error details of the API are strings, or lists for invalid requests
+local function describe(detail)
+    if type(detail) == "string" then
+        return detail
+    end
+    return vim.inspect(detail)
+end
+
+-- Arguments of a curl request, and the JSON body to write to its stdin.
+-- Bodies holding buffer contents can be larger than a single argument may
+-- be (128 KiB on Linux).
+local function curl_args(method, path, body)
+    local args = { "--silent", "--show-error", "--no-buffer", "-X", method }
+    local data
+
+    if body ~= nil then
+        table.insert(args, "-H")
+        table.insert(args, "Content-Type: application/json")
+        table.insert(args, "--data-binary")
+        table.insert(args, "@-")
+        data = vim.json.encode(body)
+    end
+
+    table.insert(args, url(path))
+    return args, data
+end
+
+-- Make a JSON request. The callback gets true and the decoded response, or
+-- false and an error message.
+function M.request(method, path, body, callback)
+    local args, data = curl_args(method, path, body)
+    -- The status code is written after the response body
+    table.insert(args, 1, "--write-out")
+    table.insert(args, 2, "\n%{http_code}")
+
+    return job.start("curl", args, {
+        stdin = data,
+        on_exit = function(code, output)
+            if code ~= 0 then
+                callback(false, "Backend request failed: " .. vim.trim(output))
+                return
+            end
+
+            local response, status = output:match("^(.*)\n(%d+)$")
+            local ok, decoded = pcall(vim.json.decode, response or "")
+            if not ok then
+                decoded = response
+            end
+
+            if not status or tonumber(status) >= 400 then
+                local detail = type(decoded) == "table" and decoded.detail or decoded
+                callback(false, string.format("Backend returned %s: %s", status, describe(detail)))
+                return
+            end
+
+            callback(true, decoded)
+        end,
+    })
+end
+
+-- The name and root of the project being edited
+function M.project()
+    local path = settings.current.project_path or vim.fn.getcwd()
+    local name = settings.current.project_name or vim.fn.fnamemodify(path, ":t")
+    return name, path
+end
+
+function M.create_session(callback)
+    local name = M.project()
+    return M.request("POST", "/sessions", { project_name = name }, callback)
+end
+
+-- Stream a chat response. on_event is called with each event of the
+-- response as it arrives: "context", "token" with content, then "done",
+-- or "error" with a message. on_exit is called once the request ends, with
+-- an error message if it failed.
+--
+-- Returns an object whose cancel() stops the request.
+function M.stream_chat(request, on_event, on_exit)
+    local partial = ""
+    local finished = false
+
+    local function on_stdout(data)
+        -- Events are lines of JSON, which may arrive split
+        partial = partial .. data
+        while true do
+            local line, rest = partial:match("^([^\n]*)\n(.*)$")
+            if not line then
+                break
+            end
+            partial = rest
+
+            local ok, event = pcall(vim.json.decode, line)
+            if ok and type(event) == "table" and event.type then
+                if event.type == "done" or event.type == "error" then
+                    finished = true
+                end
+                on_event(event)
+            elseif line ~= "" then
+                -- An error response from the API rather than an event
+                local detail = ok and type(event) == "table" and event.detail
+                finished = true
+                on_event({ type = "error", message = describe(detail or line) })
+            end
+        end
+    end
+
+    local args, data = curl_args("POST", "/chat/stream", request)
+    return job.start("curl", args, {
+        stdin = data,
+        on_stdout = on_stdout,
+        on_exit = function(code, output)
+            if partial ~= "" then
+                on_stdout("\n")
+            end
+
+            if code ~= 0 and not finished then
+                on_exit("Backend request failed: " .. vim.trim(output))
+            else
+                on_exit(nil)
+            end
+        end,
+    })
+end
+
+local function poll_job(job_id, on_update)
+    M.request("GET", "/jobs/" .. job_id, nil, function(ok, response)
+        if not ok then
+            on_update(false, response)
+            return
+        end
+
+        on_update(true, response)
+        if response.status == "pending" or response.status == "running" then
+            vim.defer_fn(function()
+                poll_job(job_id, on_update)
+            end, settings.current.index_poll_interval)
+        end
+    end)
+end
+
+-- Queue the project for indexing and poll the job until it finishes.
+-- on_update is called with true and the job after each poll, or with false
+-- and an error message.
+function M.index_project(on_update)
+    local name, path = M.project()
+    local body = { project_name = name, project_path = path }
+
+    M.request("POST", "/index_codebase", body, function(ok, response)
+        if not ok then
+            on_update(false, response)
+            return
+        end
+
+        poll_job(response.job_id, on_update)
+    end)
+end
+
+return M
@@ -1,14 +1,56 @@
 local window = require("nvim-llama.window")
 local settings = require("nvim-llama.settings")
 local ollama = require('nvim-llama.ollama')
+local job = require('nvim-llama.job')
+local chat = require('nvim-llama.chat')
 
 local M = {}
 
+-- Result of the Docker and container checks, made once per session:
+-- "pending" while they run, then "ready" or "error"
+local status = { state = nil, message = nil, started = nil }
+
+-- Called once the checks finish
+local waiting = {}
+
+local function notify(message, level)
+    vim.notify("nvim-llama: " .. message, level or vim.log.levels.INFO)
+end
+
+local function debug(message)
+    if settings.current.debug then
+        notify(message, vim.log.levels.DEBUG)
+    end
+end
+
+local function elapsed_ms(start)
+    return (vim.loop.hrtime() - start) / 1e6
+end
+
+local function when_ready(callback)
+    if status.state == "pending" then
+        table.insert(waiting, callback)
+    else
+        callback()
+    end
+end
+
 M.interactive_llama = function()
-    local command = ollama.run(settings.current.model)
+    if status.state == "pending" then
+        notify("Waiting for the Ollama container to start...")
+    end
+
+    when_ready(function()
+        if status.state == "error" then
+            notify(status.message, vim.log.levels.ERROR)
+            return
+        end
+
+        local command = ollama.run(settings.current.model)
 
-    window.create_chat_window()
-    vim.fn.termopen(command)
+        window.create_chat_window()
+        vim.fn.termopen(command)
+    end)
 end
 
 local function trim(s)
@@ -19,96 +61,123 @@ local function set_commands()
     vim.api.nvim_create_user_command("Llama", function()
         M.interactive_llama()
     end, {})
-end
-
-local function is_docker_installed()
-    local handle = io.popen("docker --version 2>&1")
-    local result = handle:read("*a")
-    handle:close()
 
-    return result:match("Docker version")
+    -- Codebase-aware chat through the backend
+    vim.api.nvim_create_user_command("LlamaChat", function(opts)
+        chat.ask(opts.args)
+    end, { nargs = "+" })
+    vim.api.nvim_create_user_command("LlamaCancel", function()
+        chat.cancel()
+    end, {})
+    vim.api.nvim_create_user_command("LlamaReset", function()
+        chat.reset()
+    end, {})
+    vim.api.nvim_create_user_command("LlamaIndex", function()
+        chat.index()
+    end, {})
 end
 
-local function is_docker_running()
-    local handle = io.popen("docker info > /dev/null 2>&1; echo $?")
-    local result = handle:read("*a")
-    handle:close()
+local function check_docker(callback)
+    job.run("docker", { "--version" }, function(code, output)
+        if code ~= 0 or not output:match("Docker version") then
+            callback(false, "Docker is not installed. Docker is required for nvim-llama")
+            return
+        end
 
-    return result:match("0\n")
-end
+        job.run("docker", { "info" }, function(info_code)
+            if info_code ~= 0 then
+                callback(false, "Docker is not running.")
+                return
+            end
 
-local function check_docker()
-    if not is_docker_installed() then
-        error("Docker is not installed. Docker is required for nvim-llama")
-        return false
-    end
+            callback(true)
+        end)
+    end)
+end
 
-    if not is_docker_running() then
-        error("Docker is not running. ")
-        return false
-    end
+local function check_ollama_container(callback)
+    local container_name = "nvim-llama"
 
-    return true
-end
+    -- One call tells both whether the container exists and whether it runs
+    local args = {
+        "ps", "-a",
+        "--filter", "name=^/" .. container_name .. "$",
+        "--format", "{{.State}}",
+    }
+
+    job.run("docker", args, function(code, output)
+        if code ~= 0 then
+            callback(false, "Error checking docker status: " .. output)
+            return
+        end
 
-local function async(command, args, callback)
-    vim.loop.spawn(command, {args = args}, function(code)
-        if code == 0 then
+        local state = trim(output)
+        if state == "running" then
             callback(true)
+        elseif state == "" then
+            -- start a new container as non by name exists
+            notify("Starting the Ollama container...")
+            ollama.start(callback)
         else
-            callback(false)
+            -- Remove the stopped container and re-run a new one
+            job.run("docker", { "rm", container_name }, function()
+                notify("Starting the Ollama container...")
+                ollama.start(callback)
+            end)
         end
     end)
 end
 
-local function is_container_running()
-    local command = string.format("docker ps --filter 'name=^/nvim-llama$' --format '{{.Names}}'")
-    local handle = io.popen(command)
-    local result = trim(handle:read("*a"))
-    handle:close()
+local function finish_checks(ok, message)
+    status.state = ok and "ready" or "error"
+    status.message = message
+    debug(string.format("Docker checks finished in %.1f ms", elapsed_ms(status.started)))
+
+    if not ok then
+        notify(message, vim.log.levels.ERROR)
+    end
 
-    return result == "nvim-llama"
+    local callbacks = waiting
+    waiting = {}
+    for _, callback in ipairs(callbacks) do
+        callback()
+    end
 end
 
-local function check_ollama_container()
-    local container_name = "nvim-llama"
+-- Checks run in the background, and only on the first setup of a session
+local function run_checks()
+    if status.state ~= nil then
+        return
+    end
 
-    local exists_command = string.format("docker ps -a --filter 'name=^/nvim-llama$' --format '{{.Names}}'")
-    local exists_handle = io.popen(exists_command)
-    local exists_result = trim(exists_handle:read("*a"))
-    exists_handle:close()
+    status.state = "pending"
+    status.started = vim.loop.hrtime()
 
-    if exists_result == "nvim-llama" then
-        if not is_container_running() then
-            -- Remove the stopped container and re-run a new one
-            local handle = io.popen("docker rm " .. container_name)
-            handle:close()
-            ollama.start()
+    check_docker(function(ok, err)
+        if not ok then
+            finish_checks(false, err)
+            return
         end
-    else
-        -- start a new container as non by name exists
-        ollama.start()
-    end
 
-    return true
+        check_ollama_container(finish_checks)
+    end)
+end
+
+function M.status()
+    return status.state, status.message
 end
 
 function M.setup(config)
+    local start = vim.loop.hrtime()
+
     if config then
         settings.set(config)
     end
 
-    local status, err = pcall(check_docker)
-    if not status then
-        print("Error checking docker status: " .. err)
-    end
-
-    status, err = pcall(check_ollama_container)
-    if not status then
-        print("Error checking docker status: " .. err)
-    end
-
+    run_checks()
     set_commands()
+
+    debug(string.format("setup took %.1f ms", elapsed_ms(start)))
 end
 
 return M
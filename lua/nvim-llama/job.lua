@@ -0,0 +1,104 @@
+local M = {}
+
+-- Start a command in the background without blocking the editor.
+--
+-- opts.stdin, if given, is written to the command's standard input, which
+-- is then closed. opts.on_stdout, if given, is called with each piece of
+-- output as it arrives. opts.on_exit is called with the exit code and the
+-- rest of the output (stderr, and stdout when on_stdout isn't given). Both
+-- are called on the main loop so they can use the Neovim API. A command
+-- that can't be started exits with -1 and the error as output.
+--
+-- Returns an object whose cancel() stops the command.
+function M.start(command, args, opts)
+    local stdin = opts.stdin and vim.loop.new_pipe(false)
+    local stdout = vim.loop.new_pipe(false)
+    local stderr = vim.loop.new_pipe(false)
+    local output = {}
+    local exit_code
+    local handle
+
+    -- The exit and the end of both outputs can arrive in any order
+    local pending = 3
+    local function finish()
+        pending = pending - 1
+        if pending > 0 then
+            return
+        end
+
+        handle:close()
+        if opts.on_exit then
+            vim.schedule(function()
+                opts.on_exit(exit_code, table.concat(output))
+            end)
+        end
+    end
+
+    local function read(pipe, on_data)
+        pipe:read_start(function(_, data)
+            if data then
+                on_data(data)
+            else
+                pipe:close()
+                finish()
+            end
+        end)
+    end
+
+    local function collect(data)
+        table.insert(output, data)
+    end
+
+    local err
+    handle, err = vim.loop.spawn(command, {
+        args = args,
+        stdio = { stdin, stdout, stderr },
+    }, function(code)
+        exit_code = code
+        finish()
+    end)
+
+    if not handle then
+        if stdin then
+            stdin:close()
+        end
+        stdout:close()
+        stderr:close()
+        if opts.on_exit then
+            vim.schedule(function()
+                opts.on_exit(-1, err or "")
+            end)
+        end
+        return { cancel = function() end }
+    end
+
+    if opts.on_stdout then
+        read(stdout, vim.schedule_wrap(opts.on_stdout))
+    else
+        read(stdout, collect)
+    end
+    read(stderr, collect)
+
+    if stdin then
+        stdin:write(opts.stdin)
+        stdin:shutdown(function()
+            stdin:close()
+        end)
+    end
+
+    return {
+        cancel = function()
+            if not handle:is_closing() then
+                handle:kill("sigterm")
+            end
+        end,
+    }
+end
+
+-- Run a command in the background, and call back with its exit code and
+-- output (stdout and stderr) once it exits.
+function M.run(command, args, callback)
+    return M.start(command, args, { on_exit = callback })
+end
+
+return M
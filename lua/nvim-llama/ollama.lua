@@ -1,4 +1,5 @@
 local os = require('os')
+local job = require('nvim-llama.job')
 local home = os.getenv('HOME')
 
 -- Check if a file or directory exists at a given path
@@ -22,34 +23,41 @@ function M.prepare()
     local ollama_dir = home .. '/.ollama'
     local ok, err = dir_exists(ollama_dir)
     if not ok then
-        os.execute('mkdir ' .. ollama_dir)
+        vim.fn.mkdir(ollama_dir, 'p')
         print('Created .ollama directory at ' .. ollama_dir)
     end
 end
 
-function M.restart()
+function M.restart(callback)
     M.prepare()
-    local restart_command = "docker restart nvim-llama"
+    job.run("docker", { "restart", "nvim-llama" }, function(code, output)
+        if code ~= 0 then
+            callback(false, "Failed to restart Ollama container: " .. output)
+            return
+        end
 
-    local handle, err = io.popen(restart_command)
-    local result = handle:read("*a")
-    handle:close()
-
-    if err then
-        error("Failed to restart Ollama container: " .. err)
-    end
+        callback(true)
+    end)
 end
 
-function M.start()
+function M.start(callback)
     M.prepare()
-    local start_command = "docker run -d -p 11434:11434 -v " .. home .. "/.ollama:/root/.ollama --name nvim-llama ollama/ollama"
-    local handle, err = io.popen(start_command)
-    local result = handle:read("*a")
-    handle:close()
+    local args = {
+        "run", "-d",
+        "-p", "11434:11434",
+        "-v", home .. "/.ollama:/root/.ollama",
+        "--name", "nvim-llama",
+        "ollama/ollama",
+    }
 
-    if err then
-        error("Failed to start Ollama container: " .. err)
-    end
+    job.run("docker", args, function(code, output)
+        if code ~= 0 then
+            callback(false, "Failed to start Ollama container: " .. output)
+            return
+        end
+
+        callback(true)
+    end)
 end
 
 function M.run(model)
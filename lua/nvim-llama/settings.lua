@@ -8,6 +8,20 @@ local defaults = {
 
     -- the model to use with Ollama.
     model = 'llama2',
+
+    -- URL of the nvim-llama backend, for codebase-aware chat
+    backend_url = 'http://localhost:8000',
+
+    -- Name and root of the project indexed and chatted about. Default to
+    -- the current directory and its name.
+    project_name = nil,
+    project_path = nil,
+
+    -- Milliseconds between checks of a running indexing job
+    index_poll_interval = 2000,
+
+    -- Send modified buffers with chat questions, so answers see unsaved edits
+    send_unsaved_buffers = true,
 }
 
 M.current = defaults